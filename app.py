@@ -1,251 +1,1124 @@
-from flask import Flask, render_template_string, request, jsonify, redirect, url_for, session
+from flask import Flask, Response, g, has_request_context, render_template_string, request, jsonify, redirect, send_from_directory, url_for, session
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
+import bisect
+import cProfile
+import heapq
 import json
+import math
 import os
-import sqlite3
-from datetime import datetime
+import pstats
+import re
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from functools import wraps
+from itsdangerous import BadData, URLSafeTimedSerializer
+from itertools import islice
 import uuid
 import base64
+import hashlib
+import hmac
+
+from migrate import migrate_db, pending_migrations, schema_version
+from storage import ReadRouter, open_storage, set_tracer
+
+try:
+    import orjson
+except ImportError:  # optional fast encoder, stdlib json is used otherwise
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks on Windows
+    fcntl = None
+
+# Secret key
+# Signs the session cookie and the API tokens, which carry the user's role and
+# region (see Access control), so it must not be known outside the
+# deployment. Set MADARES_SECRET_KEY; without it a random key is generated
+# once and kept in MADARES_SECRET_KEY_FILE, readable by this user only, and
+# shared by the workers of one machine. Serverless instances (Vercel) don't
+# share files and refuse to start without the variable.
+SECRET_KEY_FILE = os.environ.get('MADARES_SECRET_KEY_FILE', '/tmp/madares-secret-key')
+
+def load_secret_key():
+    key = os.environ.get('MADARES_SECRET_KEY')
+    if key:
+        return key
+    if os.environ.get('VERCEL'):
+        raise RuntimeError('MADARES_SECRET_KEY is not set')
+    if not os.path.exists(SECRET_KEY_FILE):
+        # Written to a temporary file and linked into place, so a concurrent
+        # starter either wins or reads the complete key of the winner
+        fd, path = tempfile.mkstemp(dir=os.path.dirname(SECRET_KEY_FILE) or '.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            os.link(path, SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(path)
+    with open(SECRET_KEY_FILE) as f:
+        return f.read().strip()
 
 app = Flask(__name__)
-app.secret_key = 'madares_secret_key_2025'
+app.secret_key = load_secret_key()
 CORS(app)
 
-# Database initialization
-def init_db():
-    conn = sqlite3.connect('/tmp/madares.db')
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            full_name TEXT NOT NULL,
-            email TEXT NOT NULL,
-            role TEXT NOT NULL,
-            department TEXT NOT NULL,
-            region TEXT NOT NULL,
-            status TEXT DEFAULT 'نشط',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+# Reverse proxies
+# Behind MADARES_PROXY_HOPS proxies (a load balancer, Vercel's edge) the
+# client address and scheme are taken from the X-Forwarded-For and
+# X-Forwarded-Proto entries those proxies appended; rate limits key anonymous
+# clients by that address. Without proxies (0) the headers are ignored, any
+# client can send them.
+PROXY_HOPS = int(os.environ.get('MADARES_PROXY_HOPS', 0))
+
+def behind_proxies(wsgi_app, hops):
+    if hops <= 0:
+        return wsgi_app
+    return ProxyFix(wsgi_app, x_for=hops, x_proto=hops)
+
+app.wsgi_app = behind_proxies(app.wsgi_app, PROXY_HOPS)
+
+# JSON serialization
+# json_dumps/json_loads follow the orjson interface (bytes out) and fall back to
+# the stdlib encoder when orjson is not installed.
+if orjson is not None:
+    def json_dumps(obj):
+        return orjson.dumps(obj, default=str)
+
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+    json_loads = json.loads
+
+STREAM_BATCH_SIZE = 500
+
+def row_factory(cursor, exclude=(), lang=None):
+    # Resolve the column list once per query and return a row -> dict converter.
+    # Lookup id columns (see LOOKUP_COLUMNS) come out as labels.
+    columns = [description[0] for description in cursor.description]
+    coded = [(i, CODED_COLUMNS[name]) for i, name in enumerate(columns) if name in CODED_COLUMNS]
+    if not exclude and not coded:
+        return lambda row: dict(zip(columns, row))
+    keep = [(i, name) for i, name in enumerate(columns) if name not in exclude and name not in CODED_COLUMNS]
+    if not coded:
+        return lambda row: {name: row[i] for i, name in keep}
+    lang = lang or request_lang()
+
+    def make_row(row):
+        item = {name: row[i] for i, name in keep}
+        for i, name in coded:
+            item[name] = lookups.label(row[i], lang)
+        return item
+    return make_row
+
+def json_response(obj, status=200):
+    return Response(json_dumps(obj), status=status, mimetype='application/json')
+
+def stream_json_array(conn, cursor, exclude=(), batch_size=STREAM_BATCH_SIZE):
+    # Encode rows straight from the cursor in batches so large listings never
+    # hold the full result set (or its JSON) in memory. The connection is
+    # closed once the response has been sent or the client goes away.
+    lang = request_lang()
+
+    def generate():
+        try:
+            yield b'['
+            separator = b''
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if not separator:
+                    # Server-side cursors only describe their columns after
+                    # the first fetch
+                    make_row = row_factory(cursor, exclude, lang)
+                # Encode a whole batch at once and drop the surrounding brackets
+                yield separator + json_dumps([make_row(row) for row in rows])[1:-1]
+                separator = b','
+            yield b']'
+        finally:
+            conn.close()
+
+    return Response(generate(), mimetype='application/json')
+
+# Response caching
+# Read endpoints are cached by route + query string. Every key also embeds a
+# generation counter per table the endpoint reads from, and write handlers bump
+# the counter of the table they touch, so stale entries are never served again
+# and simply age out of the LRU.
+CACHE_TTL = int(os.environ.get('MADARES_CACHE_TTL', 60))
+CACHE_MAX_ENTRIES = int(os.environ.get('MADARES_CACHE_MAX_ENTRIES', 256))
+CACHE_MAX_ENTRY_BYTES = int(os.environ.get('MADARES_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024))
+
+class MemoryCacheBackend:
+    # In-process LRU with a TTL per entry. Generation counters are kept apart
+    # from the entries so that eviction can never reset them.
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self, name):
+        with self._lock:
+            return self._generations.get(name, 0)
+
+    def incr(self, name):
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+            return self._generations[name]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+class RedisCacheBackend:
+    # Shared backend so that every worker sees the same entries and
+    # invalidations. Needs the optional redis package.
+    def __init__(self, url, prefix='madares:cache:'):
+        import redis
+        self.prefix = prefix
+        self.evictions = 0
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self._client.set(self.prefix + key, value, ex=ttl)
+
+    def generation(self, name):
+        return int(self._client.get(self.prefix + 'gen:' + name) or 0)
+
+    def incr(self, name):
+        return self._client.incr(self.prefix + 'gen:' + name)
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            if not key.decode().startswith(self.prefix + 'gen:'):
+                self._client.delete(key)
+
+    def size(self):
+        return None
+
+class ResponseCache:
+    def __init__(self, backend, ttl=CACHE_TTL, max_entry_bytes=CACHE_MAX_ENTRY_BYTES):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def key(self, path, tables, versions=None):
+        # Prefer the database version stamps (already looked up for the ETag),
+        # they are shared by every worker process
+        if versions:
+            stamps = ','.join('%s:v%d' % (table, versions[table][0]) for table in tables if table in versions)
+        else:
+            stamps = ','.join('%s:%d' % (table, self.backend.generation(table)) for table in tables)
+        return '%s|%s' % (path, stamps)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def store(self, key, chunks):
+        # Pass the response body through untouched while keeping a copy, so
+        # streamed listings stay streamed. Bodies over the size limit are not
+        # cached.
+        buffer = []
+        size = 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                if buffer is not None:
+                    size += len(chunk)
+                    if size > self.max_entry_bytes:
+                        buffer = None
+                    else:
+                        buffer.append(chunk)
+                yield chunk
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        if buffer is not None:
+            self.backend.set(key, b''.join(buffer), self.ttl)
+            self.stores += 1
+
+    def invalidate(self, *tables):
+        for table in tables:
+            self.backend.incr(table)
+        self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'ttl': self.ttl,
+            'entries': self.backend.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+            'stores': self.stores,
+            'invalidations': self.invalidations,
+            'evictions': self.backend.evictions
+        }
+
+if os.environ.get('MADARES_CACHE_URL'):
+    response_cache = ResponseCache(RedisCacheBackend(os.environ['MADARES_CACHE_URL']))
+else:
+    response_cache = ResponseCache(MemoryCacheBackend())
+
+CACHE_ENABLED = os.environ.get('MADARES_CACHE', '1') != '0'
+
+def cached(*tables):
+    # Cache successful responses of a read endpoint that depends on `tables`
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not CACHE_ENABLED:
+                return view(*args, **kwargs)
+            key = response_cache.key(request.full_path + scope_key(), tables, g.get('table_versions'))
+            body = response_cache.get(key)
+            if body is not None:
+                return Response(body, mimetype='application/json')
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.response = response_cache.store(key, response.response)
+            return response
+        return wrapper
+    return decorator
+
+# Conditional GET
+def get_table_versions(tables):
+    conn = get_read_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT table_name, version, updated_at FROM table_versions WHERE table_name IN ({', '.join('?' * len(tables))})",
+            tables
         )
-    ''')
-    
-    # Assets table with all 79 MOE fields
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS assets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            -- Asset Identification (6 fields)
-            asset_name TEXT NOT NULL,
-            asset_type TEXT NOT NULL,
-            asset_category TEXT,
-            asset_status TEXT DEFAULT 'نشط',
-            unique_id TEXT,
-            creation_date DATE,
-            
-            -- Planning Assessment (4 fields)
-            need_assessment TEXT,
-            development_plan TEXT,
-            expected_timeline TEXT,
-            planning_phase TEXT,
-            
-            -- Location Attractiveness (3 fields)
-            location_rating TEXT,
-            nearby_facilities TEXT,
-            accessibility TEXT,
-            
-            -- Investment Proposal (3 fields)
-            investment_proposal TEXT,
-            potential_obstacles TEXT,
-            expected_return TEXT,
-            
-            -- Financial Obligations (3 fields)
-            total_cost REAL,
-            required_funding REAL,
-            funding_source TEXT,
-            
-            -- Utilities Information (4 fields)
-            electricity_status TEXT,
-            water_status TEXT,
-            sewage_status TEXT,
-            telecom_status TEXT,
-            
-            -- Ownership Information (4 fields)
-            ownership_type TEXT,
-            owner_name TEXT,
-            ownership_documents TEXT,
-            legal_status TEXT,
-            
-            -- Land Details (3 fields)
-            land_area REAL,
-            land_type TEXT,
-            zoning_classification TEXT,
-            
-            -- Asset Areas (5 fields)
-            built_area REAL,
-            usable_area REAL,
-            common_area REAL,
-            parking_area REAL,
-            green_area REAL,
-            
-            -- Construction Status (4 fields)
-            construction_status TEXT,
-            completion_percentage REAL,
-            construction_start_date DATE,
-            expected_completion_date DATE,
+        return {name: (version, updated_at) for name, version, updated_at in cursor.fetchall()}
+    finally:
+        conn.close()
+
+def conditional(*tables):
+    # Tag responses with an ETag built from the version stamps of `tables`,
+    # the view arguments and the query string (?include=, ?lang=, ?as_of=...
+    # change the body) and answer a matching If-None-Match with 304 before
+    # running the query
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                versions = get_table_versions(tables)
+            except storage.Error:
+                return view(*args, **kwargs)
+            g.table_versions = versions
+            parts = ['%s.%d' % (table, versions.get(table, (0, None))[0]) for table in tables]
+            parts.extend(str(value) for value in kwargs.values())
+            if request.args:
+                # Sorted, so the parameter order doesn't matter
+                query = repr(sorted(request.args.items(multi=True)))
+                parts.append('q' + hashlib.sha1(query.encode('utf-8')).hexdigest()[:12])
+            scope = scope_key()
+            if scope:
+                parts.append(scope)
+            etag = '-'.join(parts)
             
-            -- Physical Dimensions (4 fields)
-            length_meters REAL,
-            width_meters REAL,
-            height_meters REAL,
-            floors_count INTEGER,
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
             
-            -- Boundaries (8 fields)
-            north_boundary TEXT,
-            south_boundary TEXT,
-            east_boundary TEXT,
-            west_boundary TEXT,
-            boundary_length_north REAL,
-            boundary_length_south REAL,
-            boundary_length_east REAL,
-            boundary_length_west REAL,
+            response.set_etag(etag, weak=True)
+            modified = [updated_at for version, updated_at in versions.values() if updated_at]
+            if modified:
+                # SQLite returns timestamps as text, PostgreSQL as datetime
+                modified = max(modified)
+                response.last_modified = datetime.strptime(modified, '%Y-%m-%d %H:%M:%S') if isinstance(modified, str) else modified
+            # Let browsers keep the body but revalidate it on every use
+            response.cache_control.no_cache = True
+            if scope:
+                response.vary.update(('Authorization', 'Cookie'))
+            return response
+        return wrapper
+    return decorator
+
+# Metrics
+# Every request records its latency (until the response is handed to the
+# server), status, response size and the number and total time of the SQL
+# statements it ran, per route template. Statements are timed by the
+# storage tracer (storage.set_tracer), those slower than SLOW_QUERY_MS are
+# logged with their query plan, each distinct statement at most once per
+# SLOW_QUERY_LOG_INTERVAL seconds, and the EXPLAIN runs on its own thread.
+# /metrics serves everything in the Prometheus text format; the numbers are
+# per worker process, like the response cache. It needs system read access
+# (see Access control) or MADARES_METRICS_TOKEN as bearer token, which is
+# what a scraper sends.
+METRICS_ENABLED = os.environ.get('MADARES_METRICS', '1') != '0'
+METRICS_TOKEN = os.environ.get('MADARES_METRICS_TOKEN')
+SLOW_QUERY_MS = float(os.environ.get('MADARES_SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG_INTERVAL = 60
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='explain')
+
+def prometheus_labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in labels.items())
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = []
+        total = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            total += count
+            lines.append('%s_bucket%s %d' % (name, prometheus_labels(**labels, le=bound), total))
+        lines.append('%s_sum%s %s' % (name, prometheus_labels(**labels), repr(round(self.sum, 6))))
+        lines.append('%s_count%s %d' % (name, prometheus_labels(**labels), total))
+        return lines
+
+class RequestMetrics:
+    def __init__(self):
+        self.requests = {}        # (route, method, status) -> count
+        self.latency = {}         # (route, method) -> Histogram of seconds
+        self.sql_per_request = {} # route -> Histogram of statement counts
+        self.sql_statements = {}  # route -> statements
+        self.sql_seconds = {}     # route -> seconds
+        self.response_bytes = {}  # route -> bytes
+        self.slow_queries = 0
+        self._slow_logged = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, status, seconds, statements, sql_seconds):
+        with self._lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if (route, method) not in self.latency:
+                self.latency[(route, method)] = Histogram(LATENCY_BUCKETS)
+            self.latency[(route, method)].observe(seconds)
+            if route not in self.sql_per_request:
+                self.sql_per_request[route] = Histogram(SQL_COUNT_BUCKETS)
+            self.sql_per_request[route].observe(statements)
+            self.sql_statements[route] = self.sql_statements.get(route, 0) + statements
+            self.sql_seconds[route] = self.sql_seconds.get(route, 0.0) + sql_seconds
+
+    def add_bytes(self, route, size):
+        with self._lock:
+            self.response_bytes[route] = self.response_bytes.get(route, 0) + size
+
+    def slow_query(self, storage, sql, params, seconds):
+        now = time.monotonic()
+        with self._lock:
+            self.slow_queries += 1
+            if now - self._slow_logged.get(sql, -SLOW_QUERY_LOG_INTERVAL) < SLOW_QUERY_LOG_INTERVAL:
+                return
+            self._slow_logged[sql] = now
+            if len(self._slow_logged) > 1000:
+                self._slow_logged = {sql: now}
+        route = request.url_rule.rule if has_request_context() and request.url_rule else None
+        explain_executor.submit(log_slow_query, storage, sql, params, seconds, route)
+
+    def render(self):
+        with self._lock:
+            lines = ['# HELP madares_http_requests_total Requests handled',
+                     '# TYPE madares_http_requests_total counter']
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append('madares_http_requests_total%s %d' % (prometheus_labels(route=route, method=method, status=status), count))
+            lines += ['# HELP madares_http_request_duration_seconds Time until the response is returned',
+                      '# TYPE madares_http_request_duration_seconds histogram']
+            for (route, method), histogram in sorted(self.latency.items()):
+                lines += histogram.render('madares_http_request_duration_seconds', {'route': route, 'method': method})
+            lines += ['# HELP madares_http_request_sql_statements SQL statements per request',
+                      '# TYPE madares_http_request_sql_statements histogram']
+            for route, histogram in sorted(self.sql_per_request.items()):
+                lines += histogram.render('madares_http_request_sql_statements', {'route': route})
+            for name, help_text, values in (
+                    ('madares_sql_statements_total', 'SQL statements run by requests', self.sql_statements),
+                    ('madares_sql_seconds_total', 'Time spent in SQL statements by requests', self.sql_seconds),
+                    ('madares_http_response_bytes_total', 'Response body bytes sent', self.response_bytes)):
+                lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s counter' % name]
+                for route, value in sorted(values.items()):
+                    lines.append('%s%s %s' % (name, prometheus_labels(route=route), repr(round(value, 6))))
+            lines += ['# HELP madares_slow_queries_total Statements slower than the slow query threshold',
+                      '# TYPE madares_slow_queries_total counter',
+                      'madares_slow_queries_total %d' % self.slow_queries]
+        lines += ['# HELP madares_requests_shed_total Requests rejected by rate or concurrency limits',
+                  '# TYPE madares_requests_shed_total counter']
+        for endpoint, counts in sorted(admission.stats()['shed'].items()):
+            for reason, count in sorted(counts.items()):
+                lines.append('madares_requests_shed_total%s %d' % (prometheus_labels(endpoint=endpoint, reason=reason), count))
+        cache = response_cache.stats()
+        lines += ['# HELP madares_cache_lookups_total Response cache lookups',
+                  '# TYPE madares_cache_lookups_total counter',
+                  'madares_cache_lookups_total%s %d' % (prometheus_labels(result='hit'), cache['hits']),
+                  'madares_cache_lookups_total%s %d' % (prometheus_labels(result='miss'), cache['misses'])]
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+def log_slow_query(storage, sql, params, seconds, route):
+    # On the explain thread: the plan comes from a connection of its own,
+    # run outside the tracer
+    plan = None
+    if sql.split(None, 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+        if params and isinstance(params, (list, tuple)) and isinstance(params[0], (list, tuple)):
+            params = params[0]  # executemany: the first parameter set
+        try:
+            conn = storage.connect()
+            try:
+                raw = conn.raw.cursor()
+                prefix = 'EXPLAIN QUERY PLAN ' if storage.dialect == 'sqlite' else 'EXPLAIN '
+                raw.execute(*storage.prepare(prefix + sql, params))
+                plan = [str(row[-1]) for row in raw.fetchall()]
+            finally:
+                conn.close()
+        except Exception as e:
+            plan = ['EXPLAIN failed: %s' % e]
+    app.logger.warning('Slow query (%.0f ms, %s): %s\n  plan: %s', seconds * 1000, route or 'background',
+                       ' '.join(sql.split()), '\n        '.join(plan) if plan else 'n/a')
+
+def trace_statement(storage, sql, params, seconds):
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + seconds
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        request_metrics.slow_query(storage, sql, params, seconds)
+
+if METRICS_ENABLED:
+    set_tracer(trace_statement)
+
+def count_bytes(route, chunks):
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        request_metrics.add_bytes(route, size)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if not METRICS_ENABLED or started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_metrics.observe(route, request.method, response.status_code, time.perf_counter() - started,
+                            g.get('sql_statements', 0), g.get('sql_seconds', 0.0))
+    if response.is_streamed:
+        response.response = count_bytes(route, response.response)
+    elif not response.direct_passthrough:
+        request_metrics.add_bytes(route, response.calculate_content_length() or 0)
+    return response
+
+def scraper_authorized():
+    auth = request.authorization
+    return (bool(METRICS_TOKEN) and auth is not None and auth.type == 'bearer'
+            and hmac.compare_digest(auth.token or '', METRICS_TOKEN))
+
+@app.route('/metrics')
+def metrics():
+    return Response(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Rate limiting
+# Every client has a token bucket of RATE_LIMIT requests per second that
+# refills continuously and holds up to RATE_BURST; routes in
+# ROUTE_RATE_LIMITS get an additional, tighter bucket per client. Clients
+# are the user of verified credentials, else the client address (see Reverse
+# proxies). Buckets live in-process by default, MADARES_RATE_LIMIT_URL
+# (redis://...) shares them between workers. Expensive routes in
+# CONCURRENCY_LIMITS also cap how many requests run at once per worker.
+# Requests over a limit get 429 with Retry-After and are counted per route
+# and reason at /api/limits/stats.
+RATE_LIMIT = float(os.environ.get('MADARES_RATE_LIMIT', 20))
+RATE_BURST = int(os.environ.get('MADARES_RATE_BURST', 60))
+RATE_LIMIT_MAX_CLIENTS = 10000
+
+def parse_limits(value, defaults, parse):
+    # 'endpoint=value,...' from the environment on top of the defaults
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        endpoint, _, limit = item.partition('=')
+        limits[endpoint.strip()] = parse(limit.strip())
+    return limits
+
+def parse_rate(value):
+    # 'rate/burst', e.g. '0.5/5': one request every 2 seconds, 5 at once
+    rate, _, burst = value.partition('/')
+    return float(rate), int(burst or max(float(rate), 1))
+
+# endpoint -> (requests per second, burst) per client
+ROUTE_RATE_LIMITS = parse_limits(os.environ.get('MADARES_ROUTE_RATE_LIMITS'), {
+    'auth_login': (0.2, 5),
+    'auth_token': (0.2, 5),
+    'upload_document': (0.5, 5),
+}, parse_rate)
+# endpoint -> requests running at once per worker
+CONCURRENCY_LIMITS = parse_limits(os.environ.get('MADARES_CONCURRENCY_LIMITS'), {
+    'upload_document': 4,
+    'sync': 4,
+    'bulk_add_workflows': 2,
+    'bulk_reassign_workflows': 2,
+    'bulk_transition_workflows': 2,
+    'get_workflow_reports': 4,
+}, int)
+
+class MemoryRateLimitBackend:
+    # key -> (tokens, updated at). Full buckets carry no information, they
+    # are dropped first when the table grows past max_keys.
+    def __init__(self, max_keys=RATE_LIMIT_MAX_CLIENTS):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        # Seconds until a token is available, 0 when one was taken
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                if len(self._buckets) > self.max_keys:
+                    self._prune(now, rate, burst)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def _prune(self, now, rate, burst):
+        for key in [key for key, (tokens, updated) in self._buckets.items()
+                    if tokens + (now - updated) * rate >= burst]:
+            del self._buckets[key]
+        while len(self._buckets) > self.max_keys:
+            del self._buckets[next(iter(self._buckets))]
+
+    def size(self):
+        return len(self._buckets)
+
+class RedisRateLimitBackend:
+    # Shared buckets, updated atomically by a Lua script. Needs the optional
+    # redis package.
+    SCRIPT = '''
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(now - updated, 0) * rate)
+        local wait = 0
+        if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    '''
+
+    def __init__(self, url, prefix='madares:ratelimit:'):
+        import redis
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst):
+        return float(self._take(keys=[self.prefix + key], args=[rate, burst, time.time()]))
+
+    def size(self):
+        return None
+
+class AdmissionControl:
+    def __init__(self, backend):
+        self.backend = backend
+        self.admitted = 0
+        self.shed = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def reject(self, endpoint, reason, retry_after):
+        with self._lock:
+            counts = self.shed.setdefault(endpoint, {})
+            counts[reason] = counts.get(reason, 0) + 1
+        response = jsonify({'error': 'Too many requests, retry in %d s' % retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    def enter(self, endpoint):
+        # Claim a slot of a concurrency limited endpoint, False when all are taken
+        with self._lock:
+            running = self._in_flight.get(endpoint, 0)
+            if running >= CONCURRENCY_LIMITS[endpoint]:
+                return False
+            self._in_flight[endpoint] = running + 1
+            return True
+
+    def leave(self, endpoint):
+        with self._lock:
+            self._in_flight[endpoint] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': type(self.backend).__name__,
+                'rate': RATE_LIMIT,
+                'burst': RATE_BURST,
+                'clients': self.backend.size(),
+                'admitted': self.admitted,
+                'shed': {endpoint: dict(counts) for endpoint, counts in self.shed.items()},
+                'shed_total': sum(sum(counts.values()) for counts in self.shed.values()),
+                'in_flight': dict(self._in_flight),
+                'concurrency_limits': CONCURRENCY_LIMITS
+            }
+
+if os.environ.get('MADARES_RATE_LIMIT_URL'):
+    admission = AdmissionControl(RedisRateLimitBackend(os.environ['MADARES_RATE_LIMIT_URL']))
+else:
+    admission = AdmissionControl(MemoryRateLimitBackend())
+
+def client_key():
+    # A user only counts once the credentials are known to be valid: the
+    # signed session or bearer token, or Basic credentials already in the
+    # credential cache (checking new ones would mean hashing). Everything
+    # else is charged to the remote address, so made-up Authorization
+    # headers don't buy fresh buckets.
+    if session.get('user_id') is not None:
+        return 'user:%s' % session['user_id']
+    auth = request.authorization
+    user = None
+    if auth is not None and auth.type == 'bearer':
+        user = load_token(auth.token)
+    elif auth is not None and auth.type == 'basic' and auth.username:
+        user = credential_cache.get(credential_cache.key(auth.username, auth.password or ''))
+    if user is not None:
+        return 'user:%s' % user['id']
+    return 'ip:%s' % request.remote_addr
+
+@app.before_request
+def admit_request():
+    # Runs before authentication, so shed requests cost no password hashing
+    endpoint = request.endpoint
+    if endpoint is None or endpoint == 'static':
+        return None
+    client = client_key()
+    if RATE_LIMIT > 0:
+        wait = admission.backend.take(client, RATE_LIMIT, RATE_BURST)
+        if wait:
+            return admission.reject(endpoint, 'rate', math.ceil(wait))
+    if endpoint in ROUTE_RATE_LIMITS:
+        rate, burst = ROUTE_RATE_LIMITS[endpoint]
+        wait = admission.backend.take('%s|%s' % (client, endpoint), rate, burst)
+        if wait:
+            return admission.reject(endpoint, 'route', math.ceil(wait))
+    if endpoint in CONCURRENCY_LIMITS:
+        if not admission.enter(endpoint):
+            return admission.reject(endpoint, 'concurrency', 1)
+        g.admitted_endpoint = endpoint
+    admission.admitted += 1
+    return None
+
+@app.teardown_request
+def release_request(exc=None):
+    endpoint = g.pop('admitted_endpoint', None)
+    if endpoint is not None:
+        admission.leave(endpoint)
+
+# Change events
+# Write handlers publish (entity, id, operation) events into one shared ring
+# buffer. Each event is encoded once and every connected SSE client reads the
+# same buffer, so fan-out costs no per-client queues and no database polling.
+SSE_HEARTBEAT_SECONDS = int(os.environ.get('MADARES_SSE_HEARTBEAT', 15))
+EVENT_HISTORY = int(os.environ.get('MADARES_EVENT_HISTORY', 1000))
+
+def encode_event(event_id, event):
+    return b'id: %d\nevent: change\ndata: %s\n\n' % (event_id, json_dumps(event))
+
+class EventBroker:
+    def __init__(self, history=EVENT_HISTORY):
+        self.published = 0
+        self.subscribers = 0
+        self._events = deque(maxlen=history)
+        self._last_id = 0
+        self._condition = threading.Condition()
+        self._listeners = []
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, entity, entity_id, operation, **extra):
+        event = dict(extra, entity=entity, id=entity_id, operation=operation, at=datetime.utcnow().isoformat() + 'Z')
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, encode_event(self._last_id, event), event))
+            self.published += 1
+            self._condition.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def add_listener(self, callback):
+        # Extra wake-up hook, used by the asyncio event loop in asgi.py
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def since(self, last_id):
+        # Non-blocking variant of wait()
+        with self._condition:
+            if last_id > self._last_id:
+                last_id = self._last_id
+            return self._since(last_id)
+
+    def subscribe(self):
+        with self._condition:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self._condition:
+            self.subscribers -= 1
+
+    def _since(self, last_id):
+        if not self._events or last_id >= self._last_id:
+            return []
+        start = max(0, last_id - self._events[0][0] + 1)
+        return list(islice(self._events, start, None))
+
+    def wait(self, last_id, timeout):
+        # Events newer than last_id, blocking up to `timeout` seconds for one
+        with self._condition:
+            if last_id > self._last_id:
+                # Client saw ids from before a restart, resume from now
+                last_id = self._last_id
+            events = self._since(last_id)
+            if not events:
+                self._condition.wait(timeout)
+                events = self._since(last_id)
+            return events
+
+event_broker = EventBroker()
+
+# Worker processes don't share the broker. With several workers (see
+# gunicorn.conf.py) each one tails change_log instead, one query per interval
+# while it has SSE clients, and publishes to its own subscribers.
+EVENT_RELAY = os.environ.get('MADARES_EVENT_RELAY') == '1'
+EVENT_RELAY_INTERVAL = float(os.environ.get('MADARES_EVENT_RELAY_INTERVAL', 0.5))
+EVENT_AGGREGATE_MIN = 10
+_event_relay_lock = threading.Lock()
+_event_relay_thread = None
+
+def relay_change_log():
+    last_seq = None
+    while True:
+        time.sleep(EVENT_RELAY_INTERVAL)
+        if not event_broker.subscribers:
+            last_seq = None
+            continue
+        try:
+            conn = get_db()
+            cursor = conn.cursor()
+            if last_seq is None:
+                cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log')
+                last_seq = cursor.fetchone()[0]
+                conn.close()
+                continue
             
-            -- Geographic Location (7 fields)
-            latitude REAL,
-            longitude REAL,
-            region TEXT,
-            city TEXT,
-            district TEXT,
-            street_name TEXT,
-            building_number TEXT,
+            cursor.execute(
+                'SELECT seq, table_name, row_id, operation FROM change_log WHERE seq > ? ORDER BY seq',
+                (last_seq,)
+            )
+            changes = cursor.fetchall()
             
-            -- Financial & Additional (21+ fields)
-            current_value REAL,
-            market_value REAL,
-            rental_income REAL,
-            operating_expenses REAL,
-            net_income REAL,
-            roi_percentage REAL,
-            appreciation_rate REAL,
-            property_tax REAL,
-            insurance_cost REAL,
-            maintenance_cost REAL,
-            management_fee REAL,
-            vacancy_rate REAL,
-            cap_rate REAL,
-            debt_service REAL,
-            cash_flow REAL,
-            irr_percentage REAL,
-            npv_value REAL,
-            payback_period REAL,
-            risk_assessment TEXT,
-            market_conditions TEXT,
-            future_prospects TEXT,
+            statuses = {}
+            doc_ids = sorted({row_id for seq, table, row_id, operation in changes if table == 'documents'})
+            if doc_ids:
+                cursor.execute(
+                    f"SELECT id, processing_status FROM documents WHERE id IN ({', '.join('?' * len(doc_ids))})",
+                    doc_ids
+                )
+                statuses = dict(cursor.fetchall())
+            conn.close()
             
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Workflows table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS workflows (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            status TEXT DEFAULT 'معلقة',
-            priority TEXT DEFAULT 'متوسطة',
-            assignee_id INTEGER,
-            assigned_to TEXT,
-            due_date DATE,
-            progress INTEGER DEFAULT 0,
-            asset_id INTEGER,
-            created_by INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (assignee_id) REFERENCES users (id),
-            FOREIGN KEY (asset_id) REFERENCES assets (id),
-            FOREIGN KEY (created_by) REFERENCES users (id)
-        )
-    ''')
-    
-    # Documents table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            original_filename TEXT NOT NULL,
-            document_type TEXT NOT NULL,
-            asset_id INTEGER,
-            file_size INTEGER,
-            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            uploaded_by INTEGER,
-            ocr_text TEXT,
-            processing_status TEXT DEFAULT 'معلق',
-            file_path TEXT,
-            FOREIGN KEY (asset_id) REFERENCES assets (id),
-            FOREIGN KEY (uploaded_by) REFERENCES users (id)
-        )
-    ''')
+            # Bulk writes become one event per table and operation
+            groups = OrderedDict()
+            for seq, table, row_id, operation in changes:
+                groups.setdefault((table, operation), []).append(row_id)
+            for (table, operation), row_ids in groups.items():
+                if len(row_ids) >= EVENT_AGGREGATE_MIN:
+                    event_broker.publish(table, None, operation, ids=row_ids)
+                    continue
+                for row_id in row_ids:
+                    extra = {'processing_status': statuses[row_id]} if row_id in statuses and table == 'documents' else {}
+                    event_broker.publish(table, row_id, operation, **extra)
+            if changes:
+                last_seq = changes[-1][0]
+        except Exception:
+            app.logger.exception('Relaying change events failed')
+
+def start_event_relay():
+    global _event_relay_thread
+    with _event_relay_lock:
+        if _event_relay_thread is None:
+            _event_relay_thread = threading.Thread(target=relay_change_log, name='event-relay', daemon=True)
+            _event_relay_thread.start()
+
+def record_change(table, row_id, operation, **extra):
+    # Called by write handlers after commit
+    response_cache.invalidate(table)
+    if not EVENT_RELAY:
+        event_broker.publish(table, row_id, operation, **extra)
+
+# Password hashing
+# Passwords are stored as salted scrypt hashes, 'scrypt$n$r$p$salt$hash'
+# (migrations/0009_password_hashes.py converted the plaintext ones).
+SCRYPT_N = int(os.environ.get('MADARES_SCRYPT_N', 2 ** 14))
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+def hash_password(password, n=None):
+    n = n or SCRYPT_N
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=SCRYPT_R, p=SCRYPT_P,
+                            maxmem=256 * n * SCRYPT_R, dklen=32)
+    return 'scrypt$%d$%d$%d$%s$%s' % (n, SCRYPT_R, SCRYPT_P, base64.b64encode(salt).decode(),
+                                      base64.b64encode(digest).decode())
+
+def verify_password(stored, password):
+    try:
+        scheme, n, r, p, salt, digest = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+    except (AttributeError, ValueError):
+        return False
+    if scheme != 'scrypt':
+        return False
+    expected = base64.b64decode(digest)
+    actual = hashlib.scrypt(password.encode('utf-8'), salt=base64.b64decode(salt), n=n, r=r, p=p,
+                            maxmem=256 * n * r, dklen=len(expected))
+    return hmac.compare_digest(actual, expected)
+
+def needs_rehash(stored):
+    return not stored.startswith('scrypt$%d$%d$%d$' % (SCRYPT_N, SCRYPT_R, SCRYPT_P))
+
+# Database initialization
+# The schema lives in ordered files in migrations/ (see migrate.py) and the
+# applied version is tracked in PRAGMA user_version, so a warm start costs a
+# single version check instead of re-running every CREATE statement.
+# SQLite by default, PostgreSQL when MADARES_DATABASE_URL points at one (see
+# storage.py); get_db() hands out pooled connections either way.
+DB_PATH = os.environ.get('MADARES_DB', '/tmp/madares.db')
+DATABASE_URL = os.environ.get('MADARES_DATABASE_URL')
+AUTO_MIGRATE = os.environ.get('MADARES_AUTO_MIGRATE', '1') != '0'
+VERSIONED_TABLES = ('users', 'assets', 'workflows', 'documents')
+CHANGE_LOG_RETENTION_DAYS = int(os.environ.get('MADARES_CHANGE_LOG_RETENTION_DAYS', 30))
+
+storage = open_storage(DATABASE_URL, sqlite_path=DB_PATH)
+
+# Read replicas: comma-separated URLs, e.g. postgresql://... standbys, or
+# sqlite:///path for read-only connections to the WAL file. Read-only
+# endpoints use get_read_db(), everything else stays on the primary.
+DATABASE_REPLICAS = [url.strip() for url in os.environ.get('MADARES_DATABASE_REPLICAS', '').split(',') if url.strip()]
+read_router = ReadRouter(storage, [open_storage(url, sqlite_path=DB_PATH, readonly=True) for url in DATABASE_REPLICAS])
+
+def get_db():
+    return storage.connect()
+
+def get_read_db():
+    # All reads of one request go to the same database, so an ETag and the
+    # body it tags come from one replica. Clients that just wrote are only
+    # sent to replicas that have caught up with that write.
+    if not read_router.replicas or not has_request_context():
+        return get_db()
+    if 'read_storage' not in g:
+        wrote_at = session.get('wrote_at')
+        g.read_storage = read_router.choose(time.time() - wrote_at if wrote_at else None)
+    return g.read_storage.connect()
+
+@app.after_request
+def remember_write(response):
+    if read_router.replicas and request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+        session['wrote_at'] = time.time()
+    return response
+
+def init_db():
+    conn = get_db()
+    try:
+        if AUTO_MIGRATE:
+            previous = migrate_db(conn, progress=app.logger.info)
+        else:
+            previous = schema_version(conn)
+            if pending_migrations(conn):
+                app.logger.warning('Database schema is behind, run: python migrate.py up')
+        # Fresh databases (e.g. the ephemeral /tmp on Vercel) can be seeded
+        # automatically, everything else uses the seed-db command
+        if previous == 0 and os.environ.get('MADARES_AUTO_SEED') == '1':
+            seed_db(conn)
+    finally:
+        conn.close()
+        # Don't keep the connection open in a preloading master process
+        storage.close_all()
+        for replica in read_router.replicas:
+            replica.close_all()
+
+def seed_db(conn):
+    cursor = conn.cursor()
+    # Enumerated values are stored as lookup ids, see LOOKUP_COLUMNS
     
     # Insert default admin user
     cursor.execute('''
-        INSERT OR IGNORE INTO users (username, password, full_name, email, role, department, region)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', ('admin', 'password123', 'مدير النظام', 'admin@madares.sa', 'مدير', 'الإدارة العامة', 'الرياض'))
+        INSERT INTO users (username, password, full_name, email, role_id, department, region)
+        VALUES (?, ?, ?, ?, (SELECT id FROM lookups WHERE kind = 'user_role' AND label = ?), ?, ?) ON CONFLICT DO NOTHING
+    ''', ('admin', hash_password('password123'), 'مدير النظام', 'admin@madares.sa', 'مدير', 'الإدارة العامة', 'الرياض'))
     
     # Insert sample users
     cursor.execute('''
-        INSERT OR IGNORE INTO users (username, password, full_name, email, role, department, region)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', ('ahmed.m', 'password123', 'أحمد محمد', 'ahmed@madares.sa', 'محلل أصول', 'إدارة الأصول', 'الرياض'))
+        INSERT INTO users (username, password, full_name, email, role_id, department, region)
+        VALUES (?, ?, ?, ?, (SELECT id FROM lookups WHERE kind = 'user_role' AND label = ?), ?, ?) ON CONFLICT DO NOTHING
+    ''', ('ahmed.m', hash_password('password123'), 'أحمد محمد', 'ahmed@madares.sa', 'محلل أصول', 'إدارة الأصول', 'الرياض'))
     
     cursor.execute('''
-        INSERT OR IGNORE INTO users (username, password, full_name, email, role, department, region)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', ('fatima.a', 'password123', 'فاطمة علي', 'fatima@madares.sa', 'مختص قانوني', 'الشؤون القانونية', 'جدة'))
+        INSERT INTO users (username, password, full_name, email, role_id, department, region)
+        VALUES (?, ?, ?, ?, (SELECT id FROM lookups WHERE kind = 'user_role' AND label = ?), ?, ?) ON CONFLICT DO NOTHING
+    ''', ('fatima.a', hash_password('password123'), 'فاطمة علي', 'fatima@madares.sa', 'مختص قانوني', 'الشؤون القانونية', 'جدة'))
     
-    # Insert sample assets
-    cursor.execute('''
-        INSERT OR IGNORE INTO assets (
-            asset_name, asset_type, asset_category, region, city, current_value, 
-            completion_percentage, construction_status, latitude, longitude
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', ('مجمع الرياض التجاري', 'تجاري', 'مجمع تجاري', 'الرياض', 'الرياض', 25000000, 85, 'قيد الإنشاء', 24.7136, 46.6753))
+    # Sample assets and workflows only go into an empty database
+    cursor.execute('SELECT COUNT(*) FROM assets')
+    if cursor.fetchone()[0] == 0:
+        # Insert sample assets
+        cursor.execute('''
+            INSERT INTO assets (
+                asset_name, asset_type_id, asset_category, region, city, current_value, 
+                completion_percentage, construction_status_id, latitude, longitude
+            ) VALUES (?, (SELECT id FROM lookups WHERE kind = 'asset_type' AND label = ?), ?, ?, ?, ?, ?, (SELECT id FROM lookups WHERE kind = 'construction_status' AND label = ?), ?, ?) ON CONFLICT DO NOTHING
+        ''', ('مجمع الرياض التجاري', 'تجاري', 'مجمع تجاري', 'الرياض', 'الرياض', 25000000, 85, 'قيد الإنشاء', 24.7136, 46.6753))
     
-    cursor.execute('''
-        INSERT OR IGNORE INTO assets (
-            asset_name, asset_type, asset_category, region, city, current_value, 
-            completion_percentage, construction_status, latitude, longitude
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', ('برج جدة للأعمال', 'مكتبي', 'برج أعمال', 'مكة المكرمة', 'جدة', 45000000, 100, 'مكتمل', 21.4858, 39.1925))
+        cursor.execute('''
+            INSERT INTO assets (
+                asset_name, asset_type_id, asset_category, region, city, current_value, 
+                completion_percentage, construction_status_id, latitude, longitude
+            ) VALUES (?, (SELECT id FROM lookups WHERE kind = 'asset_type' AND label = ?), ?, ?, ?, ?, ?, (SELECT id FROM lookups WHERE kind = 'construction_status' AND label = ?), ?, ?) ON CONFLICT DO NOTHING
+        ''', ('برج جدة للأعمال', 'مكتبي', 'برج أعمال', 'مكة المكرمة', 'جدة', 45000000, 100, 'مكتمل', 21.4858, 39.1925))
     
-    cursor.execute('''
-        INSERT OR IGNORE INTO assets (
-            asset_name, asset_type, asset_category, region, city, current_value, 
-            completion_percentage, construction_status, latitude, longitude
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', ('مجمع الدمام السكني', 'سكني', 'مجمع سكني', 'المنطقة الشرقية', 'الدمام', 18000000, 60, 'قيد الإنشاء', 26.4207, 50.0888))
+        cursor.execute('''
+            INSERT INTO assets (
+                asset_name, asset_type_id, asset_category, region, city, current_value, 
+                completion_percentage, construction_status_id, latitude, longitude
+            ) VALUES (?, (SELECT id FROM lookups WHERE kind = 'asset_type' AND label = ?), ?, ?, ?, ?, ?, (SELECT id FROM lookups WHERE kind = 'construction_status' AND label = ?), ?, ?) ON CONFLICT DO NOTHING
+        ''', ('مجمع الدمام السكني', 'سكني', 'مجمع سكني', 'المنطقة الشرقية', 'الدمام', 18000000, 60, 'قيد الإنشاء', 26.4207, 50.0888))
     
-    # Insert sample workflows
-    cursor.execute('''
-        INSERT OR IGNORE INTO workflows (title, status, priority, assigned_to, due_date, progress)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', ('مراجعة تقييم الأصول', 'قيد التنفيذ', 'عالية', 'أحمد محمد', '2025-08-15', 75))
+        # Insert sample workflows
+        cursor.execute('''
+            INSERT INTO workflows (title, status_id, priority_id, assigned_to, due_date, progress)
+            VALUES (?, (SELECT id FROM lookups WHERE kind = 'workflow_status' AND label = ?), (SELECT id FROM lookups WHERE kind = 'workflow_priority' AND label = ?), ?, ?, ?) ON CONFLICT DO NOTHING
+        ''', ('مراجعة تقييم الأصول', 'قيد التنفيذ', 'عالية', 'أحمد محمد', '2025-08-15', 75))
     
-    cursor.execute('''
-        INSERT OR IGNORE INTO workflows (title, status, priority, assigned_to, due_date, progress)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', ('تحديث المستندات القانونية', 'مكتملة', 'متوسطة', 'فاطمة علي', '2025-08-10', 100))
+        cursor.execute('''
+            INSERT INTO workflows (title, status_id, priority_id, assigned_to, due_date, progress)
+            VALUES (?, (SELECT id FROM lookups WHERE kind = 'workflow_status' AND label = ?), (SELECT id FROM lookups WHERE kind = 'workflow_priority' AND label = ?), ?, ?, ?) ON CONFLICT DO NOTHING
+        ''', ('تحديث المستندات القانونية', 'مكتملة', 'متوسطة', 'فاطمة علي', '2025-08-10', 100))
     
-    cursor.execute('''
-        INSERT OR IGNORE INTO workflows (title, status, priority, assigned_to, due_date, progress)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', ('فحص الأصول الجديدة', 'معلقة', 'منخفضة', 'محمد سالم', '2025-08-20', 25))
+        cursor.execute('''
+            INSERT INTO workflows (title, status_id, priority_id, assigned_to, due_date, progress)
+            VALUES (?, (SELECT id FROM lookups WHERE kind = 'workflow_status' AND label = ?), (SELECT id FROM lookups WHERE kind = 'workflow_priority' AND label = ?), ?, ?, ?) ON CONFLICT DO NOTHING
+        ''', ('فحص الأصول الجديدة', 'معلقة', 'منخفضة', 'محمد سالم', '2025-08-20', 25))
     
     conn.commit()
-    conn.close()
+
+def prune_change_log(conn):
+    # Entries older than the retention window are dropped, clients holding an
+    # older token get a full resync
+    cutoff = datetime.utcnow() - timedelta(days=CHANGE_LOG_RETENTION_DAYS)
+    conn.execute(
+        'DELETE FROM change_log WHERE changed_at < ?',
+        (cutoff.strftime('%Y-%m-%d %H:%M:%S'),)
+    )
+    conn.commit()
+
+@app.cli.command('seed-db')
+def seed_db_command():
+    """Insert the default admin user and the sample data."""
+    conn = get_db()
+    try:
+        migrate_db(conn)
+        seed_db(conn)
+    finally:
+        conn.close()
+    print('Database seeded')
+
+@app.cli.command('compact-asset-history')
+def compact_asset_history_command():
+    """Fold asset history older than the retention window into snapshots."""
+    conn = get_db()
+    try:
+        print('Compacted the history of %d assets' % compact_asset_history(conn))
+    finally:
+        conn.close()
+
+@app.cli.command('prune-change-log')
+def prune_change_log_command():
+    """Drop change log entries older than the retention window."""
+    conn = get_db()
+    try:
+        prune_change_log(conn)
+    finally:
+        conn.close()
 
 # Initialize database on startup
 init_db()
@@ -1441,18 +2314,27 @@ def index():
                 const username = usernameElement.value.trim();
                 const password = passwordElement.value.trim();
                 
-                console.log('Username:', username);
-                console.log('Password length:', password.length);
-                
-                if (username === 'admin' && password === 'password123') {
-                    console.log('Login successful');
-                    currentUser = { username: 'admin', role: 'Administrator' };
-                    showMainContent();
-                    alert('تم تسجيل الدخول بنجاح!');
-                } else {
-                    console.log('Login failed - incorrect credentials');
-                    alert('خطأ في تسجيل الدخول: اسم المستخدم أو كلمة المرور غير صحيحة\\nاستخدم: admin / password123');
-                }
+                fetch('/api/auth/login', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ username: username, password: password })
+                })
+                .then(response => response.json().then(result => ({ ok: response.ok, result: result })))
+                .then(({ ok, result }) => {
+                    if (ok) {
+                        console.log('Login successful');
+                        currentUser = result.user;
+                        showMainContent();
+                        alert('تم تسجيل الدخول بنجاح!');
+                    } else {
+                        console.log('Login failed:', result.error);
+                        alert('خطأ في تسجيل الدخول: اسم المستخدم أو كلمة المرور غير صحيحة');
+                    }
+                })
+                .catch(error => {
+                    console.error('Login error:', error);
+                    alert('حدث خطأ أثناء تسجيل الدخول: ' + error.message);
+                });
             } catch (error) {
                 console.error('Login error:', error);
                 alert('حدث خطأ أثناء تسجيل الدخول: ' + error.message);
@@ -1460,10 +2342,11 @@ def index():
         }
         
         function debugLogin() {
+            // The API needs a session, sign in with the demo account
             console.log('Debug login called');
-            currentUser = { username: 'admin', role: 'Administrator' };
-            showMainContent();
-            alert('تم تسجيل الدخول بنجاح باستخدام الوضع التجريبي!');
+            document.getElementById('username').value = 'admin';
+            document.getElementById('password').value = 'password123';
+            login(new Event('submit'));
         }
         
         function showMainContent() {
@@ -1476,10 +2359,13 @@ def index():
             if (logoutBtn) logoutBtn.style.display = 'block';
             
             loadAllData();
+            connectEvents();
         }
         
         function logout() {
+            fetch('/api/auth/logout', { method: 'POST' });
             currentUser = null;
+            disconnectEvents();
             document.getElementById('loginContainer').style.display = 'flex';
             document.getElementById('mainContent').style.display = 'none';
             document.querySelector('.logout-btn').style.display = 'none';
@@ -1520,6 +2406,46 @@ def index():
             }
         }
 
+        // Live Updates
+        let eventSource = null;
+        const pendingRefresh = {};
+        const refreshHandlers = {
+            assets: () => { loadAssets(); loadStats(); },
+            workflows: () => { loadWorkflows(); loadStats(); },
+            users: () => { loadUsers(); loadStats(); },
+            documents: () => loadDocuments()
+        };
+
+        function connectEvents() {
+            if (eventSource || !window.EventSource) return;
+            
+            eventSource = new EventSource('/api/events');
+            eventSource.addEventListener('change', event => {
+                const change = JSON.parse(event.data);
+                if (change.entity === 'documents' && change.processing_status === 'مكتمل') {
+                    console.log(`Document ${change.id} processed`);
+                }
+                scheduleRefresh(change.entity);
+            });
+        }
+
+        function disconnectEvents() {
+            if (eventSource) {
+                eventSource.close();
+                eventSource = null;
+            }
+        }
+
+        function scheduleRefresh(entity) {
+            // Coalesce bursts of events into one reload per entity
+            const handler = refreshHandlers[entity];
+            if (!handler || pendingRefresh[entity]) return;
+            pendingRefresh[entity] = setTimeout(() => {
+                delete pendingRefresh[entity];
+                handler();
+            }, 300);
+        }
+
         // Data Loading Functions
         function loadAllData() {
             loadStats();
@@ -1544,17 +2470,90 @@ def index():
                 });
         }
 
-        function loadAssets() {
-            fetch('/api/assets')
+        // Delta sync: assets and workflows are kept in local maps and patched
+        // with the rows changed since the last sync token
+        const syncState = {
+            token: 0,
+            inFlight: null,
+            tables: {
+                assets: { rows: new Map(), dirty: new Set(), reset: true },
+                workflows: { rows: new Map(), dirty: new Set(), reset: true }
+            }
+        };
+
+        function syncData() {
+            if (syncState.inFlight) return syncState.inFlight;
+            
+            const tables = Object.keys(syncState.tables).join(',');
+            syncState.inFlight = fetch(`/api/sync?since=${syncState.token}&tables=${tables}`)
                 .then(response => response.json())
                 .then(data => {
-                    const tbody = document.getElementById('assetsTable');
-                    if (!tbody) return;
+                    if (data.error) throw new Error(data.error);
                     
-                    tbody.innerHTML = '';
-                    data.forEach(asset => {
-                        const row = document.createElement('tr');
-                        row.innerHTML = `
+                    Object.entries(data.changes).forEach(([table, change]) => {
+                        const state = syncState.tables[table];
+                        if (data.full) {
+                            state.rows.clear();
+                            state.reset = true;
+                        }
+                        change.inserted.concat(change.updated).forEach(item => {
+                            state.rows.set(item.id, item);
+                            state.dirty.add(item.id);
+                        });
+                        change.deleted.forEach(id => {
+                            state.rows.delete(id);
+                            state.dirty.add(id);
+                        });
+                    });
+                    syncState.token = data.token;
+                })
+                .finally(() => {
+                    syncState.inFlight = null;
+                });
+            return syncState.inFlight;
+        }
+
+        function buildTableRow(item, renderRow) {
+            const row = document.createElement('tr');
+            row.dataset.id = item.id;
+            row.innerHTML = renderRow(item);
+            return row;
+        }
+
+        function patchTable(tbodyId, table, renderRow) {
+            const tbody = document.getElementById(tbodyId);
+            if (!tbody) return;
+            
+            const state = syncState.tables[table];
+            if (state.reset) {
+                tbody.innerHTML = '';
+                Array.from(state.rows.values())
+                    .sort((a, b) => b.id - a.id)
+                    .forEach(item => tbody.appendChild(buildTableRow(item, renderRow)));
+            } else {
+                state.dirty.forEach(id => {
+                    const existing = tbody.querySelector(`tr[data-id="${id}"]`);
+                    const item = state.rows.get(id);
+                    if (!item) {
+                        if (existing) existing.remove();
+                        return;
+                    }
+                    const row = buildTableRow(item, renderRow);
+                    if (existing) {
+                        existing.replaceWith(row);
+                        return;
+                    }
+                    // Keep the newest-first order
+                    const next = Array.from(tbody.children).find(tr => Number(tr.dataset.id) < id);
+                    tbody.insertBefore(row, next || null);
+                });
+            }
+            state.reset = false;
+            state.dirty.clear();
+        }
+
+        function renderAssetRow(asset) {
+            return `
                             <td>
                                 <button class="btn btn-small btn-info" onclick="viewAsset(${asset.id})">
                                     <i class="fas fa-eye"></i> عرض
@@ -1577,26 +2576,10 @@ def index():
                             <td>${asset.asset_name}</td>
                             <td>${asset.id}</td>
                         `;
-                        tbody.appendChild(row);
-                    });
-                })
-                .catch(error => {
-                    console.error('Error loading assets:', error);
-                    alert('خطأ في تحميل الأصول: ' + error.message);
-                });
         }
 
-        function loadWorkflows() {
-            fetch('/api/workflows')
-                .then(response => response.json())
-                .then(data => {
-                    const tbody = document.getElementById('workflowsTable');
-                    if (!tbody) return;
-                    
-                    tbody.innerHTML = '';
-                    data.forEach(workflow => {
-                        const row = document.createElement('tr');
-                        row.innerHTML = `
+        function renderWorkflowRow(workflow) {
+            return `
                             <td>
                                 <button class="btn btn-small btn-info" onclick="viewWorkflow(${workflow.id})">
                                     <i class="fas fa-eye"></i> عرض
@@ -1621,9 +2604,20 @@ def index():
                             <td>${workflow.title}</td>
                             <td>${workflow.id}</td>
                         `;
-                        tbody.appendChild(row);
-                    });
-                })
+        }
+
+        function loadAssets() {
+            syncData()
+                .then(() => patchTable('assetsTable', 'assets', renderAssetRow))
+                .catch(error => {
+                    console.error('Error loading assets:', error);
+                    alert('خطأ في تحميل الأصول: ' + error.message);
+                });
+        }
+
+        function loadWorkflows() {
+            syncData()
+                .then(() => patchTable('workflowsTable', 'workflows', renderWorkflowRow))
                 .catch(error => {
                     console.error('Error loading workflows:', error);
                     alert('خطأ في تحميل المهام: ' + error.message);
@@ -2139,27 +3133,711 @@ def index():
 </html>
     ''')
 
-# API Routes
+# Lookup values
+# Enumerated columns store integer ids into the lookups table
+# (migrations/0003_lookup_codes.py): smaller rows and indexes, GROUP BY on
+# integers. The API keeps speaking labels: row_factory translates ids on the
+# way out, encode_lookups() labels on the way in, both through an
+# in-process cache. ?lang=en returns the English labels.
+LOOKUP_COLUMNS = {
+    'assets': {'asset_type': 'asset_type', 'asset_status': 'asset_status', 'construction_status': 'construction_status'},
+    'workflows': {'status': 'workflow_status', 'priority': 'workflow_priority'},
+    'users': {'role': 'user_role'},
+}
+# id column -> API field, id columns are named <field>_id
+CODED_COLUMNS = {field + '_id': field for fields in LOOKUP_COLUMNS.values() for field in fields}
+LOOKUP_LANGUAGES = ('ar', 'en')
+LOOKUP_RELOAD_INTERVAL = 1.0
+
+def request_lang():
+    if has_request_context() and request.args.get('lang') in LOOKUP_LANGUAGES:
+        return request.args['lang']
+    return 'ar'
+
+class LookupCache:
+    # The whole table is small, it is loaded at once and reloaded when an id
+    # or label shows up that another worker has added since
+    def __init__(self):
+        self._labels = {}
+        self._ids = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self, force=False):
+        with self._lock:
+            if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < LOOKUP_RELOAD_INTERVAL:
+                return
+            conn = get_db()
+            try:
+                rows = conn.execute('SELECT id, kind, label, label_en FROM lookups').fetchall()
+            finally:
+                conn.close()
+            self._labels = {lookup_id: {'kind': kind, 'ar': label, 'en': label_en or label}
+                            for lookup_id, kind, label, label_en in rows}
+            self._ids = {(kind, label): lookup_id for lookup_id, kind, label, label_en in rows}
+            self._loaded_at = time.monotonic()
+
+    def label(self, lookup_id, lang='ar'):
+        if lookup_id is None:
+            return None
+        entry = self._labels.get(lookup_id)
+        if entry is None:
+            self.load()
+            entry = self._labels.get(lookup_id)
+        return entry[lang] if entry else None
+
+    def id_for(self, kind, label):
+        # For labels the code itself uses (constants, seed data), unknown ones
+        # become new lookup values. Labels sent by clients go through known().
+        if label is None:
+            return None
+        key = (kind, label)
+        if key not in self._ids:
+            self.load()
+        if key not in self._ids:
+            conn = get_db()
+            try:
+                conn.execute('INSERT INTO lookups (kind, label) VALUES (?, ?) ON CONFLICT DO NOTHING', key)
+                conn.commit()
+            finally:
+                conn.close()
+            self.load(force=True)
+        return self._ids[key]
+
+    def find(self, kind, label):
+        # Id of an Arabic or English label, None when unknown (nothing is added)
+        if self._loaded_at is None:
+            self.load()
+        for lookup_id, entry in self._labels.items():
+            if entry['kind'] == kind and label in (entry['ar'], entry['en']):
+                return lookup_id
+        return None
+
+    def known(self, kind, label):
+        # Id of a label from a request, ValueError when it isn't a lookup value
+        if label is None:
+            return None
+        lookup_id = self.find(kind, label)
+        if lookup_id is None:
+            self.load()
+            lookup_id = self.find(kind, label)
+        if lookup_id is None:
+            raise ValueError('Unknown %s: %s' % (kind.replace('_', ' '), label))
+        return lookup_id
+
+    def translate(self, kind, label, lang):
+        # Arabic label -> label in `lang`, unknown labels are returned as they are
+        if label is None or lang == 'ar':
+            return label
+        if (kind, label) not in self._ids:
+            self.load()
+        lookup_id = self._ids.get((kind, label))
+        return self.label(lookup_id, lang) if lookup_id is not None else label
+
+    def values(self, lang='ar'):
+        if self._loaded_at is None:
+            self.load()
+        result = {}
+        for lookup_id, entry in sorted(self._labels.items()):
+            result.setdefault(entry['kind'], []).append({'id': lookup_id, 'label': entry[lang]})
+        return result
+
+lookups = LookupCache()
+
+def encode_lookups(table, data):
+    # Replace the label fields of `table` in `data` with their lookup ids,
+    # ValueError for labels that aren't lookup values
+    encoded = dict(data)
+    for field, kind in LOOKUP_COLUMNS[table].items():
+        if field in encoded:
+            encoded[field + '_id'] = lookups.known(kind, encoded.pop(field))
+    return encoded
+
+# Asset sections
+# The MOE sections that listings never show live in 1:1 side tables keyed by
+# asset_id (migrations/0002_asset_sections.py), so the assets row stays narrow.
+# Listings return the assets row only, ?include=planning,financials (or
+# include=all) joins sections in; detail views include every section.
+ASSET_COLUMNS = (
+    'asset_name', 'asset_type_id', 'asset_category', 'asset_status_id', 'unique_id', 'creation_date',
+    'construction_status_id', 'completion_percentage', 'construction_start_date', 'expected_completion_date',
+    'latitude', 'longitude', 'region', 'city', 'district', 'street_name', 'building_number', 'current_value'
+)
+ASSET_SECTIONS = OrderedDict([
+    ('planning', ('asset_planning', ('need_assessment', 'development_plan', 'expected_timeline', 'planning_phase'))),
+    ('attractiveness', ('asset_attractiveness', ('location_rating', 'nearby_facilities', 'accessibility'))),
+    ('investment', ('asset_investment', ('investment_proposal', 'potential_obstacles', 'expected_return'))),
+    ('obligations', ('asset_obligations', ('total_cost', 'required_funding', 'funding_source'))),
+    ('utilities', ('asset_utilities', ('electricity_status', 'water_status', 'sewage_status', 'telecom_status'))),
+    ('ownership', ('asset_ownership', ('ownership_type', 'owner_name', 'ownership_documents', 'legal_status'))),
+    ('land', ('asset_land', ('land_area', 'land_type', 'zoning_classification'))),
+    ('areas', ('asset_areas', ('built_area', 'usable_area', 'common_area', 'parking_area', 'green_area'))),
+    ('dimensions', ('asset_dimensions', ('length_meters', 'width_meters', 'height_meters', 'floors_count'))),
+    ('boundaries', ('asset_boundaries', (
+        'north_boundary', 'south_boundary', 'east_boundary', 'west_boundary',
+        'boundary_length_north', 'boundary_length_south', 'boundary_length_east', 'boundary_length_west'))),
+    ('financials', ('asset_financials', (
+        'market_value', 'rental_income', 'operating_expenses', 'net_income', 'roi_percentage',
+        'appreciation_rate', 'property_tax', 'insurance_cost', 'maintenance_cost', 'management_fee',
+        'vacancy_rate', 'cap_rate', 'debt_service', 'cash_flow', 'irr_percentage', 'npv_value',
+        'payback_period', 'risk_assessment', 'market_conditions', 'future_prospects')))
+])
+ASSET_SECTION_COLUMNS = {column for table, columns in ASSET_SECTIONS.values() for column in columns}
+
+def parse_asset_sections(value):
+    if not value:
+        return []
+    if value == 'all':
+        return list(ASSET_SECTIONS)
+    sections = [section for section in value.split(',') if section]
+    unknown = [section for section in sections if section not in ASSET_SECTIONS]
+    if unknown:
+        raise ValueError('Unknown section: %s (expected %s or all)' % (', '.join(unknown), ', '.join(ASSET_SECTIONS)))
+    return sections
+
+def asset_query(sections):
+    columns = ['assets.*']
+    joins = []
+    for section in sections:
+        table, section_columns = ASSET_SECTIONS[section]
+        columns.extend('%s.%s' % (table, column) for column in section_columns)
+        joins.append('LEFT JOIN %s ON %s.asset_id = assets.id' % (table, table))
+    # Tombstoned assets (deleted, not purged yet) are left out
+    return 'SELECT %s FROM assets %s WHERE assets.deleted_at IS NULL' % (', '.join(columns), ' '.join(joins))
+
+def save_asset_sections(cursor, asset_id, data):
+    # Write the section columns present in `data`. Only sections with at
+    # least one value get a row, clearing the fields of a missing row is a no-op.
+    for table, columns in ASSET_SECTIONS.values():
+        provided = [column for column in columns if column in data]
+        if not provided:
+            continue
+        values = [data[column] for column in provided]
+        if all(value is None for value in values):
+            cursor.execute(
+                f"UPDATE {table} SET {', '.join(column + ' = NULL' for column in provided)} WHERE asset_id = ?",
+                (asset_id,)
+            )
+        else:
+            cursor.execute(
+                f"INSERT INTO {table} (asset_id, {', '.join(provided)}) VALUES (?, {', '.join('?' * len(provided))}) "
+                f"ON CONFLICT (asset_id) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in provided)}",
+                [asset_id] + values
+            )
+
+# Asset history
+# Every write to an asset appends an entry to asset_history holding only the
+# fields it changed, by API field name with Arabic labels
+# (migrations/0004_asset_history.sql). 'insert' and 'snapshot' entries hold
+# the full state: reading an asset as of a point in time starts from the
+# latest of those and replays the diffs after it, and a snapshot is added
+# every ASSET_HISTORY_SNAPSHOT_EVERY diffs so that replay stays short.
+# compact-asset-history folds entries older than the retention window into a
+# single snapshot per asset.
+ASSET_HISTORY_SNAPSHOT_EVERY = int(os.environ.get('MADARES_ASSET_HISTORY_SNAPSHOT_EVERY', 50))
+ASSET_HISTORY_RETENTION_DAYS = int(os.environ.get('MADARES_ASSET_HISTORY_RETENTION_DAYS', 0))  # 0: keep all
+ASSET_HISTORY_UNTRACKED = ('id', 'created_at', 'updated_at', 'deleted_at')
+ASSET_HISTORY_FIELDS = tuple(CODED_COLUMNS.get(column, column) for column in ASSET_COLUMNS) + tuple(
+    column for table, columns in ASSET_SECTIONS.values() for column in columns)
+HISTORY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def current_username():
+    user = current_principal()
+    return user['username'] if user else None
+
+def history_time(value):
+    # Timestamps are compared as text in the format CURRENT_TIMESTAMP uses (UTC)
+    return value.strftime(HISTORY_TIME_FORMAT) if isinstance(value, datetime) else value
+
+def parse_as_of(value):
+    # ISO 8601, values without an offset are taken as UTC
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return history_time(moment)
+
+def load_asset(cursor, asset_id, lock=False):
+    # Current state of an asset with Arabic labels, None when it doesn't exist.
+    # With lock, concurrent writers of the same asset wait for this transaction
+    # (SQLite serializes writers anyway).
+    query = asset_query(ASSET_SECTIONS) + ' AND assets.id = ?'
+    if lock and cursor.storage.dialect != 'sqlite':
+        query += ' FOR UPDATE OF assets'
+    cursor.execute(query, (asset_id,))
+    row = cursor.fetchone()
+    return row_factory(cursor, lang='ar')(row) if row else None
+
+def tracked_fields(state, skip_empty=False):
+    return {field: value for field, value in state.items()
+            if field not in ASSET_HISTORY_UNTRACKED and not (skip_empty and value is None)}
+
+def record_asset_history(cursor, asset_id, operation, before=None, after=None):
+    # Append the entry for one write, in the writer's transaction. Returns the
+    # changed fields; an update that changed nothing is not recorded.
+    if operation == 'insert':
+        changes = tracked_fields(after, skip_empty=True)
+    elif operation == 'update':
+        old = tracked_fields(before)
+        changes = {field: value for field, value in tracked_fields(after).items() if old.get(field) != value}
+        if not changes:
+            return changes
+    else:
+        changes = {}
+
+    cursor.execute('''
+        SELECT MAX(version), MAX(CASE WHEN operation IN ('insert', 'snapshot') THEN version END)
+        FROM asset_history WHERE asset_id = ?
+    ''', (asset_id,))
+    version, base_version = cursor.fetchone()
+    version = version or 0
+    now = history_time(datetime.utcnow())
+    entries = []
+    if version == 0 and before is not None:
+        # Asset written before history was kept: its previous state becomes
+        # the starting point, valid since its last change
+        entries.append(('snapshot', tracked_fields(before, skip_empty=True), None,
+                        history_time(before.get('updated_at')) or now))
+        base_version = 1
+    entries.append((operation, changes, current_username(), now))
+    if operation == 'update' and version + len(entries) - (base_version or 0) >= ASSET_HISTORY_SNAPSHOT_EVERY:
+        entries.append(('snapshot', tracked_fields(after, skip_empty=True), None, now))
+
+    cursor.executemany(
+        'INSERT INTO asset_history (asset_id, version, operation, changes, changed_by, changed_at) VALUES (?, ?, ?, ?, ?, ?)',
+        [(asset_id, version + i, entry_operation, json_dumps(entry_changes).decode('utf-8'), changed_by, changed_at)
+         for i, (entry_operation, entry_changes, changed_by, changed_at) in enumerate(entries, 1)]
+    )
+    return changes
+
+def reconstruct_asset(cursor, asset_id, as_of=None, version=None):
+    # State of an asset at time `as_of` (or right after entry `version`),
+    # replayed from its history. None when it didn't exist then.
+    bound, value = ('changed_at <= ?', as_of) if version is None else ('version <= ?', version)
+    cursor.execute(f'''
+        SELECT operation, changes FROM asset_history
+        WHERE asset_id = ? AND {bound} AND version >= COALESCE((
+            SELECT MAX(version) FROM asset_history
+            WHERE asset_id = ? AND {bound} AND operation IN ('insert', 'snapshot')
+        ), 0)
+        ORDER BY version
+    ''', (asset_id, value, asset_id, value))
+    state = None
+    for operation, changes in cursor.fetchall():
+        if operation == 'delete':
+            state = None
+        elif operation in ('insert', 'snapshot'):
+            state = json_loads(changes)
+        elif state is not None:
+            state.update(json_loads(changes))
+    return state
+
+def compact_asset_history(conn, batch_size=100):
+    # Replace the entries older than the retention window by one snapshot per
+    # asset (its state after the last of them). Assets deleted before the
+    # cutoff lose their history altogether.
+    if ASSET_HISTORY_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = history_time(datetime.utcnow() - timedelta(days=ASSET_HISTORY_RETENTION_DAYS))
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT asset_id, MAX(version) FROM asset_history WHERE changed_at < ?
+        GROUP BY asset_id HAVING COUNT(*) > 1 OR MAX(CASE WHEN operation = 'delete' THEN 1 ELSE 0 END) = 1
+    ''', (cutoff,))
+    folded = cursor.fetchall()
+    for i, (asset_id, version) in enumerate(folded, 1):
+        state = reconstruct_asset(cursor, asset_id, version=version)
+        if state is None:
+            cursor.execute('DELETE FROM asset_history WHERE asset_id = ? AND version <= ?', (asset_id, version))
+        else:
+            state = {field: value for field, value in state.items() if value is not None}
+            cursor.execute(
+                "UPDATE asset_history SET operation = 'snapshot', changes = ?, changed_by = NULL "
+                "WHERE asset_id = ? AND version = ?",
+                (json_dumps(state).decode('utf-8'), asset_id, version)
+            )
+            cursor.execute('DELETE FROM asset_history WHERE asset_id = ? AND version < ?', (asset_id, version))
+        if i % batch_size == 0:
+            conn.commit()
+    conn.commit()
+    return len(folded)
+
+# Workflow engine
+# Workflows move through WORKFLOW_TRANSITIONS only. Each priority has an SLA:
+# the default due date (days after creation) and how many days before it an
+# open workflow is escalated to high priority; one still open after its due
+# date is flagged overdue. DeadlineScheduler keeps the deadlines of the next
+# WORKFLOW_HORIZON_DAYS in a heap, loaded through idx_workflows_status_due
+# (migrations/0006_workflow_engine.sql), so a tick only looks at the heap's
+# head instead of the workflows table.
+WORKFLOW_PENDING = 'معلقة'
+WORKFLOW_IN_PROGRESS = 'قيد التنفيذ'
+WORKFLOW_COMPLETED = 'مكتملة'
+WORKFLOW_CANCELLED = 'ملغاة'
+WORKFLOW_TRANSITIONS = {
+    WORKFLOW_PENDING: (WORKFLOW_IN_PROGRESS, WORKFLOW_CANCELLED),
+    WORKFLOW_IN_PROGRESS: (WORKFLOW_COMPLETED, WORKFLOW_PENDING, WORKFLOW_CANCELLED),
+    WORKFLOW_COMPLETED: (WORKFLOW_IN_PROGRESS,),
+    WORKFLOW_CANCELLED: (),
+}
+WORKFLOW_OPEN = (WORKFLOW_PENDING, WORKFLOW_IN_PROGRESS)
+WORKFLOW_HIGH_PRIORITY = 'عالية'
+WORKFLOW_SLA = {
+    'عالية': {'days': 2, 'escalate_before': 1},
+    'متوسطة': {'days': 7, 'escalate_before': 2},
+    'منخفضة': {'days': 14, 'escalate_before': 3},
+}
+WORKFLOW_SCHEDULER_INTERVAL = float(os.environ.get('MADARES_WORKFLOW_SCHEDULER_INTERVAL', 60))  # 0: off
+WORKFLOW_HORIZON_DAYS = int(os.environ.get('MADARES_WORKFLOW_HORIZON_DAYS', 1))
+WORKFLOW_FIRE_BATCH_SIZE = 500
+PG_SCHEDULER_LOCK = 7314  # advisory lock key, next to migrate.PG_MIGRATION_LOCK
+_scheduler_lock = threading.Lock()
+_scheduler_thread = None
+
+def workflow_sla(priority):
+    return WORKFLOW_SLA.get(priority, WORKFLOW_SLA['متوسطة'])
+
+def default_due_date(priority, today=None):
+    return (today or datetime.utcnow().date()) + timedelta(days=workflow_sla(priority)['days'])
+
+def as_date(value):
+    # DATE columns come back as text from SQLite and as date from PostgreSQL
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+class DeadlineScheduler:
+    # Min-heap of (fire date, action, workflow id). Entries are hints: the
+    # UPDATE that fires an action re-checks the row, so entries made stale by
+    # a transition are harmless. Ticks of several processes are serialized by
+    # scheduler_turn().
+    def __init__(self):
+        self._heap = []
+        self._loaded_on = None
+        self._horizon = None
+        self._lock = threading.Lock()
+        self.fired = {'escalate': 0, 'overdue': 0}
+
+    def _push(self, workflow_id, priority, due_date, escalated, overdue):
+        due_date = as_date(due_date)
+        if due_date is None:
+            return
+        if not escalated:
+            fire = due_date - timedelta(days=workflow_sla(priority)['escalate_before'])
+            if fire <= self._horizon:
+                heapq.heappush(self._heap, (fire, 'escalate', workflow_id))
+        if not overdue:
+            fire = due_date + timedelta(days=1)
+            if fire <= self._horizon:
+                heapq.heappush(self._heap, (fire, 'overdue', workflow_id))
+
+    def load(self, conn, today):
+        # Open workflows whose actions fall due by the horizon, one index
+        # range per open status
+        horizon = today + timedelta(days=WORKFLOW_HORIZON_DAYS)
+        latest_due = horizon + timedelta(days=max(sla['escalate_before'] for sla in WORKFLOW_SLA.values()))
+        cursor = conn.cursor()
+        rows = []
+        for status in WORKFLOW_OPEN:
+            cursor.execute('''
+                SELECT id, priority_id, due_date, escalated_at, overdue_at FROM workflows
+                WHERE status_id = ? AND due_date <= ? AND (escalated_at IS NULL OR overdue_at IS NULL)
+            ''', (lookups.id_for('workflow_status', status), latest_due.isoformat()))
+            rows.extend(cursor.fetchall())
+        conn.rollback()
+        with self._lock:
+            self._heap = []
+            self._horizon = horizon
+            self._loaded_on = today
+            for workflow_id, priority_id, due_date, escalated_at, overdue_at in rows:
+                self._push(workflow_id, lookups.label(priority_id), due_date, escalated_at, overdue_at)
+            heapq.heapify(self._heap)
+
+    def schedule(self, workflow_id, priority, due_date):
+        # Called for new or rescheduled workflows of this process
+        with self._lock:
+            if self._horizon is not None:
+                self._push(workflow_id, priority, due_date, False, False)
+
+    def tick(self, conn, today=None):
+        today = today or datetime.utcnow().date()
+        if self._loaded_on != today:
+            self.load(conn, today)
+        due = {'escalate': set(), 'overdue': set()}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= today:
+                fire, action, workflow_id = heapq.heappop(self._heap)
+                due[action].add(workflow_id)
+        fired = {}
+        for action, workflow_ids in due.items():
+            if workflow_ids:
+                fired[action] = self.fire(conn, action, sorted(workflow_ids), today)
+        return fired
+
+    def fire(self, conn, action, workflow_ids, today):
+        # Only rows that are still open and not flagged yet change
+        open_ids = [lookups.id_for('workflow_status', status) for status in WORKFLOW_OPEN]
+        checks = f"status_id IN ({', '.join('?' * len(open_ids))})"
+        check_params = open_ids
+        if action == 'escalate':
+            checks += ' AND escalated_at IS NULL'
+            changes = 'escalated_at = CURRENT_TIMESTAMP, priority_id = ?'
+            change_params = [lookups.id_for('workflow_priority', WORKFLOW_HIGH_PRIORITY)]
+        else:
+            checks += ' AND overdue_at IS NULL AND due_date < ?'
+            check_params = open_ids + [today.isoformat()]
+            changes = 'overdue_at = CURRENT_TIMESTAMP'
+            change_params = []
+        update = f"UPDATE workflows SET {changes}, updated_at = CURRENT_TIMESTAMP WHERE {checks} AND "
+        cursor = conn.cursor()
+        fired = []
+        # Counted are the rows this UPDATE changed, not the ones found due:
+        # another process may have fired or closed them in between
+        for start in range(0, len(workflow_ids), WORKFLOW_FIRE_BATCH_SIZE):
+            batch = workflow_ids[start:start + WORKFLOW_FIRE_BATCH_SIZE]
+            if conn.dialect == 'sqlite':
+                for workflow_id in batch:
+                    if cursor.execute(update + 'id = ?', change_params + check_params + [workflow_id]).rowcount:
+                        fired.append(workflow_id)
+            else:
+                cursor.execute(
+                    update + f"id IN ({', '.join('?' * len(batch))}) RETURNING id",
+                    change_params + check_params + batch
+                )
+                fired.extend(row[0] for row in cursor.fetchall())
+            conn.commit()
+        self.fired[action] += len(fired)
+        for workflow_id in fired:
+            record_change('workflows', workflow_id, 'update', sla=action)
+        return len(fired)
+
+    def stats(self):
+        return {'pending': len(self._heap), 'loaded_on': self._loaded_on, 'horizon': self._horizon,
+                'fired': dict(self.fired)}
+
+deadline_scheduler = DeadlineScheduler()
+
+@contextmanager
+def scheduler_turn(conn):
+    # Every worker runs a scheduler thread, one tick at a time may fire
+    # across workers and nodes; the others skip theirs. Like migrate.py's
+    # migration_lock, with a PostgreSQL advisory lock or a lock file.
+    if conn.dialect != 'sqlite':
+        if not conn.execute('SELECT pg_try_advisory_lock(?)', (PG_SCHEDULER_LOCK,)).fetchone()[0]:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            conn.rollback()
+            conn.execute('SELECT pg_advisory_unlock(?)', (PG_SCHEDULER_LOCK,))
+        return
+    db_path = conn.storage.path
+    if fcntl is None or db_path == ':memory:':
+        yield True
+        return
+    with open(db_path + '.scheduler.lock', 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def run_deadline_scheduler():
+    while True:
+        try:
+            conn = get_db()
+            try:
+                with scheduler_turn(conn) as turn:
+                    if turn:
+                        deadline_scheduler.tick(conn)
+            finally:
+                conn.close()
+        except Exception:
+            app.logger.exception('Workflow deadline check failed')
+        time.sleep(WORKFLOW_SCHEDULER_INTERVAL)
+
+@app.before_request
+def start_deadline_scheduler():
+    global _scheduler_thread
+    if _scheduler_thread is None and WORKFLOW_SCHEDULER_INTERVAL > 0 and not os.environ.get('VERCEL'):
+        with _scheduler_lock:
+            if _scheduler_thread is None:
+                _scheduler_thread = threading.Thread(target=run_deadline_scheduler, name='workflow-deadlines', daemon=True)
+                _scheduler_thread.start()
+
+@app.cli.command('check-workflow-deadlines')
+def check_workflow_deadlines_command():
+    """Escalate and flag overdue workflows once."""
+    conn = get_db()
+    try:
+        with scheduler_turn(conn) as turn:
+            fired = deadline_scheduler.tick(conn) if turn else {}
+    finally:
+        conn.close()
+    if not turn:
+        print('another process is checking deadlines')
+        return
+    print('escalated: %d, overdue: %d' % (fired.get('escalate', 0), fired.get('overdue', 0)))
+
+# Workflow analytics
+# Reports read pre-aggregated rollups (migrations/0008_workflow_rollups.sql)
+# instead of scanning workflows. Every creation and status change adds to the
+# rows of the current ISO week in the same transaction:
+#   created / completed        counters, completed also per assignee
+#   cycle_hours                creation -> completion, per priority
+#   stage_hours                time spent in the status being left, per status
+# The two duration metrics are histograms over ROLLUP_HOURS_BUCKETS with the
+# summed hours per bucket, enough for means and approximate percentiles.
+# workflows.status_changed_at records when the current status was entered.
+ROLLUP_HOURS_BUCKETS = (1, 4, 8, 24, 48, 72, 168, 336, 720)  # upper bounds, the last bucket is open
+ROLLUP_MAX_WEEKS = 104
+
+def rollup_period(moment):
+    year, week, weekday = moment.isocalendar()
+    return '%d-W%02d' % (year, week)
+
+def as_datetime(value):
+    # TIMESTAMP columns come back as text on SQLite
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.strptime(str(value)[:19], HISTORY_TIME_FORMAT)
+
+def hours_between(start, end):
+    return max((end - as_datetime(start)).total_seconds() / 3600, 0.0)
+
+def add_rollups(cursor, increments):
+    # {(metric, period, dimension, bucket): [count, total]}
+    if not increments:
+        return
+    cursor.executemany('''
+        INSERT INTO workflow_rollups (metric, period, dimension, bucket, count, total) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (metric, period, dimension, bucket) DO UPDATE
+        SET count = workflow_rollups.count + excluded.count, total = workflow_rollups.total + excluded.total
+    ''', [key + tuple(value) for key, value in increments.items()])
+
+class RollupBatch:
+    # Collects the increments of one transaction, rows touched several times
+    # are written once
+    def __init__(self, now):
+        self.now = now
+        self.period = rollup_period(now)
+        self.increments = {}
+
+    def count(self, metric, dimension='', n=1, period=None):
+        entry = self.increments.setdefault((metric, period or self.period, dimension, 0), [0, 0.0])
+        entry[0] += n
+
+    def observe(self, metric, dimension, hours, period=None):
+        bucket = bisect.bisect_left(ROLLUP_HOURS_BUCKETS, hours)
+        entry = self.increments.setdefault((metric, period or self.period, dimension, bucket), [0, 0.0])
+        entry[0] += 1
+        entry[1] += hours
+
+    def transition(self, status_id, target_id, priority_id, assignee_id, created_at, status_changed_at):
+        # One workflow leaving status_id for target_id now
+        self.observe('stage_hours', 'status:%d' % status_id, hours_between(status_changed_at or created_at, self.now))
+        if lookups.label(target_id) == WORKFLOW_COMPLETED:
+            self.count('completed')
+            if assignee_id is not None:
+                self.count('completed', 'assignee:%d' % assignee_id)
+            self.observe('cycle_hours', 'priority:%d' % priority_id, hours_between(created_at, self.now))
+
+    def write(self, cursor):
+        add_rollups(cursor, self.increments)
+
+# Columns RollupBatch.transition needs besides status_id
+ROLLUP_COLUMNS = 'priority_id, assignee_id, created_at, status_changed_at'
+
+def summarize_histogram(buckets):
+    # {bucket: [count, total]} -> count, mean and approximate percentiles (the
+    # upper bound of the bucket holding them, None past the last bound)
+    count = sum(entry[0] for entry in buckets.values())
+    total = sum(entry[1] for entry in buckets.values())
+    def bound(bucket):
+        return ROLLUP_HOURS_BUCKETS[bucket] if bucket < len(ROLLUP_HOURS_BUCKETS) else None
+
+    summary = {'count': count, 'mean_hours': round(total / count, 1) if count else None}
+    for name, share in (('p50_hours', 0.5), ('p90_hours', 0.9)):
+        summary[name] = None
+        seen = 0
+        for bucket in sorted(buckets):
+            seen += buckets[bucket][0]
+            if count and seen >= share * count:
+                summary[name] = bound(bucket)
+                break
+    summary['histogram'] = [{'le_hours': bound(bucket), 'count': buckets[bucket][0]} for bucket in sorted(buckets)]
+    return summary
+
+def rebuild_workflow_rollups(conn):
+    # Recomputes created, completed and cycle_hours from the workflows table,
+    # for data written before the rollups existed. Completion time is taken
+    # from updated_at; stage times can't be recovered and are left as they are.
+    completed_id = lookups.id_for('workflow_status', WORKFLOW_COMPLETED)
+    batch = RollupBatch(datetime.utcnow())
+    cursor = conn.cursor()
+    for created_at, updated_at, status_id, priority_id, assignee_id in conn.stream(
+            'SELECT created_at, updated_at, status_id, priority_id, assignee_id FROM workflows'):
+        created_at = as_datetime(created_at)
+        batch.count('created', period=rollup_period(created_at))
+        if status_id == completed_id and updated_at is not None:
+            completed_at = as_datetime(updated_at)
+            period = rollup_period(completed_at)
+            batch.count('completed', period=period)
+            if assignee_id is not None:
+                batch.count('completed', 'assignee:%d' % assignee_id, period=period)
+            batch.observe('cycle_hours', 'priority:%d' % priority_id, hours_between(created_at, completed_at), period=period)
+    conn.begin_write()
+    cursor.execute("DELETE FROM workflow_rollups WHERE metric IN ('created', 'completed', 'cycle_hours')")
+    batch.write(cursor)
+    conn.commit()
+    return len(batch.increments)
+
+@app.cli.command('rebuild-workflow-rollups')
+def rebuild_workflow_rollups_command():
+    """Recompute workflow report counters from the workflows table."""
+    conn = get_db()
+    try:
+        rows = rebuild_workflow_rollups(conn)
+    finally:
+        conn.close()
+    print('rollup rows: %d' % rows)
+
+# API Routes
 @app.route('/api/stats')
+@conditional('assets', 'workflows', 'users')
+@cached('assets', 'workflows', 'users')
 def get_stats():
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_read_db()
         cursor = conn.cursor()
         
+        # Region scoped requests count their region only
+        assets_scope, assets_params = scope_filter('assets')
+        workflows_scope, workflows_params = scope_filter('workflows')
+        users_scope, users_params = scope_filter('users')
+        
         # Get total assets
-        cursor.execute('SELECT COUNT(*) FROM assets')
+        cursor.execute('SELECT COUNT(*) FROM assets WHERE deleted_at IS NULL'
+                       + (' AND ' + assets_scope if assets_scope else ''), assets_params)
         total_assets = cursor.fetchone()[0]
         
         # Get total value
-        cursor.execute('SELECT SUM(current_value) FROM assets WHERE current_value IS NOT NULL')
+        cursor.execute('SELECT SUM(current_value) FROM assets WHERE current_value IS NOT NULL AND deleted_at IS NULL'
+                       + (' AND ' + assets_scope if assets_scope else ''), assets_params)
         total_value = cursor.fetchone()[0] or 0
         
         # Get active workflows
-        cursor.execute("SELECT COUNT(*) FROM workflows WHERE status != 'مكتملة'")
+        cursor.execute(f"SELECT COUNT(*) FROM workflows WHERE status_id IN ({', '.join('?' * len(WORKFLOW_OPEN))})"
+                       + (' AND ' + workflows_scope if workflows_scope else ''),
+                       [lookups.id_for('workflow_status', status) for status in WORKFLOW_OPEN] + workflows_params)
         active_workflows = cursor.fetchone()[0]
         
         # Get total users
-        cursor.execute('SELECT COUNT(*) FROM users')
+        cursor.execute('SELECT COUNT(*) FROM users' + (' WHERE ' + users_scope if users_scope else ''), users_params)
         total_users = cursor.fetchone()[0]
         
         conn.close()
@@ -2174,71 +3852,123 @@ def get_stats():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/assets')
+@conditional('assets')
+@cached('assets')
 def get_assets():
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM assets ORDER BY id DESC')
-        assets = []
-        for row in cursor.fetchall():
-            asset = {}
-            columns = [description[0] for description in cursor.description]
-            for i, value in enumerate(row):
-                asset[columns[i]] = value
-            assets.append(asset)
-        
-        conn.close()
-        return jsonify(assets)
+        sections = parse_asset_sections(request.args.get('include'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        condition, params = scope_filter('assets')
+        conn = get_read_db()
+        cursor = conn.stream(asset_query(sections) + (' AND ' + condition if condition else '') + ' ORDER BY assets.id DESC',
+                             params)
+        return stream_json_array(conn, cursor)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/assets/<int:asset_id>')
+@conditional('assets')
 def get_asset(asset_id):
+    if request.args.get('as_of'):
+        return get_asset_as_of(asset_id)
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_read_db()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM assets WHERE id = ?', (asset_id,))
+        condition, params = scope_filter('assets')
+        cursor.execute(asset_query(ASSET_SECTIONS) + ' AND assets.id = ?' + (' AND ' + condition if condition else ''),
+                       [asset_id] + params)
         row = cursor.fetchone()
         
         if row:
-            asset = {}
-            columns = [description[0] for description in cursor.description]
-            for i, value in enumerate(row):
-                asset[columns[i]] = value
+            asset = row_factory(cursor)(row)
             conn.close()
-            return jsonify(asset)
+            return json_response(asset)
         else:
             conn.close()
             return jsonify({'error': 'Asset not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def get_asset_as_of(asset_id):
+    try:
+        as_of = parse_as_of(request.args['as_of'])
+    except ValueError:
+        return jsonify({'error': 'as_of must be an ISO 8601 date or time'}), 400
+    try:
+        conn = get_read_db()
+        try:
+            asset = reconstruct_asset(conn.cursor(), asset_id, as_of) if asset_in_scope(conn, asset_id) else None
+        finally:
+            conn.close()
+        if asset is None:
+            return jsonify({'error': 'Asset not found at %s' % as_of}), 404
+        lang = request_lang()
+        for field, kind in LOOKUP_COLUMNS['assets'].items():
+            asset[field] = lookups.translate(kind, asset.get(field), lang)
+        asset = dict({'id': asset_id}, **{field: asset.get(field) for field in ASSET_HISTORY_FIELDS}, as_of=as_of)
+        return json_response(asset)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/assets/<int:asset_id>/history')
+@conditional('assets')
+def get_asset_history(asset_id):
+    try:
+        conn = get_read_db()
+        try:
+            cursor = conn.cursor()
+            condition, params = scope_filter('assets')
+            scope = ' AND asset_id IN (SELECT id FROM assets WHERE %s)' % condition if condition else ''
+            cursor.execute(f'''
+                SELECT version, operation, changes, changed_by, changed_at FROM asset_history
+                WHERE asset_id = ?{scope} ORDER BY version
+            ''', [asset_id] + params)
+            history = [
+                {'version': version, 'operation': operation, 'changes': json_loads(changes),
+                 'changed_by': changed_by, 'changed_at': changed_at}
+                for version, operation, changes, changed_by, changed_at in cursor.fetchall()
+            ]
+        finally:
+            conn.close()
+        return json_response(history)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def check_asset_fields(data):
+    unknown = [key for key in data if key not in ASSET_COLUMNS and key not in ASSET_SECTION_COLUMNS
+               and key not in LOOKUP_COLUMNS['assets']]
+    return 'Unknown field: ' + ', '.join(unknown) if unknown else None
+
 @app.route('/api/assets', methods=['POST'])
 def add_asset():
     try:
-        data = request.json
-        conn = sqlite3.connect('/tmp/madares.db')
+        data = {key: value for key, value in request.json.items() if value is not None and value != ''}
+        error = check_asset_fields(data)
+        if error:
+            return jsonify({'error': error}), 400
+        try:
+            data = encode_lookups('assets', data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        conn = get_db()
         cursor = conn.cursor()
         
         # Build dynamic INSERT query based on provided fields
-        fields = []
-        values = []
-        placeholders = []
-        
-        for key, value in data.items():
-            if value is not None and value != '':
-                fields.append(key)
-                values.append(value)
-                placeholders.append('?')
+        fields = [key for key in data if key in ASSET_COLUMNS]
+        values = [data[key] for key in fields]
+        placeholders = ['?'] * len(fields)
         
         if fields:
             query = f"INSERT INTO assets ({', '.join(fields)}) VALUES ({', '.join(placeholders)})"
-            cursor.execute(query, values)
+            asset_id = cursor.insert(query, values)
+            save_asset_sections(cursor, asset_id, data)
+            record_asset_history(cursor, asset_id, 'insert', after=load_asset(cursor, asset_id))
             conn.commit()
-            asset_id = cursor.lastrowid
             conn.close()
+            record_change('assets', asset_id, 'insert')
             return jsonify({'success': True, 'id': asset_id})
         else:
             conn.close()
@@ -2247,17 +3977,60 @@ def add_asset():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/assets/<int:asset_id>', methods=['PUT', 'PATCH'])
+def update_asset(asset_id):
+    # Partial update: only the fields sent are written, '' or null clears one
+    try:
+        data = {key: None if value == '' else value for key, value in (request.json or {}).items()}
+        error = check_asset_fields(data)
+        if error:
+            return jsonify({'error': error}), 400
+        if not data:
+            return jsonify({'error': 'No valid data provided'}), 400
+        try:
+            data = encode_lookups('assets', data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        conn = get_db()
+        try:
+            cursor = conn.cursor()
+            before = load_asset(cursor, asset_id, lock=True)
+            if before is None:
+                return jsonify({'error': 'Asset not found'}), 404
+            fields = [key for key in data if key in ASSET_COLUMNS]
+            cursor.execute(
+                f"UPDATE assets SET {''.join(field + ' = ?, ' for field in fields)}updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                [data[field] for field in fields] + [asset_id]
+            )
+            save_asset_sections(cursor, asset_id, data)
+            changes = record_asset_history(cursor, asset_id, 'update', before, load_asset(cursor, asset_id))
+            conn.commit()
+        except storage.IntegrityError as e:
+            return jsonify({'error': str(e)}), 400
+        finally:
+            conn.close()
+        record_change('assets', asset_id, 'update')
+        return jsonify({'success': True, 'changed': sorted(changes)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/assets/<int:asset_id>', methods=['DELETE'])
 def delete_asset(asset_id):
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute('DELETE FROM assets WHERE id = ?', (asset_id,))
+        # Only a tombstone here, purge_deleted() removes the row together
+        # with its workflows and documents
+        before = load_asset(cursor, asset_id, lock=True)
+        if before is not None:
+            cursor.execute('UPDATE assets SET deleted_at = CURRENT_TIMESTAMP WHERE id = ?', (asset_id,))
+            record_asset_history(cursor, asset_id, 'delete', before=before)
         conn.commit()
         
-        if cursor.rowcount > 0:
+        if before is not None:
             conn.close()
+            record_change('assets', asset_id, 'delete')
             return jsonify({'success': True})
         else:
             conn.close()
@@ -2266,78 +4039,395 @@ def delete_asset(asset_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/workflows')
+@conditional('workflows')
+@cached('workflows')
 def get_workflows():
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM workflows ORDER BY id DESC')
-        workflows = []
-        for row in cursor.fetchall():
-            workflow = {}
-            columns = [description[0] for description in cursor.description]
-            for i, value in enumerate(row):
-                workflow[columns[i]] = value
-            workflows.append(workflow)
-        
-        conn.close()
-        return jsonify(workflows)
+        condition, params = scope_filter('workflows')
+        conn = get_read_db()
+        cursor = conn.stream('SELECT * FROM workflows' + (' WHERE ' + condition if condition else '') + ' ORDER BY id DESC',
+                             params)
+        return stream_json_array(conn, cursor)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/workflows/<int:workflow_id>')
+@conditional('workflows')
 def get_workflow(workflow_id):
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_read_db()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM workflows WHERE id = ?', (workflow_id,))
+        condition, params = scope_filter('workflows')
+        cursor.execute('SELECT * FROM workflows WHERE id = ?' + (' AND ' + condition if condition else ''),
+                       [workflow_id] + params)
         row = cursor.fetchone()
         
         if row:
-            workflow = {}
-            columns = [description[0] for description in cursor.description]
-            for i, value in enumerate(row):
-                workflow[columns[i]] = value
+            workflow = row_factory(cursor)(row)
             conn.close()
-            return jsonify(workflow)
+            return json_response(workflow)
         else:
             conn.close()
             return jsonify({'error': 'Workflow not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def resolve_assignee(cursor, assignee_id, assigned_to):
+    # Workflows carry both the user id (work queues) and the display name;
+    # either one fills in the other
+    if assignee_id and assigned_to:
+        return assignee_id, assigned_to
+    if assignee_id:
+        cursor.execute('SELECT full_name FROM users WHERE id = ?', (assignee_id,))
+        row = cursor.fetchone()
+        return assignee_id, assigned_to or (row[0] if row else None)
+    if assigned_to:
+        cursor.execute('SELECT MIN(id) FROM users WHERE full_name = ? OR username = ?', (assigned_to, assigned_to))
+        return cursor.fetchone()[0], assigned_to
+    return None, None
+
+WORKFLOW_INSERT = '''
+    INSERT INTO workflows (title, description, status_id, priority_id, assignee_id, assigned_to, asset_id, due_date, progress)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def prepare_workflow(cursor, data):
+    # Parameters for WORKFLOW_INSERT plus (priority, due date) for the
+    # deadline scheduler. Without a due date the priority's SLA sets one.
+    # New workflows always start pending, a status in `data` is ignored:
+    # every later status goes through /transition and its checks.
+    # ValueError for an unknown priority.
+    priority_id = lookups.known('workflow_priority', data.get('priority') or 'متوسطة')
+    priority = lookups.label(priority_id)
+    due_date = data.get('due_date') or default_due_date(priority).isoformat()
+    assignee_id, assigned_to = resolve_assignee(cursor, data.get('assignee_id'), data.get('assigned_to'))
+    return (
+        data.get('title'),
+        data.get('description'),
+        lookups.id_for('workflow_status', WORKFLOW_PENDING),
+        priority_id,
+        assignee_id,
+        assigned_to,
+        data.get('asset_id'),
+        due_date,
+        data.get('progress', 0)
+    ), (priority, due_date)
+
 @app.route('/api/workflows', methods=['POST'])
 def add_workflow():
     try:
         data = request.json
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO workflows (title, description, status, priority, assigned_to, due_date, progress)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            data.get('title'),
-            data.get('description'),
-            data.get('status', 'معلقة'),
-            data.get('priority', 'متوسطة'),
-            data.get('assigned_to'),
-            data.get('due_date'),
-            data.get('progress', 0)
-        ))
+        try:
+            params, (priority, due_date) = prepare_workflow(cursor, data)
+        except ValueError as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 400
+        workflow_id = cursor.insert(WORKFLOW_INSERT, params)
+        rollups = RollupBatch(datetime.utcnow())
+        rollups.count('created')
+        rollups.write(cursor)
         
         conn.commit()
-        workflow_id = cursor.lastrowid
         conn.close()
-        return jsonify({'success': True, 'id': workflow_id})
+        deadline_scheduler.schedule(workflow_id, priority, due_date)
+        record_change('workflows', workflow_id, 'insert')
+        return jsonify({'success': True, 'id': workflow_id, 'due_date': due_date})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Bulk workflow operations
+# Create, reassign or transition many workflows in one transaction: items are
+# checked one by one, the valid ones are written with a single executemany,
+# the response reports every item and one change event carries all ids.
+BULK_MAX_ITEMS = int(os.environ.get('MADARES_BULK_MAX_ITEMS', 1000))
+
+def bulk_list(data, key):
+    items = data.get(key)
+    if not isinstance(items, list) or not items:
+        raise ValueError('%s must be a non-empty list' % key)
+    if len(items) > BULK_MAX_ITEMS:
+        raise ValueError('At most %d items per request' % BULK_MAX_ITEMS)
+    return items
+
+def bulk_response(results, operation, workflow_ids, **extra):
+    if workflow_ids:
+        record_change('workflows', None, operation, ids=workflow_ids, **extra)
+    return jsonify({
+        'success': all(result['success'] for result in results),
+        'succeeded': sum(result['success'] for result in results),
+        'failed': sum(not result['success'] for result in results),
+        'results': results
+    })
+
+def select_workflows(cursor, workflow_ids, columns='id'):
+    # Rows to change, locked until commit (see Connection.begin_write)
+    lock = ' FOR UPDATE' if cursor.storage.dialect != 'sqlite' else ''
+    cursor.execute(
+        f"SELECT {columns} FROM workflows WHERE id IN ({', '.join('?' * len(workflow_ids))}){lock}",
+        workflow_ids
+    )
+    return cursor.fetchall()
+
+@app.route('/api/workflows/bulk', methods=['POST'])
+def bulk_add_workflows():
+    # {"workflows": [{...}, ...]}, or one template for many assets:
+    # {"template": {...}, "asset_ids": [...]}
+    try:
+        data = request.json or {}
+        if 'asset_ids' in data:
+            items = [dict(data.get('template') or {}, asset_id=asset_id) for asset_id in bulk_list(data, 'asset_ids')]
+        else:
+            items = bulk_list(data, 'workflows')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db()
+        try:
+            cursor = conn.cursor()
+            asset_ids = sorted({item.get('asset_id') for item in items if isinstance(item, dict) and item.get('asset_id')})
+            existing_assets = set()
+            if asset_ids:
+                cursor.execute(
+                    f"SELECT id FROM assets WHERE id IN ({', '.join('?' * len(asset_ids))}) AND deleted_at IS NULL",
+                    asset_ids
+                )
+                existing_assets = {row[0] for row in cursor.fetchall()}
+
+            results = [None] * len(items)
+            valid = []
+            assignees = {}
+            for index, item in enumerate(items):
+                if not isinstance(item, dict) or not item.get('title'):
+                    results[index] = {'index': index, 'success': False, 'error': 'title is required'}
+                elif item.get('asset_id') and item['asset_id'] not in existing_assets:
+                    results[index] = {'index': index, 'success': False, 'error': 'Asset not found'}
+                else:
+                    # One lookup per distinct assignee, not per item
+                    key = (item.get('assignee_id'), item.get('assigned_to'))
+                    if key not in assignees:
+                        assignees[key] = resolve_assignee(cursor, *key)
+                    item = dict(item, assignee_id=assignees[key][0], assigned_to=assignees[key][1])
+                    try:
+                        valid.append((index, prepare_workflow(cursor, item)))
+                    except ValueError as e:
+                        results[index] = {'index': index, 'success': False, 'error': str(e)}
+
+            workflow_ids = cursor.insert_many(WORKFLOW_INSERT, [params for index, (params, schedule) in valid])
+            if workflow_ids:
+                rollups = RollupBatch(datetime.utcnow())
+                rollups.count('created', n=len(workflow_ids))
+                rollups.write(cursor)
+            conn.commit()
+        finally:
+            conn.close()
+        for workflow_id, (index, (params, (priority, due_date))) in zip(workflow_ids, valid):
+            deadline_scheduler.schedule(workflow_id, priority, due_date)
+            results[index] = {'index': index, 'success': True, 'id': workflow_id, 'due_date': due_date}
+        return bulk_response(results, 'insert', workflow_ids)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/workflows/bulk/reassign', methods=['POST'])
+def bulk_reassign_workflows():
+    # {"ids": [...], "assignee_id": 2} (or "assigned_to": name)
+    try:
+        data = request.json or {}
+        workflow_ids = bulk_list(data, 'ids')
+        if not data.get('assignee_id') and not data.get('assigned_to'):
+            raise ValueError('assignee_id or assigned_to is required')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db()
+        try:
+            conn.begin_write()
+            cursor = conn.cursor()
+            assignee_id, assigned_to = resolve_assignee(cursor, data.get('assignee_id'), data.get('assigned_to'))
+            if data.get('assignee_id') and assigned_to is None:
+                conn.rollback()
+                return jsonify({'error': 'User not found'}), 404
+            existing = {row[0] for row in select_workflows(cursor, workflow_ids)}
+            changed = [workflow_id for workflow_id in dict.fromkeys(workflow_ids) if workflow_id in existing]
+            cursor.executemany(
+                'UPDATE workflows SET assignee_id = ?, assigned_to = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                [(assignee_id, assigned_to, workflow_id) for workflow_id in changed]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        results = [{'index': index, 'id': workflow_id, 'success': True} if workflow_id in existing else
+                   {'index': index, 'id': workflow_id, 'success': False, 'error': 'Workflow not found'}
+                   for index, workflow_id in enumerate(workflow_ids)]
+        return bulk_response(results, 'update', changed, assignee_id=assignee_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/workflows/bulk/transition', methods=['POST'])
+def bulk_transition_workflows():
+    # {"ids": [...], "status": "قيد التنفيذ"}, each workflow must allow the move
+    try:
+        data = request.json or {}
+        workflow_ids = bulk_list(data, 'ids')
+        target = data.get('status')
+        if target not in WORKFLOW_TRANSITIONS:
+            raise ValueError('Unknown status, expected one of: ' + ', '.join(WORKFLOW_TRANSITIONS))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db()
+        try:
+            conn.begin_write()
+            cursor = conn.cursor()
+            rows = {row[0]: row[1:] for row in select_workflows(cursor, workflow_ids, 'id, status_id, ' + ROLLUP_COLUMNS)}
+            current = {workflow_id: lookups.label(row[0]) for workflow_id, row in rows.items()}
+            results = []
+            changed = {}
+            for index, workflow_id in enumerate(workflow_ids):
+                status = current.get(workflow_id)
+                if status is None:
+                    results.append({'index': index, 'id': workflow_id, 'success': False, 'error': 'Workflow not found'})
+                elif target not in WORKFLOW_TRANSITIONS.get(status, ()):
+                    results.append({'index': index, 'id': workflow_id, 'success': False,
+                                    'error': 'Cannot move a workflow from %s to %s' % (status, target)})
+                else:
+                    results.append({'index': index, 'id': workflow_id, 'success': True})
+                    changed[workflow_id] = True
+            progress = ', progress = 100' if target == WORKFLOW_COMPLETED else ''
+            target_id = lookups.id_for('workflow_status', target)
+            rollups = RollupBatch(datetime.utcnow())
+            cursor.executemany(
+                f'UPDATE workflows SET status_id = ?{progress}, status_changed_at = ?, updated_at = CURRENT_TIMESTAMP '
+                f'WHERE id = ?',
+                [(target_id, history_time(rollups.now), workflow_id) for workflow_id in changed]
+            )
+            for workflow_id in changed:
+                rollups.transition(rows[workflow_id][0], target_id, *rows[workflow_id][1:])
+            rollups.write(cursor)
+            conn.commit()
+        finally:
+            conn.close()
+        return bulk_response(results, 'update', list(changed), status=target)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/workflows/<int:workflow_id>/transition', methods=['POST'])
+def transition_workflow(workflow_id):
+    try:
+        target = (request.json or {}).get('status')
+        if target not in WORKFLOW_TRANSITIONS:
+            return jsonify({'error': 'Unknown status, expected one of: ' + ', '.join(WORKFLOW_TRANSITIONS)}), 400
+        conn = get_db()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status_id, ' + ROLLUP_COLUMNS + ' FROM workflows WHERE id = ?', (workflow_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return jsonify({'error': 'Workflow not found'}), 404
+            current = lookups.label(row[0])
+            if target not in WORKFLOW_TRANSITIONS.get(current, ()):
+                return jsonify({'error': 'Cannot move a workflow from %s to %s' % (current, target),
+                                'allowed': list(WORKFLOW_TRANSITIONS.get(current, ()))}), 409
+            # Compare-and-set: a concurrent transition makes this one fail
+            progress = ', progress = 100' if target == WORKFLOW_COMPLETED else ''
+            target_id = lookups.id_for('workflow_status', target)
+            rollups = RollupBatch(datetime.utcnow())
+            cursor.execute(
+                f'UPDATE workflows SET status_id = ?{progress}, status_changed_at = ?, updated_at = CURRENT_TIMESTAMP '
+                f'WHERE id = ? AND status_id = ?',
+                (target_id, history_time(rollups.now), workflow_id, row[0])
+            )
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return jsonify({'error': 'Workflow changed concurrently, try again'}), 409
+            rollups.transition(row[0], target_id, *row[1:])
+            rollups.write(cursor)
+            conn.commit()
+        finally:
+            conn.close()
+        record_change('workflows', workflow_id, 'update', status=target)
+        return jsonify({'success': True, 'status': target})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/workflows/engine')
+def get_workflow_engine():
+    # State machine and SLAs for clients, plus this process' scheduler
+    lang = request_lang()
+    return json_response({
+        'transitions': {lookups.translate('workflow_status', status, lang):
+                        [lookups.translate('workflow_status', target, lang) for target in targets]
+                        for status, targets in WORKFLOW_TRANSITIONS.items()},
+        'sla': {lookups.translate('workflow_priority', priority, lang): sla for priority, sla in WORKFLOW_SLA.items()},
+        'scheduler': deadline_scheduler.stats()
+    })
+
+@app.route('/api/workflows/reports')
+@conditional('workflows')
+@cached('workflows')
+def get_workflow_reports():
+    # Throughput per week, completions per assignee, cycle time per priority
+    # and time spent per status over the last ?weeks= (default 12) weeks
+    try:
+        weeks = min(max(request.args.get('weeks', 12, type=int), 1), ROLLUP_MAX_WEEKS)
+        now = datetime.utcnow()
+        since = rollup_period(now - timedelta(weeks=weeks - 1))
+        lang = request_lang()
+        conn = get_read_db()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT metric, period, dimension, bucket, count, total FROM workflow_rollups
+                WHERE metric IN ('created', 'completed', 'cycle_hours', 'stage_hours') AND period >= ?
+            ''', (since,))
+            rows = cursor.fetchall()
+            throughput = {}
+            by_assignee = {}
+            histograms = {'cycle_hours': {}, 'stage_hours': {}}
+            for metric, period, dimension, bucket, count, total in rows:
+                if metric in histograms:
+                    buckets = histograms[metric].setdefault(int(dimension.split(':')[1]), {})
+                    entry = buckets.setdefault(bucket, [0, 0.0])
+                    entry[0] += count
+                    entry[1] += total
+                elif dimension:
+                    assignee_id = int(dimension.split(':')[1])
+                    by_assignee[assignee_id] = by_assignee.get(assignee_id, 0) + count
+                else:
+                    throughput.setdefault(period, {'created': 0, 'completed': 0})[metric] += count
+            names = {}
+            if by_assignee:
+                placeholders = ', '.join('?' for assignee_id in by_assignee)
+                cursor.execute(f'SELECT id, full_name FROM users WHERE id IN ({placeholders})', list(by_assignee))
+                names = dict(cursor.fetchall())
+        finally:
+            conn.close()
+        return json_response({
+            'since': since,
+            'weeks': weeks,
+            'throughput': [dict(throughput[period], week=period) for period in sorted(throughput)],
+            'completed_by_assignee': sorted(
+                ({'assignee_id': assignee_id, 'assignee': names.get(assignee_id), 'completed': count}
+                 for assignee_id, count in by_assignee.items()),
+                key=lambda entry: -entry['completed']
+            ),
+            'cycle_time': {lookups.label(priority_id, lang): summarize_histogram(buckets)
+                           for priority_id, buckets in sorted(histograms['cycle_hours'].items())},
+            # Statuses ordered by total time spent in them, the main bottleneck first
+            'stages': {lookups.label(status_id, lang): summarize_histogram(buckets)
+                       for status_id, buckets in sorted(histograms['stage_hours'].items(),
+                                                        key=lambda item: -sum(e[1] for e in item[1].values()))}
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/workflows/<int:workflow_id>', methods=['DELETE'])
 def delete_workflow(workflow_id):
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('DELETE FROM workflows WHERE id = ?', (workflow_id,))
@@ -2345,6 +4435,7 @@ def delete_workflow(workflow_id):
         
         if cursor.rowcount > 0:
             conn.close()
+            record_change('workflows', workflow_id, 'delete')
             return jsonify({'success': True})
         else:
             conn.close()
@@ -2352,44 +4443,827 @@ def delete_workflow(workflow_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/users')
-def get_users():
+# Authentication
+# Password hashing (see hash_password) is slow on purpose, so it runs on its
+# own pool: at most AUTH_WORKERS hashes at a time, and once AUTH_MAX_PENDING
+# more are waiting further logins get a 503 instead of piling up behind them.
+# Every waiting login holds a request thread, so by default logins take at
+# most half of a worker's MADARES_THREADS and the rest keep serving.
+# No database connection is held while hashing.
+# Hashes written with another cost are upgraded to SCRYPT_N at the next
+# successful login.
+# POST /api/auth/login verifies once and keeps the user in the signed session
+# cookie. API clients may send HTTP Basic credentials instead: they are
+# verified once per AUTH_CACHE_SECONDS and then answered from an in-process
+# cache keyed by an HMAC of the credentials.
+WORKER_THREADS = int(os.environ.get('MADARES_THREADS', 8))
+AUTH_WORKERS = int(os.environ.get('MADARES_AUTH_WORKERS', 2))
+AUTH_MAX_PENDING = int(os.environ.get('MADARES_AUTH_MAX_PENDING', max(0, WORKER_THREADS // 2 - AUTH_WORKERS)))
+AUTH_CACHE_SECONDS = int(os.environ.get('MADARES_AUTH_CACHE_SECONDS', 300))
+AUTH_CACHE_SIZE = 1024
+
+password_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix='auth')
+_password_slots = threading.BoundedSemaphore(AUTH_WORKERS + AUTH_MAX_PENDING)
+_dummy_hash = None
+
+class AuthBusy(Exception):
+    pass
+
+def run_password_task(fn, *args):
+    # The calling thread waits, but no more than AUTH_WORKERS hashes burn CPU
+    # at once and the queue behind them is bounded
+    if not _password_slots.acquire(blocking=False):
+        raise AuthBusy('Too many logins in progress, try again shortly')
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM users ORDER BY id DESC')
-        users = []
-        for row in cursor.fetchall():
-            user = {}
-            columns = [description[0] for description in cursor.description]
-            for i, value in enumerate(row):
-                if columns[i] != 'password':  # Don't return passwords
-                    user[columns[i]] = value
-            users.append(user)
+        future = password_executor.submit(fn, *args)
+    except BaseException:
+        _password_slots.release()
+        raise
+    future.add_done_callback(lambda future: _password_slots.release())
+    return future.result()
+
+class CredentialCache:
+    # HMAC(credentials) -> (user, expiry), least recently used entries go first
+    def __init__(self, ttl=AUTH_CACHE_SECONDS, max_size=AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, username, password):
+        return hmac.new(app.secret_key.encode('utf-8'), ('%s\0%s' % (username, password)).encode('utf-8'),
+                        hashlib.sha256).digest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, user):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            for key in [key for key, (user, expires) in self._entries.items() if user['id'] == user_id]:
+                del self._entries[key]
+
+credential_cache = CredentialCache()
+
+def authenticate(username, password):
+    # The user ({id, username, full_name, role_id, region}) or None
+    key = credential_cache.key(username, password)
+    user = credential_cache.get(key)
+    if user is not None:
+        return user
+    conn = get_db()
+    try:
+        row = conn.execute('SELECT id, username, password, full_name, role_id, region FROM users WHERE username = ?',
+                           (username,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        # Same work as for a known user, response times don't reveal usernames
+        global _dummy_hash
+        if _dummy_hash is None:
+            _dummy_hash = hash_password(os.urandom(16).hex())
+        run_password_task(verify_password, _dummy_hash, password)
+        return None
+    user_id, username, stored, full_name, role_id, region = row
+    if not run_password_task(verify_password, stored, password):
+        return None
+    if needs_rehash(stored):
+        rehashed = run_password_task(hash_password, password)
+        conn = get_db()
+        try:
+            # Unless the password was changed meanwhile
+            conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?', (rehashed, user_id, stored))
+            conn.commit()
+        finally:
+            conn.close()
+    user = {'id': user_id, 'username': username, 'full_name': full_name, 'role_id': role_id, 'region': region}
+    credential_cache.put(key, user)
+    return user
+
+def user_response(user):
+    return {'id': user['id'], 'username': user['username'], 'full_name': user['full_name'],
+            'role': lookups.label(user['role_id'], request_lang())}
+
+@app.before_request
+def load_credentials():
+    auth = request.authorization
+    if auth is None:
+        return None
+    if auth.type == 'bearer':
+        if request.path == '/metrics' and scraper_authorized():
+            g.scraper = True
+            return None
+        g.auth_user = load_token(auth.token)
+        if g.auth_user is None:
+            return jsonify({'error': 'Invalid or expired token'}), 401, {'WWW-Authenticate': 'Bearer'}
+        return None
+    if auth.type != 'basic' or not auth.username:
+        return None
+    try:
+        user = authenticate(auth.username, auth.password or '')
+    except AuthBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    if user is None:
+        return jsonify({'error': 'Invalid username or password'}), 401, {'WWW-Authenticate': 'Basic realm="madares"'}
+    g.auth_user = user
+
+def check_login():
+    # (user, None) for valid {"username", "password"}, else (None, error response)
+    data = request.get_json(silent=True) or {}
+    username = data.get('username')
+    password = data.get('password')
+    if not username or not password:
+        return None, (jsonify({'error': 'username and password are required'}), 400)
+    try:
+        user = authenticate(username, password)
+    except AuthBusy as e:
+        return None, (jsonify({'error': str(e)}), 503, {'Retry-After': '1'})
+    except Exception as e:
+        return None, (jsonify({'error': str(e)}), 500)
+    if user is None:
+        return None, (jsonify({'error': 'Invalid username or password'}), 401)
+    return user, None
+
+SESSION_USER_KEYS = ('username', 'user_id', 'role_id', 'region')
+
+@app.route('/api/auth/login', methods=['POST'])
+def auth_login():
+    user, error = check_login()
+    if error:
+        return error
+    session['username'] = user['username']
+    session['user_id'] = user['id']
+    session['role_id'] = user['role_id']
+    session['region'] = user['region']
+    return jsonify({'success': True, 'user': user_response(user), 'token': issue_token(user)})
+
+@app.route('/api/auth/token', methods=['POST'])
+def auth_token():
+    # Bearer token for API clients: Authorization: Bearer <token>
+    user, error = check_login()
+    if error:
+        return error
+    return jsonify({'token': issue_token(user), 'token_type': 'Bearer', 'expires_in': TOKEN_MAX_AGE})
+
+@app.route('/api/auth/logout', methods=['POST'])
+def auth_logout():
+    for key in SESSION_USER_KEYS:
+        session.pop(key, None)
+    return jsonify({'success': True})
+
+@app.route('/api/auth/me')
+def auth_me():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Not signed in'}), 401
+    try:
+        conn = get_read_db()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, username, full_name, role_id FROM users WHERE id = ?', (user_id,))
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return jsonify({'error': 'Not signed in'}), 401
+        return jsonify(user_response(dict(zip(('id', 'username', 'full_name', 'role_id'), row))))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Access control
+# A request's user comes from a signed bearer token (POST /api/auth/token),
+# HTTP Basic credentials or the session cookie, and carries its role and
+# region. role_permissions (migrations/0010_access_policy.sql) says which
+# role may read or write each resource, everywhere ('all') or only within its
+# own region ('region'). AccessPolicy compiles the table into a dict and each
+# route into its (resource, action) once, so the check costs two lookups.
+# Region scoped requests get the region added to the WHERE clause of their
+# queries (scope_filter()), rows of other regions are never fetched; their
+# cache entries and ETags are kept apart by scope_key(). Requests without
+# credentials get 401; MADARES_AUTH_REQUIRED=0 lets them read (never write),
+# for local development.
+AUTH_REQUIRED = os.environ.get('MADARES_AUTH_REQUIRED', '1') != '0'
+TOKEN_MAX_AGE = int(os.environ.get('MADARES_TOKEN_MAX_AGE', 8 * 3600))
+POLICY_RELOAD_SECONDS = int(os.environ.get('MADARES_POLICY_RELOAD_SECONDS', 60))
+PUBLIC_RESOURCES = ('auth', 'lookups')
+ROUTE_RESOURCES = {'me': 'workflows', 'cache': 'system', 'db': 'system', 'limits': 'system', 'profiling': 'system'}
+# Can't be narrowed to a region: region scoped roles are refused
+UNSCOPED_RESOURCES = ('reports', 'system')
+
+token_serializer = URLSafeTimedSerializer(app.secret_key, salt='madares-api-token')
+
+def issue_token(user):
+    return token_serializer.dumps({'sub': user['id'], 'name': user['username'],
+                                   'role': user['role_id'], 'region': user['region']})
+
+def load_token(token):
+    # The user a token was issued to, None when it is forged or expired
+    try:
+        claims = token_serializer.loads(token, max_age=TOKEN_MAX_AGE)
+    except BadData:
+        return None
+    return {'id': claims['sub'], 'username': claims['name'], 'role_id': claims['role'], 'region': claims['region']}
+
+class AccessPolicy:
+    def __init__(self):
+        self._rules = None
+        self._loaded_at = 0
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        conn = get_read_db()
+        try:
+            rows = conn.execute('SELECT role_id, resource, action, scope FROM role_permissions').fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            self._rules = {(role_id, resource, action): scope for role_id, resource, action, scope in rows}
+            self._loaded_at = time.monotonic()
+
+    def rules(self):
+        if self._rules is None or time.monotonic() - self._loaded_at > POLICY_RELOAD_SECONDS:
+            self.load()
+        return self._rules
+
+    def scope(self, role_id, resource, action):
+        # 'all', 'region' or None (denied)
+        return self.rules().get((role_id, resource, action))
+
+    def covers(self, role_id, other_role_id):
+        # True when role_id holds every grant of other_role_id, at least as
+        # widely: users can't hand out more access than they have
+        rules = self.rules()
+        return all(rules.get((role_id, resource, action)) in (scope, 'all')
+                   for (role, resource, action), scope in rules.items() if role == other_role_id)
+
+    def route(self, rule, method):
+        # (resource, action) a route needs, None for public routes
+        key = (rule, method)
+        if key not in self._routes:
+            parts = rule.strip('/').split('/')
+            permission = None
+            if parts[0] == 'metrics':
+                permission = ('system', 'read')
+            elif parts[0] == 'api' and len(parts) > 1:
+                if 'reports' in parts:
+                    resource = 'reports'
+                elif 'workflows' in parts:
+                    resource = 'workflows'
+                else:
+                    resource = ROUTE_RESOURCES.get(parts[1], parts[1])
+                if resource not in PUBLIC_RESOURCES:
+                    permission = (resource, 'read' if method in ('GET', 'HEAD', 'OPTIONS') else 'write')
+            self._routes[key] = permission
+        return self._routes[key]
+
+    def stats(self):
+        return {'rules': len(self._rules or ()), 'routes': len(self._routes)}
+
+access_policy = AccessPolicy()
+
+def current_principal():
+    # {id, username, role_id, region} of the signed-in user or None
+    if not has_request_context():
+        return None
+    user = g.get('auth_user')
+    if user is None and session.get('user_id') is not None:
+        user = {'id': session['user_id'], 'username': session.get('username'),
+                'role_id': session.get('role_id'), 'region': session.get('region')}
+    return user
+
+def scope_filter(table, alias=None):
+    # (condition, params) limiting `table` to the request's region, or
+    # (None, []) when the request may see every row
+    region = g.get('region') if has_request_context() else None
+    if region is None:
+        return None, []
+    return region_condition(table, alias or table, region, current_principal()['id'])
+
+def region_condition(table, alias, region, user_id):
+    if table == 'users':
+        return f'{alias}.region = ?', [region]
+    # A user's region names either an asset's region or its city (جدة is
+    # in the مكة المكرمة region)
+    if table == 'assets':
+        return f'({alias}.region = ? OR {alias}.city = ?)', [region, region]
+    if table == 'documents':
+        return f'{alias}.asset_id IN (SELECT id FROM assets WHERE region = ? OR city = ?)', [region, region]
+    if table == 'workflows':
+        # Plus the user's own tasks, wherever they are
+        return (f'({alias}.asset_id IN (SELECT id FROM assets WHERE region = ? OR city = ?) OR {alias}.assignee_id = ?)',
+                [region, region, user_id])
+    raise ValueError('No region scope for ' + table)
+
+class EventFilter:
+    # Change events a subscriber may see, decided per entity like its list
+    # requests: entities it can't read are dropped, region scoped ones are
+    # looked up with one query per table and batch of events. Deletes of rows
+    # that are already gone carry nothing but the id and are passed on.
+    TABLES = ('assets', 'workflows', 'documents', 'users')
+
+    def __init__(self, user):
+        self.region = user['region']
+        self.user_id = user['id']
+        self.scopes = {}
+        for table in self.TABLES:
+            scope = access_policy.scope(user['role_id'], table, 'read')
+            # Like authorize_request, a user without a region isn't narrowed
+            self.scopes[table] = 'all' if scope == 'region' and self.region is None else scope
+
+    @classmethod
+    def for_user(cls, user):
+        # None when the user may see every event
+        if user is None:
+            return None
+        event_filter = cls(user)
+        if all(scope == 'all' for scope in event_filter.scopes.values()):
+            return None
+        return event_filter
+
+    def apply(self, events):
+        # Payloads of the broker's (id, payload, event) entries to send
+        wanted = {}
+        for event_id, payload, event in events:
+            if self.scopes.get(event['entity']) == 'region':
+                wanted.setdefault(event['entity'], set()).update(event_row_ids(event))
+        visible = {}
+        if wanted:
+            conn = get_db()
+            try:
+                for table, ids in wanted.items():
+                    ids = sorted(ids)
+                    condition, params = region_condition(table, table, self.region, self.user_id)
+                    visible[table] = dict(conn.execute(
+                        f"SELECT id, CASE WHEN {condition} THEN 1 ELSE 0 END FROM {table} "
+                        f"WHERE id IN ({', '.join('?' * len(ids))})",
+                        params + ids
+                    ).fetchall())
+            finally:
+                conn.close()
         
+        payloads = []
+        for event_id, payload, event in events:
+            scope = self.scopes.get(event['entity'])
+            if scope == 'all':
+                payloads.append(payload)
+            elif scope == 'region':
+                rows = visible[event['entity']]
+                gone = event['operation'] == 'delete'
+                ids = [row_id for row_id in event_row_ids(event) if rows.get(row_id, gone)]
+                if event['id'] is not None or len(ids) == len(event['ids']):
+                    if ids:
+                        payloads.append(payload)
+                elif ids:
+                    payloads.append(encode_event(event_id, dict(event, ids=ids)))
+        return payloads
+
+def event_row_ids(event):
+    return event['ids'] if event['id'] is None else [event['id']]
+
+def asset_in_scope(conn, asset_id):
+    condition, params = scope_filter('assets')
+    if condition is None:
+        return True
+    return conn.execute('SELECT 1 FROM assets WHERE id = ? AND ' + condition, [asset_id] + params).fetchone() is not None
+
+def scope_key():
+    # Tells apart cached responses and ETags of differently scoped requests
+    region = g.get('region') if has_request_context() else None
+    if region is None:
+        return ''
+    key = '%s:%s' % (region, current_principal()['id'])
+    return 'scope-' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+# View argument -> table of the row a write targets
+WRITE_TARGETS = {'asset_id': 'assets', 'workflow_id': 'workflows', 'doc_id': 'documents', 'user_id': 'users'}
+
+def check_region_write(resource):
+    # Region scoped writes may only touch rows in the region and may not move
+    # or create them elsewhere. None when allowed, else the error response.
+    region = g.region
+    for arg, table in WRITE_TARGETS.items():
+        if arg in (request.view_args or {}):
+            condition, params = scope_filter(table)
+            conn = get_read_db()
+            try:
+                row = conn.execute(f'SELECT 1 FROM {table} WHERE id = ? AND {condition}',
+                                   [request.view_args[arg]] + params).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                return jsonify({'error': '%s not found' % table[:-1].capitalize()}), 404
+            break
+    data = (request.get_json(silent=True) if request.is_json else request.form) or {}
+    if not hasattr(data, 'get'):
+        data = {}
+    if resource == 'assets':
+        moved = request.method == 'POST' or 'region' in data or 'city' in data
+        if moved and region not in (data.get('region'), data.get('city')):
+            return jsonify({'error': 'Assets can only be placed in region ' + region}), 403
+    elif request.method == 'POST' and not request.view_args:
+        # New workflows and documents belong to an asset of the region
+        condition, params = scope_filter('assets')
+        conn = get_read_db()
+        try:
+            row = conn.execute('SELECT 1 FROM assets WHERE id = ? AND ' + condition, [data.get('asset_id')] + params).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return jsonify({'error': 'asset_id must be an asset in region ' + region}), 403
+    return None
+
+@app.before_request
+def authorize_request():
+    if request.url_rule is None:
+        return None
+    permission = access_policy.route(request.url_rule.rule, request.method)
+    if permission is None or g.get('scraper'):
+        return None
+    user = current_principal()
+    if user is None:
+        if AUTH_REQUIRED or permission[1] != 'read':
+            return jsonify({'error': 'Sign in required'}), 401
+        return None
+    resource, action = permission
+    scope = access_policy.scope(user['role_id'], resource, action)
+    if scope is None or (scope == 'region' and (resource in UNSCOPED_RESOURCES or '/bulk' in request.url_rule.rule)):
+        return jsonify({'error': 'Not allowed to %s %s' % (action, resource)}), 403
+    if scope == 'region':
+        g.region = user['region']
+        if action == 'write':
+            return check_region_write(resource)
+    return None
+
+def authorize_headers(authorization, cookie, resource, action):
+    # For routes served outside Flask (asgi.py's /api/events): (error, user),
+    # the error is (status, message) or None when the request may go ahead
+    user = None
+    if authorization and authorization[:7].lower() == 'bearer ':
+        user = load_token(authorization[7:].strip())
+    elif cookie:
+        name = app.config['SESSION_COOKIE_NAME']
+        for part in cookie.split(';'):
+            key, _, value = part.strip().partition('=')
+            if key == name:
+                try:
+                    data = app.session_interface.get_signing_serializer(app).loads(
+                        value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+                except BadData:
+                    break
+                if data.get('user_id') is not None:
+                    user = {'id': data['user_id'], 'role_id': data.get('role_id'), 'region': data.get('region')}
+                break
+    if user is None:
+        return ((401, 'Sign in required') if AUTH_REQUIRED else None), None
+    if access_policy.scope(user['role_id'], resource, action) is None:
+        return (403, 'Not allowed to %s %s' % (action, resource)), user
+    return None, user
+
+# Profiling
+# Managers can have the next N requests to a route profiled
+# (POST /api/profiling {"route": "/api/assets", "count": 5}), or send
+# X-Madares-Profile: 1 with any request. Each profile is a cProfile run of
+# the request's thread, stored in PROFILE_DIR as .pstats (for pstats or
+# snakeviz) and .collapsed (for flamegraph.pl or speedscope); the response
+# carries its name in X-Madares-Profile-Id. While nothing is armed the only
+# cost per request is one dict and one header lookup. Armed routes are per
+# worker process.
+PROFILE_DIR = os.environ.get('MADARES_PROFILE_DIR', '/tmp/madares-profiles')
+PROFILE_MAX_FILES = int(os.environ.get('MADARES_PROFILE_MAX_FILES', 50))
+PROFILE_MAX_COUNT = 100
+PROFILE_HEADER = 'X-Madares-Profile'
+PROFILE_NAME = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}\.(pstats|collapsed)$')
+
+_profile_targets = {}  # route rule -> requests left to profile
+_profile_lock = threading.Lock()
+
+def profiling_allowed():
+    # Only for signed-in users with write access to 'system', also while
+    # anonymous requests are otherwise allowed
+    user = current_principal()
+    return user is not None and access_policy.scope(user['role_id'], 'system', 'write') == 'all'
+
+def collapsed_stacks(stats):
+    # pstats -> {'root;caller;function': microseconds of own time}. cProfile
+    # records caller -> callee edges, not whole stacks, so a function's time
+    # is split among its callers in proportion to the time of each edge.
+    entries = stats.stats
+    children = {}
+    for function, (cc, nc, tt, ct, callers) in entries.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((function, edge[3]))
+
+    def label(function):
+        filename, line, name = function
+        return ('%s (%s:%d)' % (name, os.path.basename(filename), line) if line else name).replace(';', ',')
+
+    stacks = {}
+
+    def walk(function, path, seen, share):
+        path = path + (label(function),)
+        own = entries[function][2] * share
+        if own > 0:
+            key = ';'.join(path)
+            stacks[key] = stacks.get(key, 0) + own
+        if len(path) >= 64:
+            return
+        for child, edge_time in children.get(function, ()):
+            child_time = entries[child][3]
+            if child not in seen and child_time > 0 and edge_time > 0:
+                walk(child, path, seen | {child}, share * edge_time / child_time)
+
+    for function, entry in entries.items():
+        if not entry[4]:
+            walk(function, (), {function}, 1.0)
+    return {stack: int(seconds * 1e6) for stack, seconds in stacks.items() if seconds * 1e6 >= 1}
+
+def save_profile(profiler, profile_id, route, method, path, seconds):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(os.path.join(PROFILE_DIR, profile_id + '.pstats'))
+    with open(os.path.join(PROFILE_DIR, profile_id + '.collapsed'), 'w', encoding='utf-8') as f:
+        for stack, micros in sorted(collapsed_stacks(stats).items()):
+            f.write('%s %d\n' % (stack, micros))
+    with open(os.path.join(PROFILE_DIR, profile_id + '.json'), 'wb') as f:
+        f.write(json_dumps({'id': profile_id, 'route': route, 'method': method, 'path': path,
+                            'seconds': round(seconds, 6), 'created_at': history_time(datetime.utcnow())}))
+    # Oldest profiles go first
+    profiles = sorted(name[:-5] for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+    for old in profiles[:-PROFILE_MAX_FILES]:
+        for extension in ('.json', '.pstats', '.collapsed'):
+            remove_file(os.path.join(PROFILE_DIR, old + extension))
+
+@app.before_request
+def start_profiler():
+    if not _profile_targets and PROFILE_HEADER not in request.headers:
+        return None
+    if request.headers.get(PROFILE_HEADER):
+        if not profiling_allowed():
+            return None
+    else:
+        rule = request.url_rule.rule if request.url_rule else None
+        with _profile_lock:
+            left = _profile_targets.get(rule)
+            if not left:
+                return None
+            if left > 1:
+                _profile_targets[rule] = left - 1
+            else:
+                del _profile_targets[rule]
+    g.profile_id = '%s-%s' % (datetime.utcnow().strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+    g.profile_started = time.perf_counter()
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+def profile_finisher():
+    # Stops the request's profiler and saves it, callable without the request
+    # context. Streamed bodies (stream_json_array) are produced after
+    # teardown, so the profile ends when the server closes the response.
+    profiler = g.pop('profiler')
+    profile_id, started = g.profile_id, g.profile_started
+    route = request.url_rule.rule if request.url_rule else None
+    method, path = request.method, request.full_path
+
+    def finish():
+        profiler.disable()
+        try:
+            save_profile(profiler, profile_id, route, method, path, time.perf_counter() - started)
+        except OSError:
+            app.logger.exception('Could not save profile %s', profile_id)
+    return finish
+
+@app.after_request
+def tag_profiled_response(response):
+    if g.get('profiler') is not None:
+        response.headers['X-Madares-Profile-Id'] = g.profile_id
+        response.call_on_close(profile_finisher())
+    return response
+
+@app.teardown_request
+def stop_profiler(exc=None):
+    # Requests that failed before a response was made
+    if g.get('profiler') is not None:
+        profile_finisher()()
+
+@app.route('/api/profiling', methods=['GET', 'POST', 'DELETE'])
+def profiling():
+    # GET: armed routes and stored profiles, POST {"route", "count"}: profile
+    # the next requests to route, DELETE: disarm everything
+    if not profiling_allowed():
+        return jsonify({'error': 'Profiling needs a signed-in user with system access'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        route = data.get('route')
+        count = data.get('count', 1)
+        if route not in {rule.rule for rule in app.url_map.iter_rules()}:
+            return jsonify({'error': 'Unknown route, use the pattern, e.g. /api/assets/<int:asset_id>'}), 400
+        if not isinstance(count, int) or not 1 <= count <= PROFILE_MAX_COUNT:
+            return jsonify({'error': 'count must be between 1 and %d' % PROFILE_MAX_COUNT}), 400
+        with _profile_lock:
+            _profile_targets[route] = count
+    elif request.method == 'DELETE':
+        with _profile_lock:
+            _profile_targets.clear()
+    profiles = []
+    if os.path.isdir(PROFILE_DIR):
+        for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(PROFILE_DIR, name), 'rb') as f:
+                        profile = json_loads(f.read())
+                except (OSError, ValueError):
+                    continue
+                profile['files'] = [profile['id'] + '.pstats', profile['id'] + '.collapsed']
+                profiles.append(profile)
+    with _profile_lock:
+        armed = dict(_profile_targets)
+    return json_response({'armed': armed, 'profiles': profiles})
+
+@app.route('/api/profiling/<name>')
+def download_profile(name):
+    if not profiling_allowed():
+        return jsonify({'error': 'Profiling needs a signed-in user with system access'}), 403
+    if not PROFILE_NAME.match(name) or not os.path.exists(os.path.join(PROFILE_DIR, name)):
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True,
+                               mimetype='text/plain' if name.endswith('.collapsed') else 'application/octet-stream')
+
+# Work queues
+# A user's workflows of one status, most urgent first: priority from high to
+# low, then due date. Each (status, priority) slice is one range of
+# idx_workflows_assignee (migrations/0007_assignee_queues.py) read after a
+# keyset cursor, so a page costs the same however many workflows exist.
+QUEUE_STATUSES = (WORKFLOW_IN_PROGRESS, WORKFLOW_PENDING)
+QUEUE_PAGE_SIZE = 50
+QUEUE_MAX_PAGE_SIZE = 200
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json_dumps(values)).decode('ascii')
+
+def decode_cursor(value):
+    return json_loads(base64.urlsafe_b64decode(value.encode('ascii')))
+
+def queue_priorities():
+    # Known priorities from high to low, then any added later
+    known = [lookups.id_for('workflow_priority', priority) for priority in WORKFLOW_SLA]
+    return known + [entry['id'] for entry in lookups.values().get('workflow_priority', []) if entry['id'] not in known]
+
+def fetch_queue(cursor, assignee_id, status_ids, after=None, limit=QUEUE_PAGE_SIZE):
+    # Rows of one page and the cursor of the next one (None on the last page).
+    # `after` is [status_id, priority_id, due_date, id] of the previous
+    # page's last row.
+    segments = [(status_id, priority_id) for status_id in status_ids for priority_id in queue_priorities()]
+    if after:
+        segments = segments[segments.index(tuple(after[:2])):]
+    rows = []
+    condition, scope_params = scope_filter('workflows')
+    for status_id, priority_id in segments:
+        query = 'SELECT * FROM workflows WHERE assignee_id = ? AND status_id = ? AND priority_id = ?'
+        params = [assignee_id, status_id, priority_id]
+        if condition:
+            query += ' AND ' + condition
+            params.extend(scope_params)
+        if after and (status_id, priority_id) == tuple(after[:2]):
+            query += ' AND (due_date, id) > (?, ?)'
+            params.extend(after[2:])
+        # One row more than the page tells whether there is a next page
+        cursor.execute(query + ' ORDER BY due_date, id LIMIT ?', params + [limit + 1 - len(rows)])
+        make_row = row_factory(cursor)
+        rows.extend((status_id, priority_id, make_row(row)) for row in cursor.fetchall())
+        if len(rows) > limit:
+            break
+    if len(rows) <= limit:
+        return [row for status_id, priority_id, row in rows], None
+    status_id, priority_id, last = rows[limit - 1]
+    next_cursor = [status_id, priority_id, str(as_date(last['due_date'])), last['id']]
+    return [row for status_id, priority_id, row in rows[:limit]], encode_cursor(next_cursor)
+
+def queue_response(user_id):
+    status = request.args.get('status')
+    if status:
+        status_id = lookups.find('workflow_status', status)
+        if status_id is None:
+            return jsonify({'error': 'Unknown status: ' + status}), 400
+        status_ids = [status_id]
+    else:
+        status_ids = [lookups.id_for('workflow_status', status) for status in QUEUE_STATUSES]
+    limit = min(max(request.args.get('limit', QUEUE_PAGE_SIZE, type=int), 1), QUEUE_MAX_PAGE_SIZE)
+    try:
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        if after is not None and (not isinstance(after, list) or len(after) != 4 or after[0] not in status_ids):
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    conn = get_read_db()
+    try:
+        items, next_cursor = fetch_queue(conn.cursor(), user_id, status_ids, after, limit)
+    except ValueError:  # cursor from a priority that no longer exists
+        return jsonify({'error': 'Invalid cursor'}), 400
+    finally:
+        conn.close()
+    return json_response({'items': items, 'next_cursor': next_cursor})
+
+def queue_counts_response(user_id):
+    # Index-only: the user's slice of idx_workflows_assignee
+    conn = get_read_db()
+    try:
+        cursor = conn.cursor()
+        condition, params = scope_filter('workflows')
+        cursor.execute('SELECT status_id, COUNT(*) FROM workflows WHERE assignee_id = ?'
+                       + (' AND ' + condition if condition else '') + ' GROUP BY status_id', [user_id] + params)
+        lang = request_lang()
+        counts = {lookups.label(status_id, lang): count for status_id, count in cursor.fetchall()}
+    finally:
         conn.close()
-        return jsonify(users)
+    return json_response(counts)
+
+def current_user_id():
+    user = current_principal()
+    return user['id'] if user else None
+
+@app.route('/api/users/<int:user_id>/workflows')
+@conditional('workflows')
+@cached('workflows')
+def get_user_queue(user_id):
+    try:
+        return queue_response(user_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/users/<int:user_id>/workflows/counts')
+@conditional('workflows')
+@cached('workflows')
+def get_user_queue_counts(user_id):
+    try:
+        return queue_counts_response(user_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# The signed-in user's queue. Not cached: the URL is the same for everyone.
+@app.route('/api/me/workflows')
+def get_my_queue():
+    try:
+        user_id = current_user_id()
+        if user_id is None:
+            return jsonify({'error': 'Not signed in'}), 401
+        return queue_response(user_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/me/workflows/counts')
+def get_my_queue_counts():
+    try:
+        user_id = current_user_id()
+        if user_id is None:
+            return jsonify({'error': 'Not signed in'}), 401
+        return queue_counts_response(user_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/users')
+@conditional('users')
+@cached('users')
+def get_users():
+    try:
+        condition, params = scope_filter('users')
+        conn = get_read_db()
+        cursor = conn.stream('SELECT * FROM users' + (' WHERE ' + condition if condition else '') + ' ORDER BY id DESC', params)
+        return stream_json_array(conn, cursor, exclude=('password',))  # Don't return passwords
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users/<int:user_id>')
+@conditional('users')
 def get_user(user_id):
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_read_db()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
+        condition, params = scope_filter('users')
+        cursor.execute('SELECT * FROM users WHERE id = ?' + (' AND ' + condition if condition else ''), [user_id] + params)
         row = cursor.fetchone()
         
         if row:
-            user = {}
-            columns = [description[0] for description in cursor.description]
-            for i, value in enumerate(row):
-                if columns[i] != 'password':  # Don't return password
-                    user[columns[i]] = value
+            user = row_factory(cursor, exclude=('password',))(row)  # Don't return password
             conn.close()
-            return jsonify(user)
+            return json_response(user)
         else:
             conn.close()
             return jsonify({'error': 'User not found'}), 404
@@ -2400,33 +5274,42 @@ def get_user(user_id):
 def add_user():
     try:
         data = request.json
-        conn = sqlite3.connect('/tmp/madares.db')
+        try:
+            role_id = lookups.known('user_role', data.get('role') or 'مستخدم')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not access_policy.covers(current_principal()['role_id'], role_id):
+            return jsonify({'error': 'Not allowed to assign role %s' % (data.get('role') or 'مستخدم')}), 403
+        password = run_password_task(hash_password, data['password']) if data.get('password') else None
+        conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO users (username, password, full_name, email, role, department, region)
+        user_id = cursor.insert('''
+            INSERT INTO users (username, password, full_name, email, role_id, department, region)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (
             data.get('username'),
-            data.get('password'),
+            password,
             data.get('full_name'),
             data.get('email'),
-            data.get('role', 'مستخدم'),
+            role_id,
             data.get('department'),
             data.get('region')
         ))
         
         conn.commit()
-        user_id = cursor.lastrowid
         conn.close()
+        record_change('users', user_id, 'insert')
         return jsonify({'success': True, 'id': user_id})
+    except AuthBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
@@ -2434,6 +5317,8 @@ def delete_user(user_id):
         
         if cursor.rowcount > 0:
             conn.close()
+            credential_cache.forget(user_id)
+            record_change('users', user_id, 'delete')
             return jsonify({'success': True})
         else:
             conn.close()
@@ -2442,52 +5327,75 @@ def delete_user(user_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/documents')
+@conditional('documents', 'assets')
+@cached('documents', 'assets')
 def get_documents():
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        condition, params = scope_filter('documents', 'd')
+        scope = ' AND ' + condition if condition else ''
+        conn = get_read_db()
+        cursor = conn.stream(f'''
             SELECT d.*, a.asset_name 
             FROM documents d 
             LEFT JOIN assets a ON d.asset_id = a.id 
+            WHERE d.deleted_at IS NULL{scope}
             ORDER BY d.id DESC
-        ''')
-        documents = []
-        for row in cursor.fetchall():
-            doc = {}
-            columns = [description[0] for description in cursor.description]
-            for i, value in enumerate(row):
-                doc[columns[i]] = value
-            documents.append(doc)
-        
-        conn.close()
-        return jsonify(documents)
+        ''', params)
+        return stream_json_array(conn, cursor)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/documents/<int:doc_id>')
+@conditional('documents')
 def get_document(doc_id):
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_read_db()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        condition, params = scope_filter('documents')
+        cursor.execute('SELECT * FROM documents WHERE id = ? AND deleted_at IS NULL' + (' AND ' + condition if condition else ''),
+                       [doc_id] + params)
         row = cursor.fetchone()
         
         if row:
-            doc = {}
-            columns = [description[0] for description in cursor.description]
-            for i, value in enumerate(row):
-                doc[columns[i]] = value
+            doc = row_factory(cursor)(row)
             conn.close()
-            return jsonify(doc)
+            return json_response(doc)
         else:
             conn.close()
             return jsonify({'error': 'Document not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Document processing
+# Uploads are stored as <uuid4>_<original name> in UPLOAD_DIR
+UPLOAD_DIR = os.environ.get('MADARES_UPLOAD_DIR', '/tmp')
+UPLOAD_NAME = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}_')
+ocr_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('MADARES_OCR_WORKERS', 2)), thread_name_prefix='ocr')
+
+def set_processing_status(doc_id, status, ocr_text=None):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        'UPDATE documents SET processing_status = ?, ocr_text = COALESCE(?, ocr_text) WHERE id = ?',
+        (status, ocr_text, doc_id)
+    )
+    conn.commit()
+    conn.close()
+    record_change('documents', doc_id, 'update', processing_status=status)
+
+def process_document(doc_id, original_filename):
+    try:
+        set_processing_status(doc_id, 'قيد المعالجة')
+        
+        # Simulate OCR processing
+        ocr_text = f"OCR processed text for {original_filename} - تم معالجة النص بنجاح"
+        
+        set_processing_status(doc_id, 'مكتمل', ocr_text)
+    except Exception:
+        app.logger.exception('Processing document %s failed', doc_id)
+        set_processing_status(doc_id, 'فشل')
+
 @app.route('/api/documents', methods=['POST'])
 def upload_document():
     try:
@@ -2498,60 +5406,61 @@ def upload_document():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # Save file to /tmp directory
         filename = str(uuid.uuid4()) + '_' + file.filename
-        file_path = os.path.join('/tmp', filename)
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        file_path = os.path.join(UPLOAD_DIR, filename)
         file.save(file_path)
         
         # Get file size
         file_size = os.path.getsize(file_path)
         
-        # Simulate OCR processing
-        ocr_text = f"OCR processed text for {file.filename} - تم معالجة النص بنجاح"
-        
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO documents (filename, original_filename, document_type, asset_id, file_size, ocr_text, processing_status, file_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        doc_id = cursor.insert('''
+            INSERT INTO documents (filename, original_filename, document_type, asset_id, file_size, processing_status, file_path)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (
             filename,
             file.filename,
             request.form.get('document_type'),
             request.form.get('asset_id') if request.form.get('asset_id') else None,
             file_size,
-            ocr_text,
-            'مكتمل',
+            'معلق',
             file_path
         ))
         
         conn.commit()
-        doc_id = cursor.lastrowid
         conn.close()
+        record_change('documents', doc_id, 'insert', processing_status='معلق')
+        
+        # OCR completion is pushed to clients through /api/events. Serverless
+        # functions are frozen after the response, so process inline there.
+        if os.environ.get('VERCEL'):
+            process_document(doc_id, file.filename)
+        else:
+            ocr_executor.submit(process_document, doc_id, file.filename)
         
-        return jsonify({'success': True, 'id': doc_id})
+        return jsonify({'success': True, 'id': doc_id, 'processing_status': 'معلق'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/documents/<int:doc_id>', methods=['DELETE'])
 def delete_document(doc_id):
     try:
-        conn = sqlite3.connect('/tmp/madares.db')
+        conn = get_db()
         cursor = conn.cursor()
         
-        # Get file path before deleting
-        cursor.execute('SELECT file_path FROM documents WHERE id = ?', (doc_id,))
-        row = cursor.fetchone()
-        
-        if row and row[0] and os.path.exists(row[0]):
-            os.remove(row[0])
-        
-        cursor.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+        # The file is removed by purge_deleted(), outside the request
+        cursor.execute(
+            'UPDATE documents SET deleted_at = CURRENT_TIMESTAMP WHERE id = ? AND deleted_at IS NULL',
+            (doc_id,)
+        )
         conn.commit()
         
         if cursor.rowcount > 0:
             conn.close()
+            record_change('documents', doc_id, 'delete')
             return jsonify({'success': True})
         else:
             conn.close()
@@ -2559,6 +5468,296 @@ def delete_document(doc_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Purge
+# DELETE requests only tombstone assets and documents (deleted_at), so they
+# cost one UPDATE. A background thread in each process purges tombstones
+# older than MADARES_PURGE_AFTER seconds in batches: an asset takes its
+# workflows and documents with it, a document's file is removed before its
+# row, and upload files that no row refers to are swept as well.
+PURGE_INTERVAL = float(os.environ.get('MADARES_PURGE_INTERVAL', 60))  # 0: only `flask purge-deleted`
+PURGE_AFTER = int(os.environ.get('MADARES_PURGE_AFTER', 0))
+PURGE_BATCH_SIZE = int(os.environ.get('MADARES_PURGE_BATCH_SIZE', 100))
+ORPHAN_FILE_MIN_AGE = int(os.environ.get('MADARES_ORPHAN_FILE_MIN_AGE', 3600))
+_purge_lock = threading.Lock()
+_purge_thread = None
+
+def remove_file(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def purge_deleted(conn, batch_size=PURGE_BATCH_SIZE):
+    cutoff = history_time(datetime.utcnow() - timedelta(seconds=PURGE_AFTER))
+    counts = {'assets': 0, 'workflows': 0, 'documents': 0, 'files': 0}
+    cursor = conn.cursor()
+
+    while True:
+        cursor.execute('SELECT id FROM assets WHERE deleted_at <= ? ORDER BY id LIMIT ?', (cutoff, batch_size))
+        asset_ids = [row[0] for row in cursor.fetchall()]
+        if not asset_ids:
+            break
+        in_assets = f"IN ({', '.join('?' * len(asset_ids))})"
+        cursor.execute(f'SELECT id FROM workflows WHERE asset_id {in_assets}', asset_ids)
+        workflow_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'SELECT id FROM documents WHERE asset_id {in_assets} AND deleted_at IS NULL', asset_ids)
+        document_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'DELETE FROM workflows WHERE asset_id {in_assets}', asset_ids)
+        # Documents are tombstoned with their asset's time and purged below
+        cursor.execute(f'''
+            UPDATE documents SET deleted_at = (SELECT deleted_at FROM assets WHERE assets.id = documents.asset_id)
+            WHERE asset_id {in_assets} AND deleted_at IS NULL
+        ''', asset_ids)
+        cursor.execute(f'DELETE FROM assets WHERE id {in_assets}', asset_ids)
+        conn.commit()
+        counts['assets'] += len(asset_ids)
+        counts['workflows'] += len(workflow_ids)
+        for workflow_id in workflow_ids:
+            record_change('workflows', workflow_id, 'delete')
+        for doc_id in document_ids:
+            record_change('documents', doc_id, 'delete')
+
+    while True:
+        cursor.execute('SELECT id, file_path FROM documents WHERE deleted_at <= ? ORDER BY id LIMIT ?', (cutoff, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        # Files first: if the process dies in between, the tombstone stays
+        # and the next run tries again
+        counts['files'] += sum(remove_file(file_path) for doc_id, file_path in rows if file_path)
+        doc_ids = [doc_id for doc_id, file_path in rows]
+        cursor.execute(f"DELETE FROM documents WHERE id IN ({', '.join('?' * len(doc_ids))})", doc_ids)
+        conn.commit()
+        counts['documents'] += len(doc_ids)
+
+    return counts
+
+def sweep_orphan_files(conn, batch_size=PURGE_BATCH_SIZE):
+    # Uploads without a documents row, e.g. when the request failed after
+    # saving the file. Recent files may still be getting their row.
+    cutoff = time.time() - ORPHAN_FILE_MIN_AGE
+    with os.scandir(UPLOAD_DIR) as entries:
+        names = [entry.name for entry in entries
+                 if UPLOAD_NAME.match(entry.name) and entry.is_file() and entry.stat().st_mtime < cutoff]
+    removed = 0
+    cursor = conn.cursor()
+    for start in range(0, len(names), batch_size):
+        batch = names[start:start + batch_size]
+        cursor.execute(f"SELECT filename FROM documents WHERE filename IN ({', '.join('?' * len(batch))})", batch)
+        known = {row[0] for row in cursor.fetchall()}
+        removed += sum(remove_file(os.path.join(UPLOAD_DIR, name)) for name in batch if name not in known)
+    conn.rollback()
+    return removed
+
+def run_purge():
+    while True:
+        time.sleep(PURGE_INTERVAL)
+        try:
+            conn = get_db()
+            try:
+                counts = purge_deleted(conn)
+                counts['orphan_files'] = sweep_orphan_files(conn)
+            finally:
+                conn.close()
+            if any(counts.values()):
+                app.logger.info('Purged %s', counts)
+        except Exception:
+            app.logger.exception('Purging deleted rows failed')
+
+@app.before_request
+def start_purge():
+    # One purge thread per worker process, started by its first request
+    # (threads don't survive the fork of a preloading master)
+    global _purge_thread
+    if _purge_thread is None and PURGE_INTERVAL > 0 and not os.environ.get('VERCEL'):
+        with _purge_lock:
+            if _purge_thread is None:
+                _purge_thread = threading.Thread(target=run_purge, name='purge', daemon=True)
+                _purge_thread.start()
+
+@app.cli.command('purge-deleted')
+def purge_deleted_command():
+    """Purge deleted assets and documents and sweep orphaned upload files."""
+    conn = get_db()
+    try:
+        counts = purge_deleted(conn)
+        counts['orphan_files'] = sweep_orphan_files(conn)
+    finally:
+        conn.close()
+    print(', '.join('%s: %d' % item for item in counts.items()))
+
+# Live updates
+# Under gunicorn every open stream holds one of the worker's threads, so only
+# part of the pool may be taken by streams and further clients get 503 until
+# one closes. asgi.py serves /api/events without threads and has no such cap.
+SSE_MAX_STREAMS = int(os.environ.get('MADARES_SSE_MAX_STREAMS', max(1, WORKER_THREADS // 2)))
+SSE_RETRY_MS = 3000
+SSE_BUSY_RETRY_MS = 30000
+_sse_streams = 0
+_sse_streams_lock = threading.Lock()
+
+def release_sse_stream():
+    global _sse_streams
+    with _sse_streams_lock:
+        _sse_streams -= 1
+
+@app.route('/api/events')
+def events():
+    global _sse_streams
+    # Resume after the last event the browser saw, or start from now
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_event_id', event_broker.last_id, type=int)
+    event_filter = EventFilter.for_user(current_principal())
+    
+    with _sse_streams_lock:
+        busy = _sse_streams >= SSE_MAX_STREAMS
+        if not busy:
+            _sse_streams += 1
+    if busy:
+        return Response(b'retry: %d\n\n' % SSE_BUSY_RETRY_MS, status=503, mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'Retry-After': str(SSE_BUSY_RETRY_MS // 1000)
+        })
+    
+    if EVENT_RELAY:
+        start_event_relay()
+    
+    def generate(last_id):
+        event_broker.subscribe()
+        try:
+            yield b'retry: %d\n\n' % SSE_RETRY_MS
+            while True:
+                events = event_broker.wait(last_id, SSE_HEARTBEAT_SECONDS)
+                if not events:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield b': keep-alive\n\n'
+                    continue
+                if event_filter is None:
+                    payloads = [payload for event_id, payload, event in events]
+                else:
+                    payloads = event_filter.apply(events)
+                for payload in payloads:
+                    yield payload
+                last_id = events[-1][0]
+        finally:
+            event_broker.unsubscribe()
+    
+    response = Response(generate(last_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the server closes the response, also if the stream never started
+    response.call_on_close(release_sse_stream)
+    return response
+
+# Delta sync
+SYNC_QUERIES = {
+    'assets': 'SELECT * FROM assets WHERE deleted_at IS NULL',
+    'workflows': 'SELECT * FROM workflows',
+    'users': 'SELECT * FROM users',
+    'documents': 'SELECT d.*, a.asset_name FROM documents d LEFT JOIN assets a ON d.asset_id = a.id WHERE d.deleted_at IS NULL'
+}
+SYNC_ID_COLUMNS = {'assets': 'id', 'workflows': 'id', 'users': 'id', 'documents': 'd.id'}
+SYNC_ALIASES = {'documents': 'd'}
+SYNC_EXCLUDE = {'users': ('password',)}
+CHANGE_LOG_PRUNE_INTERVAL = 3600
+_change_log_pruned_at = 0
+
+def fetch_sync_rows(cursor, table, ids=None):
+    query = SYNC_QUERIES[table]
+    conditions, params = [], []
+    if ids is not None:
+        conditions.append(f"{SYNC_ID_COLUMNS[table]} IN ({', '.join('?' * len(ids))})")
+        params.extend(ids)
+    # Region scoped users only get the rows of their region
+    condition, scope_params = scope_filter(table, SYNC_ALIASES.get(table))
+    if condition:
+        conditions.append(condition)
+        params.extend(scope_params)
+    if conditions:
+        query += (' AND ' if ' WHERE ' in query else ' WHERE ') + ' AND '.join(conditions)
+    cursor.execute(query, params)
+    make_row = row_factory(cursor, SYNC_EXCLUDE.get(table, ()))
+    return [make_row(row) for row in cursor.fetchall()]
+
+@app.route('/api/sync')
+def sync():
+    global _change_log_pruned_at
+    try:
+        since = request.args.get('since', 0, type=int)
+        tables = [t for t in request.args.get('tables', ','.join(VERSIONED_TABLES)).split(',') if t in SYNC_QUERIES]
+        
+        # Trim the change log now and then, outside the startup path
+        if time.monotonic() - _change_log_pruned_at > CHANGE_LOG_PRUNE_INTERVAL:
+            _change_log_pruned_at = time.monotonic()
+            conn = get_db()
+            try:
+                prune_change_log(conn)
+            finally:
+                conn.close()
+        
+        conn = get_read_db()
+        cursor = conn.cursor()
+        
+        # Read the token and the rows from one snapshot
+        conn.snapshot()
+        cursor.execute('SELECT COALESCE(MAX(seq), 0), COALESCE(MIN(seq), 0) FROM change_log')
+        token, oldest = cursor.fetchone()
+        
+        # Unknown or pruned tokens (e.g. a recreated database) get everything
+        full = since <= 0 or since > token or (oldest and since < oldest - 1)
+        
+        changes = {}
+        for table in tables:
+            if full:
+                changes[table] = {'inserted': fetch_sync_rows(cursor, table), 'updated': [], 'deleted': []}
+                continue
+            
+            cursor.execute('''
+                SELECT row_id, MAX(CASE WHEN operation = 'insert' THEN 1 ELSE 0 END)
+                FROM change_log
+                WHERE table_name = ? AND seq > ? AND seq <= ?
+                GROUP BY row_id
+            ''', (table, since, token))
+            touched = dict(cursor.fetchall())
+            
+            rows = fetch_sync_rows(cursor, table, list(touched)) if touched else []
+            present = {row['id'] for row in rows}
+            changes[table] = {
+                'inserted': [row for row in rows if touched[row['id']]],
+                'updated': [row for row in rows if not touched[row['id']]],
+                # Rows created and removed since the token were never seen by the
+                # client. For region scoped users this includes rows that left
+                # the region.
+                'deleted': [row_id for row_id, inserted in touched.items() if row_id not in present and not inserted]
+            }
+        
+        conn.commit()
+        conn.close()
+        
+        return json_response({'token': token, 'full': bool(full), 'changes': changes})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/lookups')
+def get_lookups():
+    # Values of every enumerated field, for forms and label translation
+    return json_response(lookups.values(request_lang()))
+
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.route('/api/db/stats')
+def get_db_stats():
+    return jsonify(read_router.stats())
+
+@app.route('/api/limits/stats')
+def get_limit_stats():
+    return jsonify(admission.stats())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=False)
 
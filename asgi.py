@@ -0,0 +1,258 @@
+# ASGI entry point for high-concurrency deployments
+#
+#   uvicorn asgi:app --workers 4 --limit-concurrency 10000
+#
+# Connections live on the event loop and only take a thread while Flask code
+# actually runs:
+#   - request bodies (document uploads included) are received asynchronously
+#     and spooled to memory/disk before Flask is called, so slow uploads hold
+#     no thread;
+#   - every route, reads included, then runs the unchanged Flask app on a
+#     bounded thread pool, so caching, ETags and all hooks still apply;
+#   - /api/events is served natively, an idle SSE client costs a coroutine
+#     instead of a thread. Flask's hooks don't run for it, so it checks the
+#     bearer token or session cookie itself (app.authorize_headers) and
+#     region scoped users only get events of their region (app.EventFilter).
+# With several uvicorn workers set MADARES_EVENT_RELAY=1 (see gunicorn.conf.py).
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs
+
+import app as madares
+from app import app as flask_app, event_broker
+
+ASGI_THREADS = int(os.environ.get('MADARES_ASGI_THREADS', 32))
+MAX_BODY_BYTES = int(os.environ.get('MADARES_MAX_BODY_MB', 50)) * 1024 * 1024
+SPOOL_MEMORY_BYTES = int(os.environ.get('MADARES_SPOOL_MEMORY_KB', 1024)) * 1024
+
+executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi')
+# Disk writes of spooled bodies get their own threads so they never wait
+# behind request handlers
+io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='asgi-io')
+
+async def read_body(receive):
+    # Receive the request body without blocking a thread. Small bodies stay in
+    # memory, larger ones are written to a temporary file off the event loop.
+    loop = asyncio.get_running_loop()
+    body = BytesIO()
+    size = 0
+    on_disk = False
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None, 0
+        chunk = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            body.close()
+            raise ValueError('Request body too large')
+        if not on_disk and size > SPOOL_MEMORY_BYTES:
+            spooled = await loop.run_in_executor(io_executor, tempfile.TemporaryFile)
+            await loop.run_in_executor(io_executor, spooled.write, body.getvalue())
+            body = spooled
+            on_disk = True
+        if on_disk:
+            await loop.run_in_executor(io_executor, body.write, chunk)
+        else:
+            body.write(chunk)
+    if on_disk:
+        await loop.run_in_executor(io_executor, body.seek, 0)
+    else:
+        body.seek(0)
+    return body, size
+
+def build_environ(scope, body, size):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'CONTENT_LENGTH': str(size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        key = 'CONTENT_TYPE' if name == 'content-type' else 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+def run_wsgi(loop, environ, send):
+    # Runs on a pool thread: the Flask call and the iteration of its response
+    # stay on one thread (SQLite connections of streamed listings require it),
+    # and each chunk waits until the event loop has sent it (back-pressure).
+    def send_sync(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    def send_start():
+        if not response.get('started'):
+            response['started'] = True
+            send_sync({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+
+    result = flask_app(environ, start_response)
+    try:
+        for chunk in result:
+            send_start()
+            if chunk:
+                send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        send_start()
+        send_sync({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+        environ['wsgi.input'].close()
+
+async def send_json(send, status, payload):
+    body = madares.json_dumps(payload)
+    await send({'type': 'http.response.start', 'status': status, 'headers': [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode())
+    ]})
+    await send({'type': 'http.response.body', 'body': body})
+
+# Live updates
+class EventNotifier:
+    # One broker listener per event loop. Waiters share an asyncio.Event that
+    # is swapped on every publish, so waking thousands of SSE clients costs a
+    # single thread-safe callback.
+    def __init__(self, loop):
+        self.loop = loop
+        self.changed = asyncio.Event()
+        event_broker.add_listener(self.notify)
+
+    def notify(self):
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def close(self):
+        event_broker.remove_listener(self.notify)
+
+_notifiers = {}
+
+def get_notifier():
+    loop = asyncio.get_running_loop()
+    if loop not in _notifiers:
+        _notifiers[loop] = EventNotifier(loop)
+    return _notifiers[loop]
+
+async def stream_events(scope, receive, send):
+    headers = dict(scope['headers'])
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    last_id = headers.get(b'last-event-id') or query.get('last_event_id', [None])[0]
+    last_id = int(last_id) if last_id and last_id.isdigit() else event_broker.last_id
+
+    # The access policy may have to be (re)loaded from the database
+    loop = asyncio.get_running_loop()
+    denied, user = await loop.run_in_executor(
+        executor, madares.authorize_headers,
+        headers.get(b'authorization', b'').decode('latin-1'), headers.get(b'cookie', b'').decode('latin-1'),
+        'events', 'read'
+    )
+    if denied:
+        return await send_json(send, denied[0], {'error': denied[1]})
+    event_filter = await loop.run_in_executor(executor, madares.EventFilter.for_user, user)
+
+    if madares.EVENT_RELAY:
+        madares.start_event_relay()
+
+    notifier = get_notifier()
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnected = asyncio.ensure_future(wait_for_disconnect())
+    event_broker.subscribe()
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]})
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        while not disconnected.done():
+            changed = notifier.changed
+            events = event_broker.since(last_id)
+            if events:
+                last_id = events[-1][0]
+                if event_filter is None:
+                    body = b''.join(payload for event_id, payload, event in events)
+                else:
+                    # Region scoped subscribers, the lookup runs on the pool
+                    body = b''.join(await loop.run_in_executor(executor, event_filter.apply, events))
+                if body:
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+                continue
+            waiter = asyncio.ensure_future(changed.wait())
+            done, pending = await asyncio.wait({waiter, disconnected}, timeout=madares.SSE_HEARTBEAT_SECONDS,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if not done:
+                # Comment line keeps proxies from closing an idle stream
+                await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+    finally:
+        event_broker.unsubscribe()
+        disconnected.cancel()
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for notifier in _notifiers.values():
+                notifier.close()
+            _notifiers.clear()
+            executor.shutdown(wait=False)
+            io_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    if scope['path'] == '/api/events' and scope['method'] == 'GET':
+        return await stream_events(scope, receive, send)
+
+    try:
+        body, size = await read_body(receive)
+    except ValueError as e:
+        return await send_json(send, 413, {'error': str(e)})
+    if body is None:
+        return
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, run_wsgi, loop, build_environ(scope, body, size), send)
@@ -0,0 +1,486 @@
+# Latency, throughput and memory of every API endpoint, through Flask's test
+# client or a real server.
+#
+#   python benchmarks/generate.py --scale 100k --db /tmp/madares-100k.db
+#   python benchmarks/api.py --db /tmp/madares-100k.db --output before.json
+#   python benchmarks/api.py --db /tmp/madares-100k.db --client http --server gunicorn
+#   python benchmarks/api.py --db /tmp/madares-100k.db --compare before.json
+#
+# Each endpoint gets --requests requests (--write-requests for writes) spread
+# over --concurrency clients, or as many as fit in --max-seconds. The first
+# request runs alone and is reported separately as first_ms: it is the one
+# that fills the response cache. Memory is the resident size of the process
+# serving the requests (this one with the test client, the server's process
+# tree otherwise) after each endpoint.
+#
+# Writes run after the reads and remove what they created again, but they do
+# change the database (soft deleted rows, history entries, transitioned
+# workflows): point --db at generated data only. /api/events (a stream that
+# never ends) and the profiling routes are not benchmarked. Rate limits are
+# turned off for the run, concurrency limits stay.
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+
+from serving import SERVERS, free_port, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_SIZE = 1000
+BULK_SIZE = 20
+
+Request = namedtuple('Request', 'method path body content_type on_success')
+Endpoint = namedtuple('Endpoint', 'name make writes login')
+
+def get(path):
+    return Request('GET', path, None, None, None)
+
+def send_json(method, path, payload=None, on_success=None):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+    return Request(method, path, body, 'application/json' if body is not None else None, on_success)
+
+def multipart(path, fields, filename, content, on_success=None):
+    boundary = uuid.uuid4().hex
+    parts = [b'--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+             % (boundary.encode(), name.encode(), value.encode('utf-8')) for name, value in fields.items()]
+    parts.append(b'--%s\r\nContent-Disposition: form-data; name="file"; filename="%s"\r\n'
+                 b'Content-Type: application/octet-stream\r\n\r\n%s\r\n--%s--\r\n'
+                 % (boundary.encode(), filename.encode('utf-8'), content, boundary.encode()))
+    return Request('POST', path, b''.join(parts), 'multipart/form-data; boundary=' + boundary, on_success)
+
+def created_ids(payload):
+    if 'id' in payload:
+        return [payload['id']]
+    return [result['id'] for result in payload.get('results', ()) if result.get('id')]
+
+class Samples:
+    # Ids of existing rows to request, and pools of the rows created by write
+    # endpoints for the ones that modify or delete them
+    def __init__(self, conn, seed):
+        self.rng = random.Random(seed)
+        self.ids = {}
+        for name, query in (
+            ('assets', 'SELECT id FROM assets WHERE deleted_at IS NULL'),
+            ('workflows', 'SELECT id FROM workflows'),
+            ('users', "SELECT id FROM users WHERE username <> 'admin'"),
+            ('assignees', 'SELECT DISTINCT assignee_id FROM workflows WHERE assignee_id IS NOT NULL'),
+            ('documents', 'SELECT id FROM documents WHERE deleted_at IS NULL'),
+        ):
+            rows = conn.execute(query + ' ORDER BY RANDOM() LIMIT %d' % SAMPLE_SIZE).fetchall()
+            self.ids[name] = [row[0] for row in rows] or [0]
+        self.sync_token = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def pick(self, name, i):
+        ids = self.ids[name]
+        return ids[i % len(ids)]
+
+    def put(self, pool, ids):
+        with self.lock:
+            self.pools.setdefault(pool, []).extend(ids)
+
+    def take(self, pool, fallback, i, n=1):
+        # Created rows first; once they run out, existing ones
+        with self.lock:
+            ids = self.pools.get(pool, [])
+            taken = [ids.pop() for _ in range(min(n, len(ids)))]
+        return taken + [self.pick(fallback, i + k) for k in range(n - len(taken))]
+
+def new_asset(samples, i):
+    rng = samples.rng
+    return {
+        'asset_name': 'أصل اختبار الأداء %d' % i, 'asset_type': 'تجاري', 'asset_category': 'مجمع تجاري',
+        'region': 'الرياض', 'city': 'الرياض', 'district': 'حي النخيل', 'current_value': rng.randint(1, 90) * 1000000,
+        'latitude': round(24.7136 + rng.gauss(0, 0.04), 6), 'longitude': round(46.6753 + rng.gauss(0, 0.04), 6),
+        'construction_status': 'قيد الإنشاء', 'completion_percentage': rng.randint(5, 95),
+        'land_area': rng.randint(500, 20000), 'market_value': rng.randint(1, 90) * 1000000, 'legal_status': 'سليم'
+    }
+
+def new_workflow(samples, i):
+    return {'title': 'مهمة اختبار الأداء %d' % i, 'priority': samples.rng.choice(['منخفضة', 'متوسطة', 'عالية']),
+            'assignee_id': samples.pick('assignees', i), 'asset_id': samples.pick('assets', i)}
+
+def build_endpoints(samples, login):
+    yesterday = (datetime.utcnow() - timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S')
+    username, password = login
+
+    def endpoint(name, make, writes=False, needs_login=False):
+        return Endpoint(name, make, writes, needs_login)
+
+    def keep(pool):
+        return lambda payload: samples.put(pool, created_ids(payload))
+
+    def transition(i):
+        workflow_id, = samples.take('workflows', 'workflows', i)
+        return send_json('POST', '/api/workflows/%d/transition' % workflow_id, {'status': 'قيد التنفيذ'},
+                         lambda payload: samples.put('started', [workflow_id]))
+
+    return [
+        endpoint('GET /', lambda i: get('/')),
+        endpoint('GET /api/stats', lambda i: get('/api/stats')),
+        endpoint('GET /api/lookups', lambda i: get('/api/lookups')),
+        endpoint('GET /api/assets', lambda i: get('/api/assets')),
+        endpoint('GET /api/assets?include=all', lambda i: get('/api/assets?include=all')),
+        endpoint('GET /api/assets?lang=en', lambda i: get('/api/assets?lang=en')),
+        endpoint('GET /api/assets/<id>', lambda i: get('/api/assets/%d' % samples.pick('assets', i))),
+        endpoint('GET /api/assets/<id>?as_of', lambda i: get('/api/assets/%d?as_of=%s' % (samples.pick('assets', i), yesterday))),
+        endpoint('GET /api/assets/<id>/history', lambda i: get('/api/assets/%d/history' % samples.pick('assets', i))),
+        endpoint('GET /api/workflows', lambda i: get('/api/workflows')),
+        endpoint('GET /api/workflows/<id>', lambda i: get('/api/workflows/%d' % samples.pick('workflows', i))),
+        endpoint('GET /api/workflows/engine', lambda i: get('/api/workflows/engine')),
+        endpoint('GET /api/workflows/reports', lambda i: get('/api/workflows/reports')),
+        endpoint('GET /api/workflows/reports?weeks=52', lambda i: get('/api/workflows/reports?weeks=52')),
+        endpoint('GET /api/users', lambda i: get('/api/users')),
+        endpoint('GET /api/users/<id>', lambda i: get('/api/users/%d' % samples.pick('users', i))),
+        endpoint('GET /api/users/<id>/workflows', lambda i: get('/api/users/%d/workflows' % samples.pick('assignees', i))),
+        endpoint('GET /api/users/<id>/workflows/counts',
+                 lambda i: get('/api/users/%d/workflows/counts' % samples.pick('assignees', i))),
+        endpoint('GET /api/me/workflows', lambda i: get('/api/me/workflows'), needs_login=True),
+        endpoint('GET /api/me/workflows/counts', lambda i: get('/api/me/workflows/counts'), needs_login=True),
+        endpoint('GET /api/auth/me', lambda i: get('/api/auth/me'), needs_login=True),
+        endpoint('GET /api/documents', lambda i: get('/api/documents')),
+        endpoint('GET /api/documents/<id>', lambda i: get('/api/documents/%d' % samples.pick('documents', i))),
+        endpoint('GET /api/sync', lambda i: get('/api/sync')),
+        endpoint('GET /api/sync?since', lambda i: get('/api/sync?since=%d' % max(samples.sync_token - 100, 1))),
+        endpoint('GET /api/cache/stats', lambda i: get('/api/cache/stats')),
+        endpoint('GET /api/db/stats', lambda i: get('/api/db/stats')),
+        endpoint('GET /api/limits/stats', lambda i: get('/api/limits/stats')),
+        endpoint('GET /metrics', lambda i: get('/metrics')),
+
+        endpoint('POST /api/auth/login',
+                 lambda i: send_json('POST', '/api/auth/login', {'username': username, 'password': password}), True),
+        endpoint('POST /api/auth/token',
+                 lambda i: send_json('POST', '/api/auth/token', {'username': username, 'password': password}), True),
+        endpoint('POST /api/auth/logout', lambda i: send_json('POST', '/api/auth/logout'), True),
+        endpoint('POST /api/assets',
+                 lambda i: send_json('POST', '/api/assets', new_asset(samples, i), keep('assets')), True),
+        endpoint('PATCH /api/assets/<id>',
+                 lambda i: send_json('PATCH', '/api/assets/%d' % samples.pick('assets', i),
+                                     {'current_value': samples.rng.randint(1, 90) * 1000000}), True),
+        endpoint('POST /api/workflows',
+                 lambda i: send_json('POST', '/api/workflows', new_workflow(samples, i), keep('workflows')), True),
+        endpoint('POST /api/workflows/<id>/transition', transition, True),
+        endpoint('POST /api/workflows/bulk',
+                 lambda i: send_json('POST', '/api/workflows/bulk', {
+                     'template': {'title': 'مراجعة دورية', 'assignee_id': samples.pick('assignees', i)},
+                     'asset_ids': [samples.pick('assets', i * BULK_SIZE + k) for k in range(BULK_SIZE)]
+                 }, keep('bulk')), True),
+        endpoint('POST /api/workflows/bulk/reassign',
+                 lambda i: send_json('POST', '/api/workflows/bulk/reassign', {
+                     'ids': [samples.pick('workflows', i * BULK_SIZE + k) for k in range(BULK_SIZE)],
+                     'assignee_id': samples.pick('assignees', i)
+                 }), True),
+        endpoint('POST /api/workflows/bulk/transition',
+                 lambda i: send_json('POST', '/api/workflows/bulk/transition', {
+                     'ids': samples.take('started', 'workflows', i, BULK_SIZE), 'status': 'مكتملة'
+                 }), True),
+        endpoint('POST /api/users',
+                 lambda i: send_json('POST', '/api/users', {
+                     'username': 'bench.%s' % uuid.uuid4().hex[:12], 'password': 'password123',
+                     'full_name': 'مستخدم اختبار الأداء', 'email': 'bench@madares.sa', 'role': 'مستخدم',
+                     'department': 'إدارة الأصول', 'region': 'الرياض'
+                 }, keep('users')), True),
+        endpoint('POST /api/documents',
+                 lambda i: multipart('/api/documents', {'document_type': 'صك ملكية', 'asset_id': str(samples.pick('assets', i))},
+                                     'صك_ملكية_%d.pdf' % i, b'%PDF-1.4 benchmark\n' * 256, keep('documents')), True),
+        endpoint('DELETE /api/assets/<id>',
+                 lambda i: send_json('DELETE', '/api/assets/%d' % samples.take('assets', 'assets', i)[0]), True),
+        endpoint('DELETE /api/workflows/<id>',
+                 lambda i: send_json('DELETE', '/api/workflows/%d' % samples.take('bulk', 'workflows', i)[0]), True),
+        endpoint('DELETE /api/users/<id>',
+                 lambda i: send_json('DELETE', '/api/users/%d' % samples.take('users', 'users', i)[0]), True),
+        endpoint('DELETE /api/documents/<id>',
+                 lambda i: send_json('DELETE', '/api/documents/%d' % samples.take('documents', 'documents', i)[0]), True),
+    ]
+
+# Clients
+class TestClient:
+    def __init__(self, app, headers):
+        self.client = app.test_client()
+        self.headers = headers
+
+    def request(self, request):
+        headers = dict(self.headers)
+        if request.content_type:
+            headers['Content-Type'] = request.content_type
+        response = self.client.open(request.path, method=request.method, data=request.body, headers=headers)
+        try:
+            return response.status_code, response.get_data()
+        finally:
+            response.close()
+
+    def close(self):
+        pass
+
+class HttpClient:
+    def __init__(self, port, headers):
+        self.port = port
+        self.headers = headers
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+
+    def request(self, request):
+        headers = dict(self.headers)
+        if request.content_type:
+            headers['Content-Type'] = request.content_type
+        try:
+            self.conn.request(request.method, request.path, body=request.body, headers=headers)
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=300)
+            return 0, b''
+
+    def close(self):
+        self.conn.close()
+
+def rss_mb(pid):
+    # Resident memory of a process and its children, from /proc (Linux only)
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            kb = int(re.search(r'^VmRSS:\s+(\d+)', f.read(), re.M).group(1))
+        tasks = os.listdir('/proc/%d/task' % pid)
+    except (OSError, AttributeError):
+        return None
+    children = []
+    for task in tasks:
+        try:
+            with open('/proc/%d/task/%s/children' % (pid, task)) as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            # Thread ended meanwhile
+            pass
+    return round(kb / 1024 + sum(rss_mb(child) or 0 for child in children), 1)
+
+def measure(endpoint, clients, requests, max_seconds):
+    latencies = []
+    statuses = Counter()
+    size = [0]
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def call(client, i):
+        request = endpoint.make(i)
+        started = time.perf_counter()
+        status, body = client.request(request)
+        elapsed = time.perf_counter() - started
+        if request.on_success and 200 <= status < 300:
+            request.on_success(json.loads(body))
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] += 1
+            size[0] += len(body)
+        return elapsed
+
+    # The first request alone: cache misses, lazily loaded state
+    first = call(clients[0], next(counter))
+    started = time.perf_counter()
+    deadline = started + max_seconds
+
+    def worker(client):
+        for i in counter:
+            call(client, i)
+            if time.perf_counter() > deadline:
+                break
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    rest = latencies[1:] or latencies
+    return {
+        'requests': len(latencies),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'first_ms': round(first * 1000, 2),
+        'mean_ms': round(sum(rest) / len(rest) * 1000, 2),
+        'p50_ms': round(percentile(rest, 50) * 1000, 2),
+        'p95_ms': round(percentile(rest, 95) * 1000, 2),
+        'p99_ms': round(percentile(rest, 99) * 1000, 2),
+        'requests_per_second': round((len(latencies) - 1) / elapsed, 1) if len(latencies) > 1 and elapsed else None,
+        'bytes_per_response': round(size[0] / len(latencies))
+    }
+
+def start_server(name, env):
+    port = free_port()
+    process = subprocess.Popen(SERVERS[name](port), cwd=ROOT, env=dict(env, PORT=str(port)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/api/lookups')
+            conn.getresponse().read()
+            conn.close()
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('%s server did not start' % name)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(previous, results, threshold):
+    # p50/p95 change per endpoint; returns the endpoints slower than threshold %
+    regressions = []
+    for key in ('client', 'server', 'concurrency', 'user', 'database', 'rows'):
+        if previous.get(key) != results[key]:
+            print('note: %s differs (%s, now %s)' % (key, previous.get(key), results[key]))
+    print('\n%-42s %21s %21s' % ('compared with ' + (previous.get('commit') or '?'), 'p50 ms', 'p95 ms'))
+    for name, new in results['endpoints'].items():
+        old = previous.get('endpoints', {}).get(name)
+        if not old:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms'):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0
+            changes.append('%8.2f %+7.1f%%' % (new[key], change))
+            if change > threshold and new[key] - old[key] > 1:
+                regressions.append(name)
+        print('%-42s %s %s%s' % (name, changes[0], changes[1], '  <-' if name in regressions else ''))
+    return sorted(set(regressions))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every API endpoint')
+    parser.add_argument('--db', help='SQLite file with generated data (default: MADARES_DB)')
+    parser.add_argument('--client', choices=['test', 'http'], default='test')
+    parser.add_argument('--server', choices=list(SERVERS), default='gunicorn', help='server for --client http')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=200, help='per read endpoint')
+    parser.add_argument('--write-requests', type=int, default=50, help='per write endpoint')
+    parser.add_argument('--max-seconds', type=float, default=10, help='time budget per endpoint')
+    parser.add_argument('--login', default='admin:password123',
+                        help='USER:PASSWORD for the auth endpoints; with --as-user every request uses its token')
+    parser.add_argument('--as-user', action='store_true',
+                        help='send a bearer token; without it only the read endpoints run, anonymously')
+    parser.add_argument('--only', help='regular expression, run the matching endpoints only')
+    parser.add_argument('--read-only', action='store_true', help='skip the write endpoints')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=20, help='percent slower that counts as a regression')
+    args = parser.parse_args()
+
+    upload_dir = tempfile.mkdtemp(prefix='madares-bench-')
+    if args.db:
+        os.environ['MADARES_DB'] = args.db
+    # Anonymous requests may read (only) with MADARES_AUTH_REQUIRED=0
+    os.environ.update(MADARES_AUTO_SEED='0', MADARES_RATE_LIMIT='0', MADARES_UPLOAD_DIR=upload_dir,
+                      MADARES_AUTH_REQUIRED='1' if args.as_user else '0',
+                      MADARES_ACCESS_LOG='', MADARES_LOG_LEVEL='warning')
+    sys.path.insert(0, ROOT)
+    import app
+
+    # Per-route limits (logins, uploads) can only be raised, not switched off
+    os.environ['MADARES_ROUTE_RATE_LIMITS'] = ','.join('%s=1000000/1000000' % name for name in app.ROUTE_RATE_LIMITS)
+    app.ROUTE_RATE_LIMITS.clear()
+
+    conn = app.get_db()
+    try:
+        samples = Samples(conn, args.seed)
+        rows = {table: conn.execute('SELECT COUNT(*) FROM ' + table).fetchone()[0]
+                for table in ('users', 'assets', 'workflows', 'documents')}
+        dialect = conn.dialect
+    finally:
+        conn.close()
+    login = tuple(args.login.split(':', 1))
+    endpoints = [endpoint for endpoint in build_endpoints(samples, login)
+                 if (not args.only or re.search(args.only, endpoint.name))
+                 and not (args.read_only and endpoint.writes)
+                 and not ((endpoint.login or endpoint.writes) and not args.as_user)]
+
+    process = None
+    clients = []
+    if args.client == 'http':
+        process, port = start_server(args.server, os.environ)
+        make_client = lambda headers: HttpClient(port, headers)
+        pid = process.pid
+    else:
+        make_client = lambda headers: TestClient(app.app, headers)
+        pid = os.getpid()
+    try:
+        headers = {}
+        if args.as_user:
+            client = make_client({})
+            status, body = client.request(
+                send_json('POST', '/api/auth/token', {'username': login[0], 'password': login[1]}))
+            client.close()
+            if status != 200:
+                raise SystemExit('Login as %s failed: %s' % (login[0], body[:200]))
+            headers['Authorization'] = 'Bearer ' + json.loads(body)['token']
+        clients = [make_client(headers) for _ in range(args.concurrency)]
+
+        results = {
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'client': args.client,
+            'server': args.server if args.client == 'http' else None,
+            'concurrency': args.concurrency,
+            'user': login[0] if args.as_user else None,
+            'python': platform.python_version(),
+            'database': dialect,
+            'rows': rows,
+            'endpoints': {}
+        }
+        peak = 0
+        print('%-42s %8s %9s %9s %9s %9s %9s %8s' % ('endpoint', 'requests', 'first ms', 'p50 ms', 'p95 ms',
+                                                     'p99 ms', 'req/s', 'RSS MB'))
+        for endpoint in endpoints:
+            result = measure(endpoint, clients, args.write_requests if endpoint.writes else args.requests,
+                             args.max_seconds)
+            result['rss_mb'] = rss_mb(pid)
+            peak = max(peak, result['rss_mb'] or 0)
+            results['endpoints'][endpoint.name] = result
+            errors = sum(count for status, count in result['statuses'].items() if int(status) >= 400 or int(status) == 0)
+            print('%-42s %8d %9.2f %9.2f %9.2f %9.2f %9s %8s%s' % (
+                endpoint.name, result['requests'], result['first_ms'], result['p50_ms'], result['p95_ms'],
+                result['p99_ms'], result['requests_per_second'], result['rss_mb'],
+                '  %d errors %s' % (errors, result['statuses']) if errors else ''))
+        if args.client == 'test':
+            # ru_maxrss is in KB on Linux
+            peak = max(peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+        results['peak_rss_mb'] = round(peak, 1) or None
+    finally:
+        # Open keep-alive connections would hold up a graceful shutdown
+        for client in clients:
+            client.close()
+        if process:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=30)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print('\n%d endpoints more than %g%% slower' % (len(regressions), args.threshold))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+# Synthetic data for benchmarks: users, assets with every MOE section filled
+# in, workflows and documents, in realistic Saudi locations with Arabic text.
+#
+#   python benchmarks/generate.py --scale 100k --db /tmp/madares-100k.db
+#
+# Scales name the number of assets (1k, 100k, 1m); the other tables grow with
+# it (SCALES), and --users/--workflows/--documents override single counts.
+# Rows are written through the app's storage layer, so MADARES_DATABASE_URL
+# works as well. Every user, admin included, gets the --password, and runs
+# with the same --seed produce the same data.
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# scale -> (assets, users, workflows, documents)
+SCALES = {
+    '1k': (1000, 50, 2000, 500),
+    '100k': (100000, 500, 200000, 50000),
+    '1m': (1000000, 2000, 2000000, 500000),
+}
+BATCH_SIZE = 2000
+
+# region -> weight, [(city, latitude, longitude)]
+REGIONS = {
+    'الرياض': (30, [('الرياض', 24.7136, 46.6753), ('الخرج', 24.1556, 47.3346)]),
+    'مكة المكرمة': (27, [('جدة', 21.4858, 39.1925), ('مكة المكرمة', 21.3891, 39.8579), ('الطائف', 21.2703, 40.4158)]),
+    'المنطقة الشرقية': (16, [('الدمام', 26.4207, 50.0888), ('الخبر', 26.2172, 50.1971), ('الأحساء', 25.3833, 49.5864)]),
+    'المدينة المنورة': (7, [('المدينة المنورة', 24.5247, 39.5692), ('ينبع', 24.0895, 38.0618)]),
+    'القصيم': (4, [('بريدة', 26.3260, 43.9750), ('عنيزة', 26.0840, 43.9935)]),
+    'عسير': (4, [('أبها', 18.2164, 42.5053), ('خميس مشيط', 18.3000, 42.7333)]),
+    'تبوك': (3, [('تبوك', 28.3835, 36.5662)]),
+    'حائل': (2, [('حائل', 27.5114, 41.7208)]),
+    'جازان': (2, [('جازان', 16.8892, 42.5511)]),
+    'نجران': (2, [('نجران', 17.5650, 44.2289)]),
+    'الباحة': (1, [('الباحة', 20.0129, 41.4677)]),
+    'الجوف': (1, [('سكاكا', 29.9697, 40.2064)]),
+    'الحدود الشمالية': (1, [('عرعر', 30.9753, 41.0381)]),
+}
+DISTRICTS = ['حي النخيل', 'حي الروضة', 'حي العزيزية', 'حي الفيصلية', 'حي السلامة', 'حي الشاطئ', 'حي المروج',
+             'حي الربوة', 'حي الصفا', 'حي الملك فهد', 'حي الياسمين', 'حي الحمراء', 'حي النزهة', 'حي الخالدية']
+STREETS = ['شارع الملك عبدالعزيز', 'طريق الملك فهد', 'شارع الأمير سلطان', 'شارع التحلية', 'طريق الملك عبدالله',
+           'شارع الستين', 'شارع العروبة', 'طريق الأمير محمد بن سلمان', 'شارع الأمير ماجد', 'شارع المدينة المنورة']
+
+# Lookup ids from migrations/0003_lookup_codes.py and 0006_workflow_engine.sql
+ASSET_TYPES = {1: ['مجمع تجاري', 'مركز تسوق', 'معرض'], 2: ['مجمع سكني', 'عمارة سكنية', 'فلل سكنية'],
+               3: ['برج أعمال', 'مبنى إداري'], 4: ['مستودع', 'مصنع', 'ورشة']}
+ASSET_STATUSES = ((11, 80), (12, 8), (13, 12))
+CONSTRUCTION_STATUSES = ((21, 10), (22, 35), (23, 50), (24, 5))
+WORKFLOW_STATUSES = ((31, 30), (32, 30), (33, 35), (34, 5))
+WORKFLOW_PRIORITIES = ((41, 'منخفضة', 25), (42, 'متوسطة', 50), (43, 'عالية', 25))
+ROLES = {51: (40, ['إدارة الأصول', 'خدمة العملاء']), 52: (30, ['إدارة الأصول', 'التخطيط والتطوير']),
+         53: (20, ['الشؤون القانونية']), 54: (10, ['الإدارة العامة', 'الشؤون المالية'])}
+
+FIRST_NAMES = ['محمد', 'أحمد', 'عبدالله', 'خالد', 'سعد', 'فهد', 'عبدالرحمن', 'فيصل', 'سلطان', 'ناصر',
+               'فاطمة', 'نورة', 'سارة', 'ريم', 'هند', 'لمى', 'منيرة', 'عبير', 'أمل', 'دانة']
+LAST_NAMES = ['العتيبي', 'القحطاني', 'الغامدي', 'الزهراني', 'الشهري', 'الحربي', 'الدوسري', 'المطيري',
+              'السبيعي', 'الشمري', 'العنزي', 'الأحمدي', 'البقمي', 'الخالدي', 'السهلي']
+WORKFLOW_TITLES = ['مراجعة تقييم الأصل', 'تحديث المستندات القانونية', 'فحص ميداني للأصل', 'تجديد عقد الإيجار',
+                   'صيانة دورية', 'اعتماد خطة التطوير', 'مراجعة الالتزامات المالية', 'تحديث بيانات الموقع']
+DOCUMENT_TYPES = {'صك ملكية': 'pdf', 'رخصة بناء': 'pdf', 'عقد إيجار': 'pdf', 'مخطط معماري': 'dwg',
+                  'تقرير تقييم': 'pdf', 'صورة الموقع': 'jpg'}
+
+SECTION_TEXT = {
+    'need_assessment': ['احتياج عالٍ لخدمات تجارية في الحي', 'طلب متزايد على الوحدات السكنية', 'احتياج متوسط'],
+    'development_plan': ['تطوير على مرحلتين', 'إعادة تأهيل المبنى القائم', 'إنشاء مبنى متعدد الاستخدامات'],
+    'expected_timeline': ['12 شهراً', '18 شهراً', '24 شهراً', '36 شهراً'],
+    'planning_phase': ['دراسة الجدوى', 'التصميم المبدئي', 'التصميم التفصيلي', 'الترسية'],
+    'location_rating': ['ممتاز', 'جيد جداً', 'جيد', 'متوسط'],
+    'nearby_facilities': ['مدارس ومستشفى ومركز تجاري', 'مساجد وحدائق عامة', 'محطة قطار ومراكز تسوق'],
+    'accessibility': ['على طريق رئيسي', 'قريب من الطريق الدائري', 'داخل الحي'],
+    'investment_proposal': ['تأجير طويل الأجل', 'شراكة مع القطاع الخاص', 'بيع الوحدات', 'استثمار مباشر'],
+    'potential_obstacles': ['تأخر التراخيص', 'ارتفاع تكاليف البناء', 'لا توجد عوائق تذكر'],
+    'expected_return': ['6%', '8%', '10%', '12%'],
+    'funding_source': ['ميزانية الوزارة', 'صندوق التنمية العقارية', 'تمويل بنكي', 'شراكة استثمارية'],
+    'electricity_status': ['متوفر', 'قيد التوصيل', 'غير متوفر'],
+    'water_status': ['متوفر', 'قيد التوصيل', 'غير متوفر'],
+    'sewage_status': ['متوفر', 'خزان تحليل', 'غير متوفر'],
+    'telecom_status': ['ألياف ضوئية', 'متوفر', 'غير متوفر'],
+    'ownership_type': ['ملكية حكومية', 'ملكية خاصة', 'وقف', 'ملكية مشتركة'],
+    'ownership_documents': ['صك إلكتروني', 'صك ورقي', 'حجة استحكام'],
+    'legal_status': ['سليم', 'قيد المراجعة', 'يوجد نزاع'],
+    'land_type': ['أرض مستوية', 'أرض منحدرة', 'أرض زراعية سابقاً'],
+    'zoning_classification': ['تجاري', 'سكني', 'سكني تجاري', 'صناعي'],
+    'risk_assessment': ['منخفض', 'متوسط', 'مرتفع'],
+    'market_conditions': ['سوق نشط', 'سوق مستقر', 'تباطؤ في الطلب'],
+    'future_prospects': ['نمو متوقع مع مشاريع الرؤية', 'استقرار في القيمة', 'فرص تطوير واعدة'],
+}
+
+def weighted(rng, choices):
+    # choices: ((value, ..., weight), ...) -> value
+    return rng.choices(choices, weights=[choice[-1] for choice in choices])[0][0]
+
+def random_time(rng, days_back, now):
+    return now - timedelta(seconds=rng.randint(0, days_back * 86400))
+
+def timestamp(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+class Generator:
+    def __init__(self, app, conn, seed, password):
+        self.app = app
+        self.conn = conn
+        self.rng = random.Random(seed)
+        self.now = datetime.utcnow().replace(microsecond=0)
+        # scrypt is slow on purpose: every user shares one hash
+        self.password = app.hash_password(password)
+        self.regions = [(region, weight) for region, (weight, cities) in REGIONS.items()]
+        self.user_ids = []
+        self.user_names = {}
+        self.asset_ids = []
+        self.labels = dict(conn.execute('SELECT id, label FROM lookups').fetchall())
+
+    def region(self):
+        region = weighted(self.rng, self.regions)
+        return region, self.rng.choice(REGIONS[region][1])
+
+    def write(self, label, total, make_row, sql, after=None):
+        # Batches of BATCH_SIZE rows, one transaction each; after() gets the
+        # batch and its ids
+        started = time.perf_counter()
+        ids = []
+        for offset in range(0, total, BATCH_SIZE):
+            rows = [make_row(offset + i) for i in range(min(BATCH_SIZE, total - offset))]
+            self.conn.begin_write()
+            cursor = self.conn.cursor()
+            batch_ids = cursor.insert_many(sql, rows)
+            if after:
+                after(cursor, rows, batch_ids)
+            self.conn.commit()
+            ids.extend(batch_ids)
+            done = offset + len(rows)
+            if done == total or done % (BATCH_SIZE * 25) == 0:
+                elapsed = time.perf_counter() - started
+                print('%-10s %9d / %d  %8.0f rows/s' % (label, done, total, done / elapsed if elapsed else 0),
+                      file=sys.stderr)
+        return ids
+
+    def users(self, count):
+        self.conn.execute('''
+            INSERT INTO users (username, password, full_name, email, role_id, department, region)
+            VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING
+        ''', ('admin', self.password, 'مدير النظام', 'admin@madares.sa', 54, 'الإدارة العامة', 'الرياض'))
+        self.conn.commit()
+        start = self.conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        roles = [(role_id, weight) for role_id, (weight, departments) in ROLES.items()]
+
+        def make_row(n):
+            role_id = weighted(self.rng, roles)
+            full_name = '%s %s' % (self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES))
+            username = 'user%07d' % (start + n)
+            region, (city, latitude, longitude) = self.region()
+            return (username, self.password, full_name, username + '@madares.sa', role_id,
+                    self.rng.choice(ROLES[role_id][1]), city)
+
+        ids = self.write('users', count, make_row, '''
+            INSERT INTO users (username, password, full_name, email, role_id, department, region)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''')
+        self.user_ids = [user_id for user_id, in self.conn.execute('SELECT id FROM users').fetchall()]
+        self.user_names = dict(self.conn.execute('SELECT id, full_name FROM users').fetchall())
+        return ids
+
+    def asset(self, n):
+        rng = self.rng
+        region, (city, latitude, longitude) = self.region()
+        type_id = rng.choice(list(ASSET_TYPES))
+        category = rng.choice(ASSET_TYPES[type_id])
+        district = rng.choice(DISTRICTS)
+        construction_id = weighted(rng, CONSTRUCTION_STATUSES)
+        completion = {21: 0, 22: rng.randint(5, 95), 23: 100, 24: rng.randint(10, 70)}[construction_id]
+        created = random_time(rng, 3650, self.now)
+        start = created + timedelta(days=rng.randint(30, 365))
+        value = round(rng.lognormvariate(16.5, 0.8), -3)
+        return (
+            '%s %s - %s' % (category, city, district), type_id, category, weighted(rng, ASSET_STATUSES),
+            'MOE-%s-%07d' % (created.year, n), created.date().isoformat(), construction_id, completion,
+            start.date().isoformat(), (start + timedelta(days=rng.randint(365, 1460))).date().isoformat(),
+            round(latitude + rng.gauss(0, 0.04), 6), round(longitude + rng.gauss(0, 0.04), 6),
+            region, city, district, rng.choice(STREETS), str(rng.randint(1000, 9999)), value,
+            timestamp(created), timestamp(created)
+        )
+
+    def sections(self, asset):
+        # {column: value} covering every column of ASSET_SECTIONS
+        rng = self.rng
+        value = asset[-3]
+        land_area = round(rng.uniform(500, 20000), 1)
+        built_area = round(land_area * rng.uniform(0.4, 2.5), 1)
+        length = round(land_area ** 0.5 * rng.uniform(0.8, 1.25), 1)
+        width = round(land_area / length, 1)
+        market_value = round(value * rng.uniform(0.85, 1.3), -3)
+        rental_income = round(market_value * rng.uniform(0.04, 0.1), -2)
+        operating_expenses = round(rental_income * rng.uniform(0.15, 0.35), -2)
+        net_income = rental_income - operating_expenses
+        debt_service = round(net_income * rng.uniform(0, 0.5), -2)
+        row = {field: rng.choice(choices) for field, choices in SECTION_TEXT.items()}
+        row.update({
+            'total_cost': round(value * rng.uniform(0.6, 0.9), -3),
+            'required_funding': round(value * rng.uniform(0, 0.5), -3),
+            'owner_name': rng.choice(['وزارة التعليم', 'شركة تطوير للمباني', 'الهيئة العامة لعقارات الدولة']),
+            'land_area': land_area,
+            'built_area': built_area,
+            'usable_area': round(built_area * 0.8, 1),
+            'common_area': round(built_area * 0.12, 1),
+            'parking_area': round(land_area * rng.uniform(0.05, 0.2), 1),
+            'green_area': round(land_area * rng.uniform(0.02, 0.1), 1),
+            'length_meters': length,
+            'width_meters': width,
+            'floors_count': rng.randint(1, 30) if asset[1] == 3 else rng.randint(1, 6),
+            'market_value': market_value,
+            'rental_income': rental_income,
+            'operating_expenses': operating_expenses,
+            'net_income': net_income,
+            'roi_percentage': round(net_income / value * 100, 2),
+            'appreciation_rate': round(rng.uniform(-2, 8), 2),
+            'property_tax': 0,
+            'insurance_cost': round(market_value * 0.002, -2),
+            'maintenance_cost': round(operating_expenses * 0.4, -2),
+            'management_fee': round(rental_income * 0.05, -2),
+            'vacancy_rate': round(rng.uniform(0, 25), 1),
+            'cap_rate': round(net_income / market_value * 100, 2),
+            'debt_service': debt_service,
+            'cash_flow': net_income - debt_service,
+            'irr_percentage': round(rng.uniform(4, 14), 2),
+            'npv_value': round(market_value * rng.uniform(-0.1, 0.4), -3),
+            'payback_period': round(value / net_income, 1) if net_income else None,
+        })
+        row['height_meters'] = row['floors_count'] * 3.5
+        for side in ('north', 'south', 'east', 'west'):
+            row[side + '_boundary'] = rng.choice(['شارع عرض 20 م', 'شارع عرض 30 م', 'أرض فضاء', 'قطعة مجاورة', 'ممر مشاة'])
+            row['boundary_length_' + side] = length if side in ('north', 'south') else width
+        return row
+
+    def assets(self, count):
+        start = self.conn.execute('SELECT COUNT(*) FROM assets').fetchone()[0]
+        sections = list(self.app.ASSET_SECTIONS.values())
+        fields = [self.app.CODED_COLUMNS.get(column, column) for column in self.app.ASSET_COLUMNS]
+
+        def add_sections(cursor, rows, ids):
+            filled = [self.sections(row) for row in rows]
+            for table, columns in sections:
+                cursor.executemany(
+                    'INSERT INTO %s (asset_id, %s) VALUES (?, %s)' % (table, ', '.join(columns), ', '.join('?' * len(columns))),
+                    [(asset_id,) + tuple(values[column] for column in columns) for asset_id, values in zip(ids, filled)]
+                )
+            # The 'insert' history entry add_asset writes, so ?as_of works
+            history = []
+            for asset_id, row, values in zip(ids, rows, filled):
+                state = dict(zip(fields, row), **values)
+                for field in ('asset_type', 'asset_status', 'construction_status'):
+                    state[field] = self.labels[state[field]]
+                changes = {field: state[field] for field in self.app.ASSET_HISTORY_FIELDS if state.get(field) is not None}
+                history.append((asset_id, 1, 'insert', self.app.json_dumps(changes).decode('utf-8'), 'admin', row[-1]))
+            cursor.executemany('''
+                INSERT INTO asset_history (asset_id, version, operation, changes, changed_by, changed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', history)
+
+        self.asset_ids.extend(self.write('assets', count, lambda n: self.asset(start + n), '''
+            INSERT INTO assets (
+                asset_name, asset_type_id, asset_category, asset_status_id, unique_id, creation_date,
+                construction_status_id, completion_percentage, construction_start_date, expected_completion_date,
+                latitude, longitude, region, city, district, street_name, building_number, current_value,
+                created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', after=add_sections))
+
+    def workflow(self, n):
+        rng = self.rng
+        status_id = weighted(rng, WORKFLOW_STATUSES)
+        priority_id, priority = rng.choices([p[:2] for p in WORKFLOW_PRIORITIES],
+                                            weights=[p[2] for p in WORKFLOW_PRIORITIES])[0]
+        created = random_time(rng, 365, self.now)
+        changed = created if status_id == 31 else min(self.now, created + timedelta(hours=rng.expovariate(1 / 120)))
+        assignee_id = rng.choice(self.user_ids)
+        progress = {31: 0, 32: rng.randint(10, 90), 33: 100, 34: rng.randint(0, 50)}[status_id]
+        return (
+            rng.choice(WORKFLOW_TITLES), 'مهمة رقم %d ضمن خطة إدارة الأصول' % n, status_id, priority_id,
+            assignee_id, self.user_names[assignee_id], rng.choice(self.asset_ids) if self.asset_ids else None,
+            self.app.default_due_date(priority, created.date()).isoformat(), progress, rng.choice(self.user_ids),
+            timestamp(created), timestamp(changed), timestamp(changed)
+        )
+
+    def workflows(self, count):
+        self.write('workflows', count, self.workflow, '''
+            INSERT INTO workflows (
+                title, description, status_id, priority_id, assignee_id, assigned_to, asset_id, due_date,
+                progress, created_by, created_at, updated_at, status_changed_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''')
+
+    def document(self, n):
+        rng = self.rng
+        document_type = rng.choice(list(DOCUMENT_TYPES))
+        original = '%s_%d.%s' % (document_type.replace(' ', '_'), n, DOCUMENT_TYPES[document_type])
+        # No file behind the row, downloads aren't part of the API
+        return (
+            '%s_%s' % (uuid.UUID(int=rng.getrandbits(128), version=4), original), original, document_type,
+            rng.choice(self.asset_ids) if self.asset_ids else None, rng.randint(50000, 15000000),
+            timestamp(random_time(rng, 1825, self.now)), rng.choice(self.user_ids),
+            'تم استخراج نص %s للأصل' % document_type, 'مكتمل'
+        )
+
+    def documents(self, count):
+        self.write('documents', count, self.document, '''
+            INSERT INTO documents (
+                filename, original_filename, document_type, asset_id, file_size, upload_date, uploaded_by,
+                ocr_text, processing_status
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''')
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill a database with synthetic benchmark data')
+    parser.add_argument('--scale', choices=list(SCALES), default='1k', help='number of assets')
+    parser.add_argument('--db', help='SQLite file (default: MADARES_DB)')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--workflows', type=int)
+    parser.add_argument('--documents', type=int)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--password', default='password123', help='password of every generated user')
+    args = parser.parse_args()
+
+    if args.db:
+        os.environ['MADARES_DB'] = args.db
+    os.environ['MADARES_AUTO_SEED'] = '0'
+    sys.path.insert(0, ROOT)
+    import app
+
+    assets, users, workflows, documents = SCALES[args.scale]
+    started = time.perf_counter()
+    conn = app.get_db()
+    try:
+        generator = Generator(app, conn, args.seed, args.password)
+        generator.users(args.users if args.users is not None else users)
+        generator.assets(assets)
+        generator.workflows(args.workflows if args.workflows is not None else workflows)
+        generator.documents(args.documents if args.documents is not None else documents)
+        app.rebuild_workflow_rollups(conn)
+        # Fresh statistics for the query planner
+        conn.execute('ANALYZE')
+        conn.commit()
+        if conn.dialect == 'sqlite':
+            # Everything into the main file, so it can be copied on its own
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        counts = {table: conn.execute('SELECT COUNT(*) FROM ' + table).fetchone()[0]
+                  for table in ('users', 'assets', 'workflows', 'documents')}
+    finally:
+        conn.close()
+    print('Generated in %.1f s: %s' % (time.perf_counter() - started,
+                                        ', '.join('%d %s' % (count, table) for table, count in counts.items())))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# Throughput of the Flask dev server vs. the production gunicorn setup.
+#
+#   python benchmarks/serving.py --duration 10 --concurrency 32
+#
+# Each server is started in turn on a free port and hammered with keep-alive
+# HTTP clients; requests/s and latency percentiles are printed per server.
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'dev': lambda port: [sys.executable, 'app.py'],
+    'gunicorn': lambda port: [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/stats')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server on port %d did not start' % port)
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def drive(port, paths, duration, concurrency):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        i = offset
+        while time.time() < stop_at:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                # Rejections (429s included) are fast and would inflate req/s
+                if response.status >= 300 and response.status != 304:
+                    errors[0] += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            local.append(time.perf_counter() - started)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2)
+    }
+
+def run_server(name, args):
+    port = free_port()
+    # One client address sends everything, rate limiting would reject most of it
+    env = dict(os.environ, PORT=str(port), MADARES_ACCESS_LOG='', MADARES_LOG_LEVEL='warning', MADARES_RATE_LIMIT='0',
+               MADARES_AUTH_REQUIRED='0')
+    if args.workers:
+        env['MADARES_WORKERS'] = str(args.workers)
+    process = subprocess.Popen(SERVERS[name](port), cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port)
+        return drive(port, args.paths, args.duration, args.concurrency)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare dev server and gunicorn throughput')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, help='gunicorn workers (default from CPU count)')
+    parser.add_argument('--paths', nargs='+', default=['/api/stats', '/api/assets', '/api/workflows', '/api/users'])
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.servers:
+        results[name] = run_server(name, args)
+        print('%-9s %8.1f req/s  p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms  errors %d' % (
+            name, results[name]['requests_per_second'], results[name]['p50_ms'],
+            results[name]['p95_ms'], results[name]['p99_ms'], results[name]['errors']))
+
+    if 'dev' in results and 'gunicorn' in results and results['dev']['requests_per_second']:
+        print('speedup   %.2fx' % (results['gunicorn']['requests_per_second'] / results['dev']['requests_per_second']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# Import-to-first-response latency, the cost of a cold start on Vercel.
+#
+#   python benchmarks/startup.py --runs 10
+#
+# Every run is a fresh interpreter. "cold" runs start without a database file
+# (migrations run), "warm" runs reuse one (only the schema version is checked).
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/api/stats')
+finished = time.perf_counter()
+assert response.status_code == 200, response.data
+print(json.dumps({'import_ms': (imported - started) * 1000, 'first_response_ms': (finished - started) * 1000}))
+'''
+
+def run_probe(db_path, seed):
+    env = dict(os.environ, MADARES_DB=db_path, MADARES_AUTO_SEED='1' if seed else '0', MADARES_AUTH_REQUIRED='0')
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def summarize(samples, key):
+    values = [sample[key] for sample in samples]
+    return {'median': round(statistics.median(values), 2), 'min': round(min(values), 2), 'max': round(max(values), 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import-to-first-response latency')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--seed', action='store_true', help='auto-seed cold databases like Vercel does')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        cold = []
+        for run in range(args.runs):
+            cold.append(run_probe(os.path.join(tmp, 'cold-%d.db' % run), args.seed))
+        warm_db = os.path.join(tmp, 'warm.db')
+        run_probe(warm_db, args.seed)
+        warm = [run_probe(warm_db, args.seed) for run in range(args.runs)]
+
+    for name, samples in (('cold', cold), ('warm', warm)):
+        results[name] = {key: summarize(samples, key) for key in ('import_ms', 'first_response_ms')}
+        print('%-5s import %7.2f ms   first response %7.2f ms   (median of %d)' % (
+            name, results[name]['import_ms']['median'], results[name]['first_response_ms']['median'], args.runs))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# Gunicorn settings for production, every value can be overridden with an
+# environment variable.
+#
+# Deploying new code without dropping requests: the app is preloaded in the
+# master, so `kill -HUP <master pid>` only re-forks workers from the code the
+# master already has (it does reload this file). For new code start a new
+# master next to the old one and retire the old one:
+#   kill -USR2 <old pid>     # new master + workers with the new code
+#   kill -WINCH <old pid>    # old workers finish their requests and exit
+#   kill -QUIT <old pid>     # old master exits
+# In the Docker image gunicorn is PID 1, roll out a new container instead.
+# With MADARES_PRELOAD=0 every worker imports the app itself and SIGHUP is
+# enough, at the cost of running the import (and init_db) once per worker.
+import multiprocessing
+import os
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+bind = os.environ.get('MADARES_BIND', '0.0.0.0:%s' % os.environ.get('PORT', 5000))
+
+# Workers from CPU count, each with a thread pool so slow uploads and
+# long-lived /api/events streams don't block a whole process (app.py lets
+# streams take at most half of the threads, MADARES_SSE_MAX_STREAMS)
+workers = env_int('MADARES_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+worker_class = 'gthread'
+threads = env_int('MADARES_THREADS', 8)
+
+# Import the app (and run init_db) once in the master, workers fork from it.
+# Code changes then need a USR2 upgrade or a restart, see above.
+preload_app = os.environ.get('MADARES_PRELOAD', '1') != '0'
+
+# Keep-alive and timeouts
+keepalive = env_int('MADARES_KEEPALIVE', 5)
+timeout = env_int('MADARES_TIMEOUT', 60)
+graceful_timeout = env_int('MADARES_GRACEFUL_TIMEOUT', 30)
+backlog = env_int('MADARES_BACKLOG', 2048)
+
+# Recycle workers now and then to cap memory growth, with jitter so they
+# don't all restart at once
+max_requests = env_int('MADARES_MAX_REQUESTS', 10000)
+max_requests_jitter = env_int('MADARES_MAX_REQUESTS_JITTER', 1000)
+
+# Set MADARES_ACCESS_LOG to an empty value to turn the access log off
+accesslog = os.environ.get('MADARES_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.environ.get('MADARES_LOG_LEVEL', 'info')
+
+# Change events are published in-process; with several workers each worker
+# relays the shared change log to its own SSE clients instead
+if workers > 1:
+    os.environ.setdefault('MADARES_EVENT_RELAY', '1')
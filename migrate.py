@@ -0,0 +1,363 @@
+# Schema migration runner
+#
+#   python migrate.py status           # applied version and pending migrations
+#   python migrate.py up [--to N]      # apply pending migrations
+#   python migrate.py dry-run          # apply to a copy of the database, time each step
+#
+# Migrations are the ordered files in migrations/, the applied version is kept
+# in PRAGMA user_version (SQLite) or the schema_version table (PostgreSQL):
+#   NNNN_name.sql             plain statements, applied in one transaction
+#   NNNN_name.postgresql.sql  used instead of NNNN_name.sql on PostgreSQL
+#   NNNN_name.py              def upgrade(ctx): ...  for data migrations and
+#                             table rebuilds, see MigrationContext
+#
+# The database is the one the app uses (MADARES_DATABASE_URL or MADARES_DB).
+# app.py applies pending migrations at startup (unless MADARES_AUTO_MIGRATE=0),
+# long-running ones are better applied ahead of a deploy with `up`.
+import argparse
+import importlib.util
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from storage import SQLiteStorage, open_storage
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks on Windows
+    fcntl = None
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+BATCH_SIZE = int(os.environ.get('MADARES_MIGRATION_BATCH_SIZE', 5000))
+BATCH_PAUSE = float(os.environ.get('MADARES_MIGRATION_BATCH_PAUSE', 0.01))
+
+def list_migrations(migrations_dir=MIGRATIONS_DIR, dialect='sqlite'):
+    migrations = {}
+    for name in sorted(os.listdir(migrations_dir)):
+        prefix = name.split('_', 1)[0]
+        if not prefix.isdigit() or not name.endswith(('.sql', '.py')):
+            continue
+        variant = name.split('.')[-2] if name.count('.') > 1 else None
+        if variant is None:
+            migrations.setdefault(int(prefix), name)
+        elif variant == dialect:
+            migrations[int(prefix)] = name
+    return sorted(migrations.items())
+
+def split_sql(script):
+    # Split a script into statements, keeping trigger bodies together
+    statements = []
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            if statement.strip():
+                statements.append(statement.strip())
+            statement = ''
+    if statement.strip():
+        statements.append(statement.strip())
+    return statements
+
+def schema_version(conn):
+    if conn.dialect == 'sqlite':
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    if conn.execute("SELECT to_regclass('schema_version')").fetchone()[0] is None:
+        return 0
+    row = conn.execute('SELECT version FROM schema_version').fetchone()
+    return row[0] if row else 0
+
+def set_schema_version(conn, version):
+    if conn.dialect == 'sqlite':
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+    else:
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+        conn.execute('DELETE FROM schema_version')
+        conn.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+
+class MigrationContext:
+    # Passed to upgrade(ctx) of Python migrations. The connection is in
+    # autocommit mode: wrap related statements in ctx.transaction(), long
+    # copies are split into one short transaction per batch.
+    def __init__(self, conn, progress=None, batch_size=BATCH_SIZE, pause=BATCH_PAUSE):
+        self.conn = conn
+        self.dialect = conn.dialect
+        # Batches are cut by rowid on SQLite and by primary key on PostgreSQL
+        self.row_key = 'rowid' if self.dialect == 'sqlite' else 'id'
+        self.batch_size = batch_size
+        self.pause = pause
+        self._progress = progress
+
+    def progress(self, message):
+        if self._progress:
+            self._progress(message)
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    def executescript(self, script):
+        if self.dialect != 'sqlite':
+            # PostgreSQL takes the whole script (function bodies included)
+            self.conn.execute(script)
+            return
+        for statement in split_sql(script):
+            self.conn.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        self.conn.execute('BEGIN IMMEDIATE' if self.dialect == 'sqlite' else 'BEGIN')
+        try:
+            yield self
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def columns(self, table):
+        if self.dialect == 'sqlite':
+            return [row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')]
+        return [row[0] for row in self.conn.execute(
+            'SELECT column_name FROM information_schema.columns WHERE table_name = ? ORDER BY ordinal_position',
+            (table,)
+        )]
+
+    def add_column(self, table, definition):
+        # ALTER TABLE ADD COLUMN only touches the schema (on PostgreSQL as long
+        # as the default is constant), no rows are rewritten
+        if definition.split()[0] not in self.columns(table):
+            self.execute(f'ALTER TABLE {table} ADD COLUMN {definition}')
+
+    def copy_in_batches(self, source, insert_sql, select_sql, label=None):
+        # Run `insert_sql` + `select_sql` over `source` in ranges of
+        # batch_size rows (by self.row_key), committing after each, so writers
+        # are only ever blocked for one batch. `select_sql` must end in a WHERE
+        # clause taking the (low, high] bounds as its last two parameters.
+        label = label or source
+        key = self.row_key
+        total = self.execute(f'SELECT COUNT(*) FROM {source}').fetchone()[0]
+        copied = 0
+        last = 0
+        started = time.monotonic()
+        while True:
+            bound = self.execute(
+                f'SELECT {key} FROM {source} WHERE {key} > ? ORDER BY {key} LIMIT 1 OFFSET ?',
+                (last, self.batch_size - 1)
+            ).fetchone()
+            high = bound[0] if bound else self.execute(f'SELECT COALESCE(MAX({key}), 0) FROM {source}').fetchone()[0]
+            if high <= last:
+                break
+            with self.transaction():
+                cursor = self.execute(f'{insert_sql} {select_sql}', (last, high))
+                copied += max(cursor.rowcount, 0)
+            last = high
+            elapsed = time.monotonic() - started
+            if total:
+                rate = copied / elapsed if elapsed else 0
+                remaining = (total - copied) / rate if rate and total > copied else 0
+                self.progress('%s: %d/%d rows (%.0f%%), %.0f rows/s, ~%.0fs left' % (
+                    label, copied, total, min(copied * 100.0 / total, 100), rate, remaining))
+            if not bound:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+        return copied
+
+    def rebuild_table(self, table, create_sql, select=None, drop_indexes=()):
+        # Online table rebuild for changes ALTER TABLE can't do (dropping or
+        # retyping columns, new constraints):
+        #   1. create the new table from `create_sql` (use {table} as its name)
+        #      and mirror every write on the old table into it with triggers;
+        #   2. copy existing rows in batches (INSERT OR IGNORE, mirrored rows
+        #      are newer and win);
+        #   3. in one short transaction swap the tables and recreate the old
+        #      indexes and triggers, except `drop_indexes`.
+        # `select` maps new column names to SQL expressions over the old row,
+        # other columns are copied by name when the old table has them.
+        # SQLite only: on PostgreSQL use ALTER TABLE, which covers these cases.
+        if self.dialect != 'sqlite':
+            raise NotImplementedError('rebuild_table is for SQLite, use ALTER TABLE on PostgreSQL')
+        new_table = table + '__new'
+        select = select or {}
+
+        with self.transaction():
+            self.execute(f'DROP TABLE IF EXISTS {new_table}')
+            self.execute(create_sql.format(table=new_table))
+            old_columns = set(self.columns(table))
+            columns = [c for c in self.columns(new_table) if c in select or c in old_columns]
+            if 'id' not in columns:
+                raise ValueError('rebuild_table needs an id column to mirror writes')
+            column_list = ', '.join(columns)
+            expressions = ', '.join(select.get(c, c) for c in columns)
+            saved = self.execute(
+                "SELECT name, sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+                (table,)
+            ).fetchall()
+            for operation, ref in (('INSERT', 'NEW'), ('UPDATE', 'NEW')):
+                self.execute(f'''
+                    CREATE TRIGGER {table}__mirror_{operation.lower()} AFTER {operation} ON {table}
+                    BEGIN
+                        INSERT OR REPLACE INTO {new_table} ({column_list})
+                        SELECT {expressions} FROM {table} WHERE rowid = {ref}.rowid;
+                    END
+                ''')
+            self.execute(f'''
+                CREATE TRIGGER {table}__mirror_delete AFTER DELETE ON {table}
+                BEGIN
+                    DELETE FROM {new_table} WHERE id = OLD.id;
+                END
+            ''')
+
+        self.copy_in_batches(
+            table,
+            f'INSERT OR IGNORE INTO {new_table} ({column_list})',
+            f'SELECT {expressions} FROM {table} WHERE rowid > ? AND rowid <= ?',
+            label='rebuild ' + table
+        )
+
+        with self.transaction():
+            # Rows written since the copy started are already mirrored
+            sequence = self.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+            self.execute(f'DROP TABLE {table}')
+            # Legacy rename skips re-validating triggers of other tables that
+            # name this table while it is briefly missing
+            self.execute('PRAGMA legacy_alter_table = ON')
+            self.execute(f'ALTER TABLE {new_table} RENAME TO {table}')
+            self.execute('PRAGMA legacy_alter_table = OFF')
+            if sequence:
+                # Don't hand out ids of deleted rows again
+                self.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (sequence[0], table))
+            for name, sql in saved:
+                if name not in drop_indexes and not name.startswith(table + '__mirror_'):
+                    self.execute(sql)
+        self.progress('rebuild %s: done' % table)
+
+def load_python_migration(path, version):
+    spec = importlib.util.spec_from_file_location('migration_%04d' % version, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def apply_migration(ctx, version, name, migrations_dir=MIGRATIONS_DIR):
+    path = os.path.join(migrations_dir, name)
+    if name.endswith('.sql'):
+        with open(path, encoding='utf-8') as f:
+            script = f.read()
+        with ctx.transaction():
+            ctx.executescript(script)
+            set_schema_version(ctx.conn, version)
+    else:
+        load_python_migration(path, version).upgrade(ctx)
+        with ctx.transaction():
+            set_schema_version(ctx.conn, version)
+
+# Arbitrary key for the PostgreSQL advisory lock held while migrating
+PG_MIGRATION_LOCK = 7313
+
+@contextmanager
+def migration_lock(conn):
+    # Keep several workers (or nodes) from migrating the same database at once
+    if conn.dialect != 'sqlite':
+        conn.execute('SELECT pg_advisory_lock(?)', (PG_MIGRATION_LOCK,))
+        try:
+            yield
+        finally:
+            conn.execute('SELECT pg_advisory_unlock(?)', (PG_MIGRATION_LOCK,))
+        return
+    db_path = conn.storage.path
+    if fcntl is None or db_path == ':memory:':
+        yield
+        return
+    with open(db_path + '.migrate.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def pending_migrations(conn, target=None, migrations_dir=MIGRATIONS_DIR):
+    current = schema_version(conn)
+    return [(version, name) for version, name in list_migrations(migrations_dir, conn.dialect)
+            if version > current and (target is None or version <= target)]
+
+def migrate_db(conn, target=None, progress=None, migrations_dir=MIGRATIONS_DIR, timings=None):
+    # Apply pending migrations. Returns the version the database was at
+    # before; the common case (nothing pending) is a single version read.
+    initial = schema_version(conn)
+    if not pending_migrations(conn, target, migrations_dir):
+        return initial
+
+    conn.commit()
+    conn.set_autocommit(True)
+    try:
+        with migration_lock(conn):
+            # Another process may have migrated while we waited for the lock
+            initial = schema_version(conn)
+            if initial == 0 and conn.dialect == 'sqlite':
+                # WAL lets readers keep going while migrations and writers commit
+                conn.execute('PRAGMA journal_mode=WAL')
+            ctx = MigrationContext(conn, progress)
+            for version, name in pending_migrations(conn, target, migrations_dir):
+                ctx.progress('applying %s' % name)
+                started = time.perf_counter()
+                apply_migration(ctx, version, name, migrations_dir)
+                if timings is not None:
+                    timings.append((name, time.perf_counter() - started))
+    finally:
+        conn.set_autocommit(False)
+    return initial
+
+def dry_run(storage, target=None, migrations_dir=MIGRATIONS_DIR):
+    # Apply pending migrations to a copy of the database and report how long
+    # each one takes with the real data
+    if storage.dialect != 'sqlite':
+        raise RuntimeError('dry-run copies SQLite databases only, for PostgreSQL '
+                           'restore a dump into a scratch database and run `up` against it')
+    timings = []
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = SQLiteStorage(os.path.join(tmp, 'dry-run.db'), pool_size=1)
+        conn = copy.connect()
+        try:
+            if os.path.exists(storage.path):
+                source = sqlite3.connect(storage.path)
+                source.backup(conn.raw)
+                source.close()
+            migrate_db(conn, target, progress=print, migrations_dir=migrations_dir, timings=timings)
+        finally:
+            conn.close()
+            copy.close_all()
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply schema migrations')
+    parser.add_argument('command', choices=('status', 'up', 'dry-run'))
+    parser.add_argument('--db', default=os.environ.get('MADARES_DATABASE_URL') or os.environ.get('MADARES_DB', '/tmp/madares.db'),
+                        help='SQLite file or postgresql:// URL')
+    parser.add_argument('--to', type=int, dest='target', help='stop after this version')
+    args = parser.parse_args()
+
+    storage = open_storage(args.db, sqlite_path=args.db, pool_size=1)
+    if args.command == 'dry-run':
+        timings = dry_run(storage, args.target)
+        if not timings:
+            print('nothing to apply')
+        for name, seconds in timings:
+            print('%-40s %8.2fs' % (name, seconds))
+        return
+
+    conn = storage.connect()
+    try:
+        if args.command == 'status':
+            print('database %s at version %d' % (args.db, schema_version(conn)))
+            for version, name in pending_migrations(conn):
+                print('pending  %s' % name)
+        else:
+            previous = migrate_db(conn, args.target, progress=print)
+            print('migrated %s from version %d to %d' % (args.db, previous, schema_version(conn)))
+    finally:
+        conn.close()
+        storage.close_all()
+
+if __name__ == '__main__':
+    sys.exit(main())
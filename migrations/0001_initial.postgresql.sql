@@ -0,0 +1,239 @@
+-- PostgreSQL variant of 0001_initial.sql, same tables and columns. Foreign
+-- keys are enforced here (SQLite leaves them off), deleting a user or asset
+-- clears the references to it instead of failing.
+
+-- Users table
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    full_name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    role TEXT NOT NULL,
+    department TEXT NOT NULL,
+    region TEXT NOT NULL,
+    status TEXT DEFAULT 'نشط',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Assets table with all 79 MOE fields
+CREATE TABLE IF NOT EXISTS assets (
+    id SERIAL PRIMARY KEY,
+    -- Asset Identification (6 fields)
+    asset_name TEXT NOT NULL,
+    asset_type TEXT NOT NULL,
+    asset_category TEXT,
+    asset_status TEXT DEFAULT 'نشط',
+    unique_id TEXT,
+    creation_date DATE,
+
+    -- Planning Assessment (4 fields)
+    need_assessment TEXT,
+    development_plan TEXT,
+    expected_timeline TEXT,
+    planning_phase TEXT,
+
+    -- Location Attractiveness (3 fields)
+    location_rating TEXT,
+    nearby_facilities TEXT,
+    accessibility TEXT,
+
+    -- Investment Proposal (3 fields)
+    investment_proposal TEXT,
+    potential_obstacles TEXT,
+    expected_return TEXT,
+
+    -- Financial Obligations (3 fields)
+    total_cost DOUBLE PRECISION,
+    required_funding DOUBLE PRECISION,
+    funding_source TEXT,
+
+    -- Utilities Information (4 fields)
+    electricity_status TEXT,
+    water_status TEXT,
+    sewage_status TEXT,
+    telecom_status TEXT,
+
+    -- Ownership Information (4 fields)
+    ownership_type TEXT,
+    owner_name TEXT,
+    ownership_documents TEXT,
+    legal_status TEXT,
+
+    -- Land Details (3 fields)
+    land_area DOUBLE PRECISION,
+    land_type TEXT,
+    zoning_classification TEXT,
+
+    -- Asset Areas (5 fields)
+    built_area DOUBLE PRECISION,
+    usable_area DOUBLE PRECISION,
+    common_area DOUBLE PRECISION,
+    parking_area DOUBLE PRECISION,
+    green_area DOUBLE PRECISION,
+
+    -- Construction Status (4 fields)
+    construction_status TEXT,
+    completion_percentage DOUBLE PRECISION,
+    construction_start_date DATE,
+    expected_completion_date DATE,
+
+    -- Physical Dimensions (4 fields)
+    length_meters DOUBLE PRECISION,
+    width_meters DOUBLE PRECISION,
+    height_meters DOUBLE PRECISION,
+    floors_count INTEGER,
+
+    -- Boundaries (8 fields)
+    north_boundary TEXT,
+    south_boundary TEXT,
+    east_boundary TEXT,
+    west_boundary TEXT,
+    boundary_length_north DOUBLE PRECISION,
+    boundary_length_south DOUBLE PRECISION,
+    boundary_length_east DOUBLE PRECISION,
+    boundary_length_west DOUBLE PRECISION,
+
+    -- Geographic Location (7 fields)
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION,
+    region TEXT,
+    city TEXT,
+    district TEXT,
+    street_name TEXT,
+    building_number TEXT,
+
+    -- Financial & Additional (21+ fields)
+    current_value DOUBLE PRECISION,
+    market_value DOUBLE PRECISION,
+    rental_income DOUBLE PRECISION,
+    operating_expenses DOUBLE PRECISION,
+    net_income DOUBLE PRECISION,
+    roi_percentage DOUBLE PRECISION,
+    appreciation_rate DOUBLE PRECISION,
+    property_tax DOUBLE PRECISION,
+    insurance_cost DOUBLE PRECISION,
+    maintenance_cost DOUBLE PRECISION,
+    management_fee DOUBLE PRECISION,
+    vacancy_rate DOUBLE PRECISION,
+    cap_rate DOUBLE PRECISION,
+    debt_service DOUBLE PRECISION,
+    cash_flow DOUBLE PRECISION,
+    irr_percentage DOUBLE PRECISION,
+    npv_value DOUBLE PRECISION,
+    payback_period DOUBLE PRECISION,
+    risk_assessment TEXT,
+    market_conditions TEXT,
+    future_prospects TEXT,
+
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Workflows table
+CREATE TABLE IF NOT EXISTS workflows (
+    id SERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    status TEXT DEFAULT 'معلقة',
+    priority TEXT DEFAULT 'متوسطة',
+    assignee_id INTEGER,
+    assigned_to TEXT,
+    due_date DATE,
+    progress INTEGER DEFAULT 0,
+    asset_id INTEGER,
+    created_by INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (assignee_id) REFERENCES users (id) ON DELETE SET NULL,
+    FOREIGN KEY (asset_id) REFERENCES assets (id) ON DELETE SET NULL,
+    FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE SET NULL
+);
+
+-- Documents table
+CREATE TABLE IF NOT EXISTS documents (
+    id SERIAL PRIMARY KEY,
+    filename TEXT NOT NULL,
+    original_filename TEXT NOT NULL,
+    document_type TEXT NOT NULL,
+    asset_id INTEGER,
+    file_size INTEGER,
+    upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    uploaded_by INTEGER,
+    ocr_text TEXT,
+    processing_status TEXT DEFAULT 'معلق',
+    file_path TEXT,
+    FOREIGN KEY (asset_id) REFERENCES assets (id) ON DELETE SET NULL,
+    FOREIGN KEY (uploaded_by) REFERENCES users (id) ON DELETE SET NULL
+);
+
+-- Per-table version stamps, bumped by triggers on every write (ETags, cache keys)
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Change log feeding /api/sync, the sequence number is the sync token
+CREATE TABLE IF NOT EXISTS change_log (
+    seq BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    operation TEXT NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log (changed_at);
+
+INSERT INTO table_versions (table_name) VALUES ('users') ON CONFLICT DO NOTHING;
+INSERT INTO table_versions (table_name) VALUES ('assets') ON CONFLICT DO NOTHING;
+INSERT INTO table_versions (table_name) VALUES ('workflows') ON CONFLICT DO NOTHING;
+INSERT INTO table_versions (table_name) VALUES ('documents') ON CONFLICT DO NOTHING;
+
+-- Version stamps move once per statement, the change log gets a row per
+-- changed row. The advisory lock makes change_log sequence numbers commit in
+-- order, otherwise a sync token could skip a row committed after a later one.
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION log_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(4242);
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO change_log (table_name, row_id, operation) VALUES (TG_TABLE_NAME, OLD.id, 'delete');
+    ELSE
+        INSERT INTO change_log (table_name, row_id, operation) VALUES (TG_TABLE_NAME, NEW.id, lower(TG_OP));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_version AFTER INSERT OR UPDATE OR DELETE ON users
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+CREATE TRIGGER users_changes AFTER INSERT OR UPDATE OR DELETE ON users
+FOR EACH ROW EXECUTE FUNCTION log_change();
+
+CREATE TRIGGER assets_version AFTER INSERT OR UPDATE OR DELETE ON assets
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+CREATE TRIGGER assets_changes AFTER INSERT OR UPDATE OR DELETE ON assets
+FOR EACH ROW EXECUTE FUNCTION log_change();
+
+CREATE TRIGGER workflows_version AFTER INSERT OR UPDATE OR DELETE ON workflows
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+CREATE TRIGGER workflows_changes AFTER INSERT OR UPDATE OR DELETE ON workflows
+FOR EACH ROW EXECUTE FUNCTION log_change();
+
+CREATE TRIGGER documents_version AFTER INSERT OR UPDATE OR DELETE ON documents
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+CREATE TRIGGER documents_changes AFTER INSERT OR UPDATE OR DELETE ON documents
+FOR EACH ROW EXECUTE FUNCTION log_change();
@@ -0,0 +1,374 @@
+-- Base schema: users, assets (MOE fields), workflows and documents, plus
+-- the version stamps and change log maintained by triggers.
+
+-- Users table
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    full_name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    role TEXT NOT NULL,
+    department TEXT NOT NULL,
+    region TEXT NOT NULL,
+    status TEXT DEFAULT 'نشط',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Assets table with all 79 MOE fields
+CREATE TABLE IF NOT EXISTS assets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    -- Asset Identification (6 fields)
+    asset_name TEXT NOT NULL,
+    asset_type TEXT NOT NULL,
+    asset_category TEXT,
+    asset_status TEXT DEFAULT 'نشط',
+    unique_id TEXT,
+    creation_date DATE,
+
+    -- Planning Assessment (4 fields)
+    need_assessment TEXT,
+    development_plan TEXT,
+    expected_timeline TEXT,
+    planning_phase TEXT,
+
+    -- Location Attractiveness (3 fields)
+    location_rating TEXT,
+    nearby_facilities TEXT,
+    accessibility TEXT,
+
+    -- Investment Proposal (3 fields)
+    investment_proposal TEXT,
+    potential_obstacles TEXT,
+    expected_return TEXT,
+
+    -- Financial Obligations (3 fields)
+    total_cost REAL,
+    required_funding REAL,
+    funding_source TEXT,
+
+    -- Utilities Information (4 fields)
+    electricity_status TEXT,
+    water_status TEXT,
+    sewage_status TEXT,
+    telecom_status TEXT,
+
+    -- Ownership Information (4 fields)
+    ownership_type TEXT,
+    owner_name TEXT,
+    ownership_documents TEXT,
+    legal_status TEXT,
+
+    -- Land Details (3 fields)
+    land_area REAL,
+    land_type TEXT,
+    zoning_classification TEXT,
+
+    -- Asset Areas (5 fields)
+    built_area REAL,
+    usable_area REAL,
+    common_area REAL,
+    parking_area REAL,
+    green_area REAL,
+
+    -- Construction Status (4 fields)
+    construction_status TEXT,
+    completion_percentage REAL,
+    construction_start_date DATE,
+    expected_completion_date DATE,
+
+    -- Physical Dimensions (4 fields)
+    length_meters REAL,
+    width_meters REAL,
+    height_meters REAL,
+    floors_count INTEGER,
+
+    -- Boundaries (8 fields)
+    north_boundary TEXT,
+    south_boundary TEXT,
+    east_boundary TEXT,
+    west_boundary TEXT,
+    boundary_length_north REAL,
+    boundary_length_south REAL,
+    boundary_length_east REAL,
+    boundary_length_west REAL,
+
+    -- Geographic Location (7 fields)
+    latitude REAL,
+    longitude REAL,
+    region TEXT,
+    city TEXT,
+    district TEXT,
+    street_name TEXT,
+    building_number TEXT,
+
+    -- Financial & Additional (21+ fields)
+    current_value REAL,
+    market_value REAL,
+    rental_income REAL,
+    operating_expenses REAL,
+    net_income REAL,
+    roi_percentage REAL,
+    appreciation_rate REAL,
+    property_tax REAL,
+    insurance_cost REAL,
+    maintenance_cost REAL,
+    management_fee REAL,
+    vacancy_rate REAL,
+    cap_rate REAL,
+    debt_service REAL,
+    cash_flow REAL,
+    irr_percentage REAL,
+    npv_value REAL,
+    payback_period REAL,
+    risk_assessment TEXT,
+    market_conditions TEXT,
+    future_prospects TEXT,
+
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Workflows table
+CREATE TABLE IF NOT EXISTS workflows (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    description TEXT,
+    status TEXT DEFAULT 'معلقة',
+    priority TEXT DEFAULT 'متوسطة',
+    assignee_id INTEGER,
+    assigned_to TEXT,
+    due_date DATE,
+    progress INTEGER DEFAULT 0,
+    asset_id INTEGER,
+    created_by INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (assignee_id) REFERENCES users (id),
+    FOREIGN KEY (asset_id) REFERENCES assets (id),
+    FOREIGN KEY (created_by) REFERENCES users (id)
+);
+
+-- Documents table
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    original_filename TEXT NOT NULL,
+    document_type TEXT NOT NULL,
+    asset_id INTEGER,
+    file_size INTEGER,
+    upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    uploaded_by INTEGER,
+    ocr_text TEXT,
+    processing_status TEXT DEFAULT 'معلق',
+    file_path TEXT,
+    FOREIGN KEY (asset_id) REFERENCES assets (id),
+    FOREIGN KEY (uploaded_by) REFERENCES users (id)
+);
+
+-- Per-table version stamps, bumped by triggers on every write (ETags, cache keys)
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Change log feeding /api/sync, the sequence number is the sync token
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    operation TEXT NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log (changed_at);
+
+INSERT OR IGNORE INTO table_versions (table_name) VALUES ('users');
+INSERT OR IGNORE INTO table_versions (table_name) VALUES ('assets');
+INSERT OR IGNORE INTO table_versions (table_name) VALUES ('workflows');
+INSERT OR IGNORE INTO table_versions (table_name) VALUES ('documents');
+
+-- users: version stamp and change log
+CREATE TRIGGER IF NOT EXISTS users_version_insert
+AFTER INSERT ON users
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'users';
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_version_update
+AFTER UPDATE ON users
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'users';
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_version_delete
+AFTER DELETE ON users
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'users';
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_changes_insert
+AFTER INSERT ON users
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('users', NEW.id, 'insert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_changes_update
+AFTER UPDATE ON users
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('users', NEW.id, 'update');
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_changes_delete
+AFTER DELETE ON users
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('users', OLD.id, 'delete');
+END;
+
+-- assets: version stamp and change log
+CREATE TRIGGER IF NOT EXISTS assets_version_insert
+AFTER INSERT ON assets
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'assets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS assets_version_update
+AFTER UPDATE ON assets
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'assets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS assets_version_delete
+AFTER DELETE ON assets
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'assets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS assets_changes_insert
+AFTER INSERT ON assets
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('assets', NEW.id, 'insert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS assets_changes_update
+AFTER UPDATE ON assets
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('assets', NEW.id, 'update');
+END;
+
+CREATE TRIGGER IF NOT EXISTS assets_changes_delete
+AFTER DELETE ON assets
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('assets', OLD.id, 'delete');
+END;
+
+-- workflows: version stamp and change log
+CREATE TRIGGER IF NOT EXISTS workflows_version_insert
+AFTER INSERT ON workflows
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'workflows';
+END;
+
+CREATE TRIGGER IF NOT EXISTS workflows_version_update
+AFTER UPDATE ON workflows
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'workflows';
+END;
+
+CREATE TRIGGER IF NOT EXISTS workflows_version_delete
+AFTER DELETE ON workflows
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'workflows';
+END;
+
+CREATE TRIGGER IF NOT EXISTS workflows_changes_insert
+AFTER INSERT ON workflows
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('workflows', NEW.id, 'insert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS workflows_changes_update
+AFTER UPDATE ON workflows
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('workflows', NEW.id, 'update');
+END;
+
+CREATE TRIGGER IF NOT EXISTS workflows_changes_delete
+AFTER DELETE ON workflows
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('workflows', OLD.id, 'delete');
+END;
+
+-- documents: version stamp and change log
+CREATE TRIGGER IF NOT EXISTS documents_version_insert
+AFTER INSERT ON documents
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'documents';
+END;
+
+CREATE TRIGGER IF NOT EXISTS documents_version_update
+AFTER UPDATE ON documents
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'documents';
+END;
+
+CREATE TRIGGER IF NOT EXISTS documents_version_delete
+AFTER DELETE ON documents
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = 'documents';
+END;
+
+CREATE TRIGGER IF NOT EXISTS documents_changes_insert
+AFTER INSERT ON documents
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('documents', NEW.id, 'insert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS documents_changes_update
+AFTER UPDATE ON documents
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('documents', NEW.id, 'update');
+END;
+
+CREATE TRIGGER IF NOT EXISTS documents_changes_delete
+AFTER DELETE ON documents
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('documents', OLD.id, 'delete');
+END;
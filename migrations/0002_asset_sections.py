@@ -0,0 +1,116 @@
+# Move the rarely-read MOE sections of assets into 1:1 side tables keyed by
+# asset_id. The assets row keeps identification, construction status,
+# geographic location and current_value, which listings and stats use. Side
+# rows only exist for assets with at least one value in that section.
+
+SECTIONS = {
+    'asset_planning': (('need_assessment', 'TEXT'), ('development_plan', 'TEXT'),
+                       ('expected_timeline', 'TEXT'), ('planning_phase', 'TEXT')),
+    'asset_attractiveness': (('location_rating', 'TEXT'), ('nearby_facilities', 'TEXT'), ('accessibility', 'TEXT')),
+    'asset_investment': (('investment_proposal', 'TEXT'), ('potential_obstacles', 'TEXT'), ('expected_return', 'TEXT')),
+    'asset_obligations': (('total_cost', 'REAL'), ('required_funding', 'REAL'), ('funding_source', 'TEXT')),
+    'asset_utilities': (('electricity_status', 'TEXT'), ('water_status', 'TEXT'),
+                        ('sewage_status', 'TEXT'), ('telecom_status', 'TEXT')),
+    'asset_ownership': (('ownership_type', 'TEXT'), ('owner_name', 'TEXT'),
+                        ('ownership_documents', 'TEXT'), ('legal_status', 'TEXT')),
+    'asset_land': (('land_area', 'REAL'), ('land_type', 'TEXT'), ('zoning_classification', 'TEXT')),
+    'asset_areas': (('built_area', 'REAL'), ('usable_area', 'REAL'), ('common_area', 'REAL'),
+                    ('parking_area', 'REAL'), ('green_area', 'REAL')),
+    'asset_dimensions': (('length_meters', 'REAL'), ('width_meters', 'REAL'),
+                         ('height_meters', 'REAL'), ('floors_count', 'INTEGER')),
+    'asset_boundaries': (('north_boundary', 'TEXT'), ('south_boundary', 'TEXT'), ('east_boundary', 'TEXT'),
+                         ('west_boundary', 'TEXT'), ('boundary_length_north', 'REAL'), ('boundary_length_south', 'REAL'),
+                         ('boundary_length_east', 'REAL'), ('boundary_length_west', 'REAL')),
+    'asset_financials': (('market_value', 'REAL'), ('rental_income', 'REAL'), ('operating_expenses', 'REAL'),
+                         ('net_income', 'REAL'), ('roi_percentage', 'REAL'), ('appreciation_rate', 'REAL'),
+                         ('property_tax', 'REAL'), ('insurance_cost', 'REAL'), ('maintenance_cost', 'REAL'),
+                         ('management_fee', 'REAL'), ('vacancy_rate', 'REAL'), ('cap_rate', 'REAL'),
+                         ('debt_service', 'REAL'), ('cash_flow', 'REAL'), ('irr_percentage', 'REAL'),
+                         ('npv_value', 'REAL'), ('payback_period', 'REAL'), ('risk_assessment', 'TEXT'),
+                         ('market_conditions', 'TEXT'), ('future_prospects', 'TEXT'))
+}
+
+ASSETS = '''
+CREATE TABLE {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    asset_name TEXT NOT NULL,
+    asset_type TEXT NOT NULL,
+    asset_category TEXT,
+    asset_status TEXT DEFAULT 'نشط',
+    unique_id TEXT,
+    creation_date DATE,
+    construction_status TEXT,
+    completion_percentage REAL,
+    construction_start_date DATE,
+    expected_completion_date DATE,
+    latitude REAL,
+    longitude REAL,
+    region TEXT,
+    city TEXT,
+    district TEXT,
+    street_name TEXT,
+    building_number TEXT,
+    current_value REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+def create_section(ctx, table, columns):
+    if ctx.dialect == 'sqlite':
+        definitions = ', '.join('%s %s' % column for column in columns)
+        ctx.execute(f'CREATE TABLE IF NOT EXISTS {table} (asset_id INTEGER PRIMARY KEY, {definitions})')
+    else:
+        definitions = ', '.join('%s %s' % (name, 'DOUBLE PRECISION' if kind == 'REAL' else kind) for name, kind in columns)
+        ctx.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                    f'(asset_id INTEGER PRIMARY KEY REFERENCES assets (id) ON DELETE CASCADE, {definitions})')
+
+def upgrade(ctx):
+    names = {table: [name for name, kind in columns] for table, columns in SECTIONS.items()}
+
+    if ctx.dialect != 'sqlite':
+        # Writers wait during the copy, readers only for the (metadata-only)
+        # DROP COLUMN at the end
+        with ctx.transaction():
+            ctx.execute('LOCK TABLE assets IN SHARE MODE')
+            for table, columns in SECTIONS.items():
+                create_section(ctx, table, columns)
+                column_list = ', '.join(names[table])
+                ctx.execute(f'INSERT INTO {table} (asset_id, {column_list}) SELECT id, {column_list} FROM assets '
+                            f'WHERE {" OR ".join(c + " IS NOT NULL" for c in names[table])}')
+            ctx.execute('ALTER TABLE assets ' + ', '.join('DROP COLUMN ' + c for cols in names.values() for c in cols))
+        return
+
+    with ctx.transaction():
+        for table, columns in SECTIONS.items():
+            create_section(ctx, table, columns)
+            column_list = ', '.join(names[table])
+            values = ', '.join('NEW.' + c for c in names[table])
+            # Keep side tables current while the existing rows are copied,
+            # dropped together with the old table by rebuild_table
+            for operation in ('insert', 'update'):
+                ctx.execute(f'''
+                    CREATE TRIGGER assets__mirror_{table}_{operation} AFTER {operation.upper()} ON assets
+                    BEGIN
+                        INSERT OR REPLACE INTO {table} (asset_id, {column_list}) VALUES (NEW.id, {values});
+                    END
+                ''')
+        # Side rows go with their asset
+        ctx.execute('''
+            CREATE TRIGGER IF NOT EXISTS assets_sections_delete AFTER DELETE ON assets
+            BEGIN
+                %s
+            END
+        ''' % '\n'.join(f'DELETE FROM {table} WHERE asset_id = OLD.id;' for table in SECTIONS))
+
+    for table in SECTIONS:
+        column_list = ', '.join(names[table])
+        ctx.copy_in_batches(
+            'assets',
+            f'INSERT OR IGNORE INTO {table} (asset_id, {column_list})',
+            f'SELECT id, {column_list} FROM assets '
+            f'WHERE ({" OR ".join(c + " IS NOT NULL" for c in names[table])}) AND rowid > ? AND rowid <= ?',
+            label='copy ' + table
+        )
+
+    ctx.rebuild_table('assets', ASSETS)
@@ -0,0 +1,146 @@
+# Store enumerated labels (asset type and status, construction status,
+# workflow status and priority, user role) as integer ids into a lookups
+# table instead of repeating the Arabic text in every row. Known values get
+# fixed ids and an English label; labels found in existing rows are added.
+
+LOOKUPS = (
+    (1, 'asset_type', 'تجاري', 'Commercial'),
+    (2, 'asset_type', 'سكني', 'Residential'),
+    (3, 'asset_type', 'مكتبي', 'Office'),
+    (4, 'asset_type', 'صناعي', 'Industrial'),
+    (11, 'asset_status', 'نشط', 'Active'),
+    (12, 'asset_status', 'معلق', 'Suspended'),
+    (13, 'asset_status', 'مكتمل', 'Completed'),
+    (21, 'construction_status', 'لم يبدأ', 'Not started'),
+    (22, 'construction_status', 'قيد الإنشاء', 'Under construction'),
+    (23, 'construction_status', 'مكتمل', 'Completed'),
+    (24, 'construction_status', 'معلق', 'On hold'),
+    (31, 'workflow_status', 'معلقة', 'Pending'),
+    (32, 'workflow_status', 'قيد التنفيذ', 'In progress'),
+    (33, 'workflow_status', 'مكتملة', 'Completed'),
+    (41, 'workflow_priority', 'منخفضة', 'Low'),
+    (42, 'workflow_priority', 'متوسطة', 'Medium'),
+    (43, 'workflow_priority', 'عالية', 'High'),
+    (51, 'user_role', 'مستخدم', 'User'),
+    (52, 'user_role', 'محلل أصول', 'Asset analyst'),
+    (53, 'user_role', 'مختص قانوني', 'Legal specialist'),
+    (54, 'user_role', 'مدير', 'Manager'),
+)
+
+# table -> {label column: lookup kind}, the id column is <label column>_id
+COLUMNS = {
+    'assets': {'asset_type': 'asset_type', 'asset_status': 'asset_status', 'construction_status': 'construction_status'},
+    'workflows': {'status': 'workflow_status', 'priority': 'workflow_priority'},
+    'users': {'role': 'user_role'},
+}
+DEFAULTS = {'asset_status': 11, 'status': 31, 'priority': 42}
+REQUIRED = ('asset_type', 'role')
+
+TABLES = {
+    'assets': '''
+CREATE TABLE {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    asset_name TEXT NOT NULL,
+    asset_type_id INTEGER NOT NULL REFERENCES lookups (id),
+    asset_category TEXT,
+    asset_status_id INTEGER DEFAULT 11 REFERENCES lookups (id),
+    unique_id TEXT,
+    creation_date DATE,
+    construction_status_id INTEGER REFERENCES lookups (id),
+    completion_percentage REAL,
+    construction_start_date DATE,
+    expected_completion_date DATE,
+    latitude REAL,
+    longitude REAL,
+    region TEXT,
+    city TEXT,
+    district TEXT,
+    street_name TEXT,
+    building_number TEXT,
+    current_value REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+''',
+    'workflows': '''
+CREATE TABLE {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    description TEXT,
+    status_id INTEGER DEFAULT 31 REFERENCES lookups (id),
+    priority_id INTEGER DEFAULT 42 REFERENCES lookups (id),
+    assignee_id INTEGER,
+    assigned_to TEXT,
+    due_date DATE,
+    progress INTEGER DEFAULT 0,
+    asset_id INTEGER,
+    created_by INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (assignee_id) REFERENCES users (id),
+    FOREIGN KEY (asset_id) REFERENCES assets (id),
+    FOREIGN KEY (created_by) REFERENCES users (id)
+)
+''',
+    'users': '''
+CREATE TABLE {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    full_name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    role_id INTEGER NOT NULL REFERENCES lookups (id),
+    department TEXT NOT NULL,
+    region TEXT NOT NULL,
+    status TEXT DEFAULT 'نشط',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+''',
+}
+
+def lookup_id(kind, column):
+    return f"(SELECT id FROM lookups WHERE kind = '{kind}' AND label = {column})"
+
+def upgrade(ctx):
+    with ctx.transaction():
+        ctx.execute('''
+            CREATE TABLE IF NOT EXISTS lookups (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                label TEXT NOT NULL,
+                label_en TEXT,
+                UNIQUE (kind, label)
+            )
+        ''')
+        for row in LOOKUPS:
+            ctx.execute('INSERT INTO lookups (id, kind, label, label_en) VALUES (?, ?, ?, ?) ON CONFLICT DO NOTHING', row)
+        if ctx.dialect != 'sqlite':
+            # Values added later are numbered after the fixed ones
+            ctx.execute("CREATE SEQUENCE IF NOT EXISTS lookups_id_seq OWNED BY lookups.id")
+            ctx.execute("SELECT setval('lookups_id_seq', (SELECT MAX(id) FROM lookups))")
+            ctx.execute("ALTER TABLE lookups ALTER COLUMN id SET DEFAULT nextval('lookups_id_seq')")
+        for table, columns in COLUMNS.items():
+            for column, kind in columns.items():
+                ctx.execute(f'''
+                    INSERT INTO lookups (kind, label)
+                    SELECT DISTINCT ?, {column} FROM {table} WHERE {column} IS NOT NULL
+                    ON CONFLICT DO NOTHING
+                ''', (kind,))
+
+    if ctx.dialect != 'sqlite':
+        with ctx.transaction():
+            for table, columns in COLUMNS.items():
+                for column, kind in columns.items():
+                    ctx.execute(f'ALTER TABLE {table} ADD COLUMN {column}_id INTEGER REFERENCES lookups (id)')
+                    ctx.execute(f'UPDATE {table} SET {column}_id = {lookup_id(kind, column)}')
+                    ctx.execute(f'ALTER TABLE {table} DROP COLUMN {column}')
+                    if column in DEFAULTS:
+                        ctx.execute(f'ALTER TABLE {table} ALTER COLUMN {column}_id SET DEFAULT {DEFAULTS[column]}')
+                    if column in REQUIRED:
+                        ctx.execute(f'ALTER TABLE {table} ALTER COLUMN {column}_id SET NOT NULL')
+        return
+
+    for table, columns in COLUMNS.items():
+        ctx.rebuild_table(table, TABLES[table], select={
+            column + '_id': lookup_id(kind, column) for column, kind in columns.items()
+        })
@@ -0,0 +1,14 @@
+-- Append-only asset history: one row per write holding only the fields it
+-- changed (JSON, API field names and labels). 'insert' and 'snapshot' rows
+-- hold the full state and are the starting points for time-travel reads.
+CREATE TABLE IF NOT EXISTS asset_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    asset_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    operation TEXT NOT NULL,
+    changes TEXT NOT NULL,
+    changed_by TEXT,
+    changed_at TIMESTAMP NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_asset_history_asset ON asset_history (asset_id, version);
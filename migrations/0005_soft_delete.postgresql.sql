@@ -0,0 +1,25 @@
+-- PostgreSQL variant of 0005_soft_delete.sql
+ALTER TABLE assets ADD COLUMN deleted_at TIMESTAMP;
+ALTER TABLE documents ADD COLUMN deleted_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_assets_deleted_at ON assets (deleted_at) WHERE deleted_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_documents_deleted_at ON documents (deleted_at) WHERE deleted_at IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_workflows_asset ON workflows (asset_id);
+CREATE INDEX IF NOT EXISTS idx_documents_asset ON documents (asset_id);
+CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents (filename);
+
+-- Tables without deleted_at have no such key in to_jsonb(NEW)
+CREATE OR REPLACE FUNCTION log_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(4242);
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO change_log (table_name, row_id, operation) VALUES (TG_TABLE_NAME, OLD.id, 'delete');
+    ELSIF TG_OP = 'UPDATE' AND to_jsonb(NEW) ->> 'deleted_at' IS NOT NULL THEN
+        INSERT INTO change_log (table_name, row_id, operation) VALUES (TG_TABLE_NAME, NEW.id, 'delete');
+    ELSE
+        INSERT INTO change_log (table_name, row_id, operation) VALUES (TG_TABLE_NAME, NEW.id, lower(TG_OP));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
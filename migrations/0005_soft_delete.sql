@@ -0,0 +1,31 @@
+-- Soft delete: deleting an asset or document only stamps deleted_at (a
+-- tombstone), the purge job removes the row, its dependents and its file
+-- later. Tombstoning is logged as a delete so sync and live events treat the
+-- row as gone right away.
+ALTER TABLE assets ADD COLUMN deleted_at TIMESTAMP;
+ALTER TABLE documents ADD COLUMN deleted_at TIMESTAMP;
+
+-- Tombstones are few, the purge job finds them through partial indexes
+CREATE INDEX IF NOT EXISTS idx_assets_deleted_at ON assets (deleted_at) WHERE deleted_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_documents_deleted_at ON documents (deleted_at) WHERE deleted_at IS NOT NULL;
+
+-- Dependents of an asset for the cascade, stored names for the orphan sweep
+CREATE INDEX IF NOT EXISTS idx_workflows_asset ON workflows (asset_id);
+CREATE INDEX IF NOT EXISTS idx_documents_asset ON documents (asset_id);
+CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents (filename);
+
+DROP TRIGGER IF EXISTS assets_changes_update;
+CREATE TRIGGER assets_changes_update
+AFTER UPDATE ON assets
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('assets', NEW.id, CASE WHEN NEW.deleted_at IS NULL THEN 'update' ELSE 'delete' END);
+END;
+
+DROP TRIGGER IF EXISTS documents_changes_update;
+CREATE TRIGGER documents_changes_update
+AFTER UPDATE ON documents
+BEGIN
+    INSERT INTO change_log (table_name, row_id, operation)
+    VALUES ('documents', NEW.id, CASE WHEN NEW.deleted_at IS NULL THEN 'update' ELSE 'delete' END);
+END;
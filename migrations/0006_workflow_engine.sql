@@ -0,0 +1,9 @@
+-- Workflow engine: a cancelled state, SLA flags set by the deadline
+-- scheduler, and the (status, due_date) index it loads upcoming deadlines
+-- from.
+INSERT INTO lookups (id, kind, label, label_en) VALUES (34, 'workflow_status', 'ملغاة', 'Cancelled') ON CONFLICT DO NOTHING;
+
+ALTER TABLE workflows ADD COLUMN escalated_at TIMESTAMP;
+ALTER TABLE workflows ADD COLUMN overdue_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_workflows_status_due ON workflows (status_id, due_date);
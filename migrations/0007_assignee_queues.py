@@ -0,0 +1,29 @@
+# Per-assignee work queues read one (assignee, status, priority) slice of
+# idx_workflows_assignee at a time, ordered by due date. Workflows that only
+# name their assignee in assigned_to get assignee_id from the matching user,
+# and those without a due date get one from their priority's SLA, so every
+# queued row has a sort key.
+SLA_DAYS = {41: 14, 42: 7, 43: 2}
+DEFAULT_SLA_DAYS = 7
+
+def created_plus(ctx, days):
+    if ctx.dialect == 'sqlite':
+        return f"date(created_at, '+{days} days')"
+    return f'CAST(created_at AS DATE) + {days}'
+
+def upgrade(ctx):
+    with ctx.transaction():
+        ctx.execute('''
+            UPDATE workflows
+            SET assignee_id = (SELECT MIN(id) FROM users WHERE users.full_name = workflows.assigned_to
+                                                         OR users.username = workflows.assigned_to)
+            WHERE assignee_id IS NULL AND assigned_to IS NOT NULL
+        ''')
+        for priority_id, days in SLA_DAYS.items():
+            ctx.execute(f'UPDATE workflows SET due_date = {created_plus(ctx, days)} '
+                        'WHERE due_date IS NULL AND priority_id = ?', (priority_id,))
+        ctx.execute(f'UPDATE workflows SET due_date = {created_plus(ctx, DEFAULT_SLA_DAYS)} WHERE due_date IS NULL')
+        ctx.execute('''
+            CREATE INDEX IF NOT EXISTS idx_workflows_assignee
+            ON workflows (assignee_id, status_id, priority_id, due_date, id)
+        ''')
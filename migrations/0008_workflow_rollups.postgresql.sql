@@ -0,0 +1,17 @@
+-- PostgreSQL variant of 0008_workflow_rollups.sql
+-- Pre-aggregated workflow analytics, updated in the transaction of every
+-- workflow creation and status change. One row per (metric, ISO week,
+-- dimension, histogram bucket): counters use bucket 0, duration histograms
+-- keep a count and the summed hours per bucket.
+CREATE TABLE IF NOT EXISTS workflow_rollups (
+    metric TEXT NOT NULL,
+    period TEXT NOT NULL,
+    dimension TEXT NOT NULL DEFAULT '',
+    bucket INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    total DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, period, dimension, bucket)
+);
+
+-- When the workflow entered its current status (NULL: since created_at)
+ALTER TABLE workflows ADD COLUMN status_changed_at TIMESTAMP;
@@ -0,0 +1,16 @@
+-- Pre-aggregated workflow analytics, updated in the transaction of every
+-- workflow creation and status change. One row per (metric, ISO week,
+-- dimension, histogram bucket): counters use bucket 0, duration histograms
+-- keep a count and the summed hours per bucket.
+CREATE TABLE IF NOT EXISTS workflow_rollups (
+    metric TEXT NOT NULL,
+    period TEXT NOT NULL,
+    dimension TEXT NOT NULL DEFAULT '',
+    bucket INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    total REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, period, dimension, bucket)
+);
+
+-- When the workflow entered its current status (NULL: since created_at)
+ALTER TABLE workflows ADD COLUMN status_changed_at TIMESTAMP;
@@ -0,0 +1,19 @@
+# Replace the plaintext passwords in users with salted scrypt hashes, in the
+# format hash_password() in app.py writes: 'scrypt$n$r$p$salt$hash' with
+# base64 salt and hash. Users keep their passwords.
+import base64
+import hashlib
+import os
+
+N, R, P = 2 ** 14, 8, 1
+
+def hash_password(password):
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=N, r=R, p=P, dklen=32)
+    return 'scrypt$%d$%d$%d$%s$%s' % (N, R, P, base64.b64encode(salt).decode(), base64.b64encode(digest).decode())
+
+def upgrade(ctx):
+    with ctx.transaction():
+        rows = ctx.execute('SELECT id, password FROM users WHERE password NOT LIKE ?', ('scrypt$%',)).fetchall()
+        for user_id, password in rows:
+            ctx.execute('UPDATE users SET password = ? WHERE id = ?', (hash_password(password or ''), user_id))
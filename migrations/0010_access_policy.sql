@@ -0,0 +1,50 @@
+-- Which role may read or write which resource: every row ('all'), or only
+-- rows in the region of the user ('region'). Missing rows deny. Resources
+-- are the first segment of the API path (assets, workflows, documents,
+-- users, stats, reports, sync, events) plus 'system' for /api/cache and
+-- /api/db.
+CREATE TABLE IF NOT EXISTS role_permissions (
+    role_id INTEGER NOT NULL REFERENCES lookups (id),
+    resource TEXT NOT NULL,
+    action TEXT NOT NULL,
+    scope TEXT NOT NULL DEFAULT 'region',
+    PRIMARY KEY (role_id, resource, action)
+);
+
+-- مدير (Manager): everything
+INSERT INTO role_permissions (role_id, resource, action, scope) VALUES
+    (54, 'assets', 'read', 'all'), (54, 'assets', 'write', 'all'),
+    (54, 'workflows', 'read', 'all'), (54, 'workflows', 'write', 'all'),
+    (54, 'documents', 'read', 'all'), (54, 'documents', 'write', 'all'),
+    (54, 'users', 'read', 'all'), (54, 'users', 'write', 'all'),
+    (54, 'stats', 'read', 'all'), (54, 'reports', 'read', 'all'),
+    (54, 'sync', 'read', 'all'), (54, 'events', 'read', 'all'),
+    (54, 'system', 'read', 'all')
+ON CONFLICT DO NOTHING;
+
+-- محلل أصول (Asset analyst): assets, their workflows and documents in the region
+INSERT INTO role_permissions (role_id, resource, action, scope) VALUES
+    (52, 'assets', 'read', 'region'), (52, 'assets', 'write', 'region'),
+    (52, 'workflows', 'read', 'region'), (52, 'workflows', 'write', 'region'),
+    (52, 'documents', 'read', 'region'), (52, 'documents', 'write', 'region'),
+    (52, 'users', 'read', 'all'), (52, 'stats', 'read', 'region'), (52, 'events', 'read', 'all')
+ON CONFLICT DO NOTHING;
+
+-- مختص قانوني (Legal specialist): reads assets, works on documents and workflows in the region
+INSERT INTO role_permissions (role_id, resource, action, scope) VALUES
+    (53, 'assets', 'read', 'region'),
+    (53, 'workflows', 'read', 'region'), (53, 'workflows', 'write', 'region'),
+    (53, 'documents', 'read', 'region'), (53, 'documents', 'write', 'region'),
+    (53, 'users', 'read', 'all'), (53, 'stats', 'read', 'region'), (53, 'events', 'read', 'all')
+ON CONFLICT DO NOTHING;
+
+-- مستخدم (User): reads the region
+INSERT INTO role_permissions (role_id, resource, action, scope) VALUES
+    (51, 'assets', 'read', 'region'), (51, 'workflows', 'read', 'region'),
+    (51, 'documents', 'read', 'region'), (51, 'users', 'read', 'all'),
+    (51, 'stats', 'read', 'region'), (51, 'events', 'read', 'all')
+ON CONFLICT DO NOTHING;
+
+-- Region scoped listings filter on either
+CREATE INDEX IF NOT EXISTS idx_assets_region ON assets (region);
+CREATE INDEX IF NOT EXISTS idx_assets_city ON assets (city);
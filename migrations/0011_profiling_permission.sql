@@ -0,0 +1,4 @@
+-- Starting profiles and downloading them (/api/profiling) needs write
+-- access to 'system', only managers get it
+INSERT INTO role_permissions (role_id, resource, action, scope) VALUES (54, 'system', 'write', 'all')
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,5 @@
+-- /api/sync is narrowed to the user's region like the listings, so every
+-- role that reads assets may sync them (the SPA loads through it)
+INSERT INTO role_permissions (role_id, resource, action, scope) VALUES
+    (51, 'sync', 'read', 'region'), (52, 'sync', 'read', 'region'), (53, 'sync', 'read', 'region')
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,66 @@
+# PostgreSQL: log changes once per statement instead of once per row.
+# log_change() (0001, 0005) took the change_log advisory lock for every
+# changed row. The lock stays: it makes sequence numbers commit in order, so
+# a sync token can't skip a row committed after a later one. Now each
+# statement takes it once and writes its rows from the transition table in
+# one INSERT ... SELECT, and statements that changed nothing don't take it.
+# Transition tables need one trigger per operation.
+# SQLite serializes writers itself and keeps its row triggers.
+TABLES = ('users', 'assets', 'workflows', 'documents')
+
+FUNCTIONS = '''
+CREATE OR REPLACE FUNCTION log_inserts() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM new_rows) THEN
+        PERFORM pg_advisory_xact_lock(4242);
+        INSERT INTO change_log (table_name, row_id, operation)
+        SELECT TG_TABLE_NAME, id, 'insert' FROM new_rows ORDER BY id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Tables without deleted_at have no such key in to_jsonb(row)
+CREATE OR REPLACE FUNCTION log_updates() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM new_rows) THEN
+        PERFORM pg_advisory_xact_lock(4242);
+        INSERT INTO change_log (table_name, row_id, operation)
+        SELECT TG_TABLE_NAME, changed.id,
+               CASE WHEN to_jsonb(changed) ->> 'deleted_at' IS NOT NULL THEN 'delete' ELSE 'update' END
+        FROM new_rows changed ORDER BY changed.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION log_deletes() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM old_rows) THEN
+        PERFORM pg_advisory_xact_lock(4242);
+        INSERT INTO change_log (table_name, row_id, operation)
+        SELECT TG_TABLE_NAME, id, 'delete' FROM old_rows ORDER BY id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+TRIGGERS = '''
+DROP TRIGGER IF EXISTS {table}_changes ON {table};
+CREATE TRIGGER {table}_inserts AFTER INSERT ON {table}
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_inserts();
+CREATE TRIGGER {table}_updates AFTER UPDATE ON {table}
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_updates();
+CREATE TRIGGER {table}_deletes AFTER DELETE ON {table}
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION log_deletes();
+'''
+
+def upgrade(ctx):
+    if ctx.dialect == 'sqlite':
+        return
+    with ctx.transaction():
+        ctx.executescript(FUNCTIONS)
+        for table in TABLES:
+            ctx.executescript(TRIGGERS.format(table=table))
+        ctx.execute('DROP FUNCTION IF EXISTS log_change()')
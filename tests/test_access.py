@@ -0,0 +1,104 @@
+import pytest
+
+def token(client, username, password='password123'):
+    response = client.post('/api/auth/token', json={'username': username, 'password': password})
+    assert response.status_code == 200, response.json
+    return {'Authorization': 'Bearer ' + response.json['token']}
+
+NEW_MANAGER = {'username': 'intruder', 'password': 'intruder-password', 'full_name': 'دخيل',
+               'email': 'intruder@madares.sa', 'role': 'مدير', 'department': 'الإدارة العامة', 'region': 'الرياض'}
+
+def test_anonymous_requests_need_credentials(client):
+    assert client.get('/api/assets').status_code == 401
+    assert client.get('/api/sync').status_code == 401
+    assert client.post('/api/users', json=NEW_MANAGER).status_code == 401
+    assert client.post('/api/auth/token', json={'username': 'intruder', 'password': 'intruder-password'}).status_code == 401
+    # Public routes
+    assert client.get('/api/lookups').status_code == 200
+
+def test_anonymous_reads_can_be_allowed_but_never_writes(client, madares, monkeypatch):
+    monkeypatch.setattr(madares, 'AUTH_REQUIRED', False)
+    assert client.get('/api/assets').status_code == 200
+    assert client.post('/api/users', json=NEW_MANAGER).status_code == 401
+    assert client.post('/api/assets', json={'asset_name': 'x', 'asset_type': 'تجاري'}).status_code == 401
+    assert client.delete('/api/workflows/1').status_code == 401
+
+def test_forged_token_is_rejected(client):
+    headers = {'Authorization': 'Bearer forged.token.value'}
+    assert client.get('/api/assets', headers=headers).status_code == 401
+
+def test_region_scoped_user_sees_only_their_region(client, admin):
+    riyadh = client.post('/api/assets', headers=admin, json={
+        'asset_name': 'أصل الرياض', 'asset_type': 'تجاري', 'region': 'الرياض', 'city': 'الرياض'}).json['id']
+    jeddah = client.post('/api/assets', headers=admin, json={
+        'asset_name': 'أصل جدة', 'asset_type': 'تجاري', 'region': 'مكة المكرمة', 'city': 'جدة'}).json['id']
+    legal = token(client, 'fatima.a')
+
+    assets = client.get('/api/assets', headers=legal).json
+    assert jeddah in [asset['id'] for asset in assets]
+    assert riyadh not in [asset['id'] for asset in assets]
+    assert all('جدة' in (asset['region'], asset['city']) for asset in assets)
+    assert client.get('/api/assets/%d' % riyadh, headers=legal).status_code == 404
+    assert client.get('/api/assets/%d' % jeddah, headers=legal).status_code == 200
+
+    synced = client.get('/api/sync', headers=legal, query_string={'tables': 'assets'}).json
+    assert {row['id'] for row in synced['changes']['assets']['inserted']} == {asset['id'] for asset in assets}
+
+@pytest.mark.parametrize('method, path, body', [
+    ('get', '/api/workflows/reports', None),
+    ('get', '/api/cache/stats', None),
+    ('post', '/api/assets', {'asset_name': 'x', 'asset_type': 'تجاري', 'region': 'جدة'}),
+    ('post', '/api/users', NEW_MANAGER),
+    ('post', '/api/workflows/bulk', {'workflows': [{'title': 'x'}]}),
+])
+def test_region_scoped_user_is_refused(client, method, path, body):
+    legal = token(client, 'fatima.a')
+    response = getattr(client, method)(path, headers=legal, json=body)
+    assert response.status_code == 403, response.json
+
+def test_roles_can_only_be_granted_by_wider_roles(madares):
+    manager, analyst, legal, user = 54, 52, 53, 51
+    assert madares.access_policy.covers(manager, manager)
+    assert madares.access_policy.covers(manager, analyst)
+    assert madares.access_policy.covers(analyst, user)
+    assert not madares.access_policy.covers(analyst, manager)
+    assert not madares.access_policy.covers(legal, analyst)
+    assert not madares.access_policy.covers(user, legal)
+
+def test_weaker_hashes_are_upgraded_at_login(client, madares):
+    conn = madares.get_db()
+    try:
+        conn.execute('UPDATE users SET password = ? WHERE username = ?', (madares.hash_password('password123', n=2 ** 10), 'ahmed.m'))
+        conn.commit()
+    finally:
+        conn.close()
+    token(client, 'ahmed.m')
+    conn = madares.get_db()
+    try:
+        stored = conn.execute('SELECT password FROM users WHERE username = ?', ('ahmed.m',)).fetchone()[0]
+    finally:
+        conn.close()
+    assert not madares.needs_rehash(stored)
+    token(client, 'ahmed.m')
+
+def test_forwarded_client_address_needs_trusted_proxy(madares, monkeypatch):
+    seen = []
+    flask_app = madares.app.wsgi_app
+    def remote_addr(environ, start_response):
+        seen.append(environ['REMOTE_ADDR'])
+        return flask_app(environ, start_response)
+    for hops in (0, 1):
+        monkeypatch.setattr(madares.app, 'wsgi_app', madares.behind_proxies(remote_addr, hops))
+        response = madares.app.test_client().get('/api/lookups', headers={'X-Forwarded-For': '203.0.113.7'})
+        assert response.status_code == 200
+    assert seen == ['127.0.0.1', '203.0.113.7']
+
+def test_metrics_need_system_access_or_scrape_token(client, admin, madares, monkeypatch):
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers=token(client, 'fatima.a')).status_code == 403
+    assert client.get('/metrics', headers=admin).status_code == 200
+    scraper = {'Authorization': 'Bearer scrape-secret'}
+    assert client.get('/metrics', headers=scraper).status_code == 401
+    monkeypatch.setattr(madares, 'METRICS_TOKEN', 'scrape-secret')
+    assert client.get('/metrics', headers=scraper).status_code == 200
+    assert client.get('/api/cache/stats', headers=scraper).status_code == 401
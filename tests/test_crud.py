@@ -0,0 +1,132 @@
+def test_asset_crud(client, admin):
+    created = client.post('/api/assets', headers=admin, json={
+        'asset_name': 'مبنى الاختبار', 'asset_type': 'تجاري', 'region': 'الرياض', 'city': 'الرياض', 'current_value': 1000000
+    })
+    assert created.status_code == 200, created.json
+    asset_id = created.json['id']
+
+    asset = client.get('/api/assets/%d' % asset_id, headers=admin).json
+    assert asset['asset_name'] == 'مبنى الاختبار'
+    assert asset['asset_type'] == 'تجاري'
+    assert asset_id in [row['id'] for row in client.get('/api/assets', headers=admin).json]
+
+    updated = client.patch('/api/assets/%d' % asset_id, headers=admin, json={'current_value': 2000000, 'city': ''})
+    assert updated.status_code == 200, updated.json
+    assert updated.json['changed'] == ['city', 'current_value']
+    asset = client.get('/api/assets/%d' % asset_id, headers=admin).json
+    assert asset['current_value'] == 2000000
+    assert asset['city'] is None
+
+    assert client.delete('/api/assets/%d' % asset_id, headers=admin).status_code == 200
+    assert client.get('/api/assets/%d' % asset_id, headers=admin).status_code == 404
+    assert asset_id not in [row['id'] for row in client.get('/api/assets', headers=admin).json]
+    assert client.delete('/api/assets/%d' % asset_id, headers=admin).status_code == 404
+
+def test_asset_rejects_unknown_fields(client, admin):
+    response = client.post('/api/assets', headers=admin, json={'asset_name': 'x', 'asset_type': 'تجاري', 'colour': 'blue'})
+    assert response.status_code == 400
+
+def test_workflow_crud(client, admin):
+    asset_id = client.post('/api/assets', headers=admin, json={'asset_name': 'أصل المهام', 'asset_type': 'سكني'}).json['id']
+    created = client.post('/api/workflows', headers=admin, json={
+        'title': 'مراجعة العقد', 'priority': 'عالية', 'asset_id': asset_id
+    })
+    assert created.status_code == 200, created.json
+    workflow_id = created.json['id']
+    assert created.json['due_date']
+
+    workflow = client.get('/api/workflows/%d' % workflow_id, headers=admin).json
+    assert workflow['title'] == 'مراجعة العقد'
+    assert workflow['asset_id'] == asset_id
+    assert workflow_id in [row['id'] for row in client.get('/api/workflows', headers=admin).json]
+
+    assert client.delete('/api/workflows/%d' % workflow_id, headers=admin).status_code == 200
+    assert client.get('/api/workflows/%d' % workflow_id, headers=admin).status_code == 404
+
+def test_new_workflows_start_pending(client, admin):
+    created = client.post('/api/workflows', headers=admin, json={'title': 'مكتملة مسبقا', 'status': 'مكتملة'})
+    assert created.status_code == 200, created.json
+    assert client.get('/api/workflows/%d' % created.json['id'], headers=admin).json['status'] == 'معلقة'
+
+    bulk = client.post('/api/workflows/bulk', headers=admin, json={'workflows': [{'title': 'ملغاة مسبقا', 'status': 'ملغاة'}]})
+    assert bulk.status_code == 200, bulk.json
+    workflow_id = bulk.json['results'][0]['id']
+    assert client.get('/api/workflows/%d' % workflow_id, headers=admin).json['status'] == 'معلقة'
+
+def test_user_crud(client, admin):
+    created = client.post('/api/users', headers=admin, json={
+        'username': 'test.user', 'password': 'secret-password', 'full_name': 'مستخدم الاختبار',
+        'email': 'test@madares.sa', 'role': 'محلل أصول', 'department': 'إدارة الأصول', 'region': 'جدة'
+    })
+    assert created.status_code == 200, created.json
+    user_id = created.json['id']
+
+    user = client.get('/api/users/%d' % user_id, headers=admin).json
+    assert user['username'] == 'test.user'
+    assert 'password' not in user
+    token = client.post('/api/auth/token', json={'username': 'test.user', 'password': 'secret-password'})
+    assert token.status_code == 200
+
+    assert client.delete('/api/users/%d' % user_id, headers=admin).status_code == 200
+    assert client.get('/api/users/%d' % user_id, headers=admin).status_code == 404
+    assert client.post('/api/auth/token', json={'username': 'test.user', 'password': 'secret-password'}).status_code == 401
+
+def test_etag_depends_on_the_query(client, admin):
+    asset_id = client.post('/api/assets', headers=admin, json={'asset_name': 'أصل الوسم', 'asset_type': 'تجاري'}).json['id']
+    arabic = client.get('/api/assets/%d' % asset_id, headers=admin)
+    english = client.get('/api/assets/%d?lang=en' % asset_id, headers=admin)
+    assert arabic.headers['ETag'] != english.headers['ETag']
+    assert english.json['asset_type'] != arabic.json['asset_type']
+
+    revalidated = client.get('/api/assets/%d?lang=en' % asset_id, headers=dict(admin, **{'If-None-Match': english.headers['ETag']}))
+    assert revalidated.status_code == 304
+    other = client.get('/api/assets/%d' % asset_id, headers=dict(admin, **{'If-None-Match': english.headers['ETag']}))
+    assert other.status_code == 200
+
+def test_unknown_lookup_labels_are_rejected(client, admin, madares):
+    def lookup_count():
+        conn = madares.get_db()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM lookups').fetchone()[0]
+        finally:
+            conn.close()
+    before = lookup_count()
+    assert client.post('/api/assets', headers=admin, json={'asset_name': 'x', 'asset_type': 'random-type-xyz'}).status_code == 400
+    assert client.post('/api/workflows', headers=admin, json={'title': 'x', 'priority': 'غريبة جدا'}).status_code == 400
+    assert client.post('/api/users', headers=admin, json={'username': 'x', 'role': 'ملك'}).status_code == 400
+    bulk = client.post('/api/workflows/bulk', headers=admin, json={'workflows': [{'title': 'x', 'priority': 'غريبة'}]})
+    assert bulk.json['results'][0]['success'] is False
+    assert lookup_count() == before
+
+    # English labels name the same values
+    created = client.post('/api/workflows', headers=admin, json={'title': 'بالإنجليزية', 'priority': 'High'})
+    assert created.status_code == 200, created.json
+    assert client.get('/api/workflows/%d' % created.json['id'], headers=admin).json['priority'] == 'عالية'
+
+def test_deadline_scheduler_counts_changed_rows(madares, client, admin):
+    created = client.post('/api/workflows', headers=admin, json={'title': 'متأخرة', 'due_date': '2020-01-01'})
+    assert created.status_code == 200, created.json
+    workflow_id = created.json['id']
+    scheduler = madares.DeadlineScheduler()
+    today = madares.date(2020, 1, 2)
+    conn = madares.get_db()
+    try:
+        assert scheduler.fire(conn, 'overdue', [workflow_id], today) == 1
+        # Already flagged, e.g. by another worker: nothing changes, nothing is counted
+        assert scheduler.fire(conn, 'overdue', [workflow_id], today) == 0
+    finally:
+        conn.close()
+    assert scheduler.fired['overdue'] == 1
+
+def test_one_scheduler_tick_at_a_time(madares):
+    first, second = madares.get_db(), madares.get_db()
+    try:
+        with madares.scheduler_turn(first) as turn:
+            assert turn
+            with madares.scheduler_turn(second) as other:
+                assert not other
+        with madares.scheduler_turn(second) as turn:
+            assert turn
+    finally:
+        first.close()
+        second.close()
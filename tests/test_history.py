@@ -0,0 +1,30 @@
+import time
+
+def test_asset_history(client, admin):
+    asset_id = client.post('/api/assets', headers=admin, json={
+        'asset_name': 'أصل التاريخ', 'asset_type': 'تجاري', 'current_value': 100
+    }).json['id']
+    client.patch('/api/assets/%d' % asset_id, headers=admin, json={'current_value': 200})
+    client.patch('/api/assets/%d' % asset_id, headers=admin, json={'asset_name': 'أصل التاريخ المعدل'})
+    client.delete('/api/assets/%d' % asset_id, headers=admin)
+
+    history = client.get('/api/assets/%d/history' % asset_id, headers=admin).json
+    assert [entry['version'] for entry in history] == [1, 2, 3, 4]
+    assert [entry['operation'] for entry in history] == ['insert', 'update', 'update', 'delete']
+    # Updates keep only the fields that changed
+    assert history[1]['changes'] == {'current_value': 200}
+    assert history[2]['changes'] == {'asset_name': 'أصل التاريخ المعدل'}
+
+def test_asset_as_of(client, admin):
+    asset_id = client.post('/api/assets', headers=admin, json={'asset_name': 'قبل', 'asset_type': 'تجاري'}).json['id']
+    history = client.get('/api/assets/%d/history' % asset_id, headers=admin).json
+    created_at = history[0]['changed_at']
+    # changed_at has one second resolution
+    time.sleep(1.1)
+    client.patch('/api/assets/%d' % asset_id, headers=admin, json={'asset_name': 'بعد'})
+
+    before = client.get('/api/assets/%d' % asset_id, headers=admin, query_string={'as_of': created_at})
+    assert before.status_code == 200, before.json
+    assert before.json['asset_name'] == 'قبل'
+    assert client.get('/api/assets/%d' % asset_id, headers=admin).json['asset_name'] == 'بعد'
+    assert client.get('/api/assets/%d' % asset_id, headers=admin, query_string={'as_of': '2000-01-01'}).status_code == 404
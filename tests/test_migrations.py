@@ -0,0 +1,35 @@
+from conftest import LEGACY_PASSWORD
+from migrate import list_migrations, migrate_db, pending_migrations, schema_version
+
+def test_migrations_apply_one_by_one(database, madares):
+    conn = madares.get_db()
+    try:
+        expected = [version for version, name in list_migrations(dialect=conn.dialect)]
+        assert database['versions'] == expected
+        assert schema_version(conn) == expected[-1]
+        assert pending_migrations(conn) == []
+        # Nothing left to do, a second run only reads the version
+        assert migrate_db(conn) == expected[-1]
+    finally:
+        conn.close()
+
+def test_data_migrations_convert_legacy_rows(client):
+    # 0003 turned the role into a lookup id, 0009 hashed the plaintext password
+    response = client.post('/api/auth/token', json={'username': 'legacy', 'password': LEGACY_PASSWORD})
+    assert response.status_code == 200, response.json
+    headers = {'Authorization': 'Bearer ' + response.json['token']}
+    me = client.get('/api/auth/me', headers=headers).json
+    assert me['username'] == 'legacy'
+
+    assets = client.get('/api/assets', headers=headers).json
+    legacy = [asset for asset in assets if asset['asset_name'] == 'أصل قديم']
+    assert len(legacy) == 1
+    assert legacy[0]['asset_type'] == 'تجاري'
+
+def test_passwords_are_not_stored_in_plaintext(madares):
+    conn = madares.get_db()
+    try:
+        passwords = [row[0] for row in conn.execute('SELECT password FROM users').fetchall()]
+    finally:
+        conn.close()
+    assert passwords and all(password.startswith('scrypt$') for password in passwords)
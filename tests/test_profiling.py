@@ -0,0 +1,22 @@
+import os
+import pstats
+
+def test_profile_covers_streamed_body(client, admin, madares, monkeypatch):
+    # Not answered from the response cache
+    monkeypatch.setattr(madares, 'CACHE_ENABLED', False)
+    response = client.get('/api/assets', headers=dict(admin, **{'X-Madares-Profile': '1'}))
+    assert response.status_code == 200
+    profile_id = response.headers['X-Madares-Profile-Id']
+    assert response.json
+    response.close()
+
+    stats = pstats.Stats(os.path.join(madares.PROFILE_DIR, profile_id + '.pstats'))
+    functions = {name for filename, line, name in stats.stats}
+    # Rows are fetched and encoded while the body is sent, after teardown
+    assert 'generate' in functions
+    assert any('fetchmany' in name for name in functions)
+
+def test_profiling_needs_system_access(client):
+    legal = client.post('/api/auth/token', json={'username': 'fatima.a', 'password': 'password123'}).json['token']
+    response = client.get('/api/assets', headers={'Authorization': 'Bearer ' + legal, 'X-Madares-Profile': '1'})
+    assert 'X-Madares-Profile-Id' not in response.headers
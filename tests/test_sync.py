@@ -0,0 +1,51 @@
+def sync(client, headers, since=0, tables='assets'):
+    response = client.get('/api/sync', headers=headers, query_string={'since': since, 'tables': tables})
+    assert response.status_code == 200, response.json
+    return response.json
+
+def test_full_sync(client, admin):
+    result = sync(client, admin, tables='assets,workflows,users,documents')
+    assert result['full'] is True
+    assert set(result['changes']) == {'assets', 'workflows', 'users', 'documents'}
+    assert result['changes']['assets']['inserted']
+    assert all('password' not in user for user in result['changes']['users']['inserted'])
+
+def test_delta_sync(client, admin):
+    kept = client.post('/api/assets', headers=admin, json={'asset_name': 'باق', 'asset_type': 'تجاري'}).json['id']
+    removed = client.post('/api/assets', headers=admin, json={'asset_name': 'محذوف', 'asset_type': 'تجاري'}).json['id']
+    token = sync(client, admin)['token']
+
+    added = client.post('/api/assets', headers=admin, json={'asset_name': 'جديد', 'asset_type': 'تجاري'}).json['id']
+    client.patch('/api/assets/%d' % kept, headers=admin, json={'asset_name': 'باق ومعدل'})
+    client.delete('/api/assets/%d' % removed, headers=admin)
+
+    result = sync(client, admin, since=token)
+    assert result['full'] is False
+    assert result['token'] > token
+    changes = result['changes']['assets']
+    assert [row['id'] for row in changes['inserted']] == [added]
+    assert [(row['id'], row['asset_name']) for row in changes['updated']] == [(kept, 'باق ومعدل')]
+    assert changes['deleted'] == [removed]
+
+    # Nothing changed since the new token
+    assert sync(client, admin, since=result['token'])['changes']['assets'] == {'inserted': [], 'updated': [], 'deleted': []}
+
+def test_unknown_token_gets_full_sync(client, admin):
+    token = sync(client, admin)['token']
+    assert sync(client, admin, since=token + 1000)['full'] is True
+
+def test_statements_log_every_changed_row(client, admin, madares):
+    ids = [client.post('/api/assets', headers=admin, json={'asset_name': 'دفعة', 'asset_type': 'تجاري'}).json['id']
+           for _ in range(3)]
+    conn = madares.get_db()
+    try:
+        last = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+        conn.execute(f"UPDATE assets SET city = ? WHERE id IN ({', '.join('?' * len(ids))})", ['جدة'] + ids)
+        conn.execute('UPDATE assets SET city = ? WHERE id = ?', ('جدة', -1))
+        conn.execute('DELETE FROM assets WHERE id = ?', (ids[0],))
+        conn.commit()
+        logged = conn.execute('SELECT row_id, operation FROM change_log WHERE seq > ? AND table_name = ? ORDER BY seq',
+                              (last, 'assets')).fetchall()
+    finally:
+        conn.close()
+    assert [tuple(row) for row in logged] == [(ids[0], 'update'), (ids[1], 'update'), (ids[2], 'update'), (ids[0], 'delete')]
@@ -0,0 +1,18 @@
+# Production entry point
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# or simply `python wsgi.py`, which starts gunicorn with the same config.
+import os
+import sys
+
+from app import app
+
+application = app
+
+if __name__ == '__main__':
+    from gunicorn.app.wsgiapp import run
+
+    config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+    sys.argv = ['gunicorn', '-c', config, 'wsgi:app'] + sys.argv[1:]
+    run()